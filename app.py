@@ -1,10 +1,33 @@
 import os
-from flask import Flask, render_template, send_from_directory, request, jsonify
+import atexit
+import base64
+import bisect
+import hashlib
+import heapq
+import logging
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import Flask, Response, render_template, send_from_directory, send_file, request, jsonify, abort, g
+from PIL import Image
 import json
 from collections import defaultdict
+from metrics import MetricsRegistry
+from lead_sink import confidence_rank
+from geo_index import GeoIndex
+try:
+    import fcntl # Cross-process file locking for the JSON backend (POSIX only)
+except ImportError:
+    fcntl = None
 
 app = Flask(__name__, template_folder="templates")
 
+# Per-request messages are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format="%(asctime)s %(levelname)-7s %(message)s")
+logger = logging.getLogger(__name__)
+
 # --- Path Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -28,6 +51,62 @@ INITIAL_JSON_FILE = os.path.join(BASE_DIR, 'leads_with_awnings.json') # Assumes
 os.makedirs(DISK_MOUNT_PATH, exist_ok=True)
 # --- End Path Configuration ---
 
+# --- Image Renditions ---
+# /images/<file>?size=<name> serves a resized copy of a saved image. Renditions
+# are generated once with Pillow and cached under RENDITIONS_DIR, keyed by the
+# source file's SHA-256 and the target width, so replacing a source image never
+# serves a stale rendition. Widths are configurable, e.g. "thumb=320,medium=640".
+RENDITIONS_DIR = os.path.join(DISK_MOUNT_PATH, 'renditions')
+RENDITION_WIDTHS = dict(
+    (name.strip(), int(width))
+    for name, width in (item.split('=') for item in os.environ.get('RENDITION_WIDTHS', 'thumb=320,medium=640').split(','))
+)
+RENDITION_QUALITY = 80
+IMAGE_CACHE_MAX_AGE = 86400 # Seconds browsers may reuse an image before revalidating with its ETag
+
+# Lead storage backend: 'json' (JSON_FILE_ON_DISK) or 'sqlite' (LEADS_DB_PATH).
+# Use 'sqlite' when running several gunicorn workers/threads.
+LEADS_BACKEND = os.environ.get('LEADS_BACKEND', 'json')
+LEADS_DB_PATH = os.path.join(DISK_MOUNT_PATH, 'leads.sqlite3')
+
+# JSON backend: edits are applied in memory and written to disk at most this often (write-behind)
+LEADS_FLUSH_DELAY_SECONDS = float(os.environ.get('LEADS_FLUSH_DELAY_SECONDS', '2'))
+
+# CRM fields the browser may edit, and the statuses a lead may be given (the page's status menu)
+EDITABLE_FIELDS = ('status', 'notes', 'follow_up')
+LEAD_STATUSES = ('New', 'Contacted', 'Qualified', 'Closed - Won', 'Closed - Lost')
+
+# /api/leads page sizes
+API_PAGE_SIZE = 24
+API_MAX_PAGE_SIZE = 100
+LEAD_SORT_ORDERS = ('file', 'confidence') # ?sort= values of /api/leads
+
+# Spatial lead index (see geo_index.py), for /api/leads/near, /within and /route
+GEO_CELL_DEGREES = 0.01 # Grid cell side, about 1 km
+
+# --- Metrics ---
+# Served at /metrics in the Prometheus text format. Every gunicorn worker keeps
+# its own registry, so a scrape reports the worker that answered it.
+app_metrics = MetricsRegistry()
+REQUEST_SECONDS = app_metrics.histogram(
+    'crm_request_seconds', "Request latency by route, method and status", ('route', 'method', 'status')
+)
+STORAGE_SECONDS = app_metrics.histogram(
+    'crm_storage_seconds',
+    "Time spent in the lead storage backend: full loads, per-request change checks and saves",
+    ('backend', 'operation'),
+)
+
+
+# Add default CRM fields if they are missing (good practice)
+def apply_crm_defaults(leads):
+    for lead in leads:
+        lead.setdefault('status', 'New')
+        lead.setdefault('notes', '')
+        lead.setdefault('follow_up', False)
+        lead.setdefault('version', 1) # Bumped on every edit; exposed as the lead's ETag
+    return leads
+
 
 # Function to load leads from the JSON file on the persistent disk
 def load_leads():
@@ -35,39 +114,34 @@ def load_leads():
     
     # If the file doesn't exist on the disk yet, try to copy it from the initial bundled file
     if not os.path.exists(target_path):
-        print(f"JSON file not found on disk at {target_path}. Attempting to initialize from {INITIAL_JSON_FILE}...")
+        logger.info("JSON file not found on disk at %s. Attempting to initialize from %s...", target_path, INITIAL_JSON_FILE)
         if os.path.exists(INITIAL_JSON_FILE):
             try:
                 with open(INITIAL_JSON_FILE, 'r', encoding='utf-8') as f_initial:
                     initial_leads = json.load(f_initial)
                 if save_leads(initial_leads): # Try saving the initial data to the disk path
-                     print(f"Successfully initialized JSON file on disk at {target_path}.")
-                     return initial_leads # Return the loaded initial leads
+                     logger.info("Successfully initialized JSON file on disk at %s.", target_path)
+                     return apply_crm_defaults(initial_leads) # Return the loaded initial leads
                 else:
-                    print(f"Failed to write initial JSON file to disk at {target_path}.")
+                    logger.error("Failed to write initial JSON file to disk at %s.", target_path)
                     return [] # Failed to initialize
             except Exception as e:
-                 print(f"Error reading or writing initial JSON file {INITIAL_JSON_FILE}: {e}")
+                 logger.error("Error reading or writing initial JSON file %s: %s", INITIAL_JSON_FILE, e)
                  return [] # Error during initialization
         else:
-            print(f"Initial JSON file {INITIAL_JSON_FILE} not found. Cannot initialize disk file.")
+            logger.warning("Initial JSON file %s not found. Cannot initialize disk file.", INITIAL_JSON_FILE)
             return [] # Cannot initialize
 
     # If the file exists on disk, load from there
     try:
         with open(target_path, 'r', encoding='utf-8') as f:
             leads = json.load(f)
-            # Add default CRM fields if they are missing (good practice)
-            for lead in leads:
-                lead.setdefault('status', 'New')
-                lead.setdefault('notes', '')
-                lead.setdefault('follow_up', False)
-            return leads
+            return apply_crm_defaults(leads)
     except json.JSONDecodeError:
-        print(f"Error decoding JSON from {target_path}. Returning empty list.")
+        logger.error("Error decoding JSON from %s. Returning empty list.", target_path)
         return []
     except Exception as e:
-        print(f"An error occurred while loading leads from {target_path}: {e}")
+        logger.error("An error occurred while loading leads from %s: %s", target_path, e)
         return []
 
 # Function to save leads back to the JSON file on the persistent disk
@@ -79,10 +153,10 @@ def save_leads(leads):
         with open(temp_path, 'w', encoding='utf-8') as f:
             json.dump(leads, f, indent=2)
         os.replace(temp_path, target_path) # Atomic replace
-        print(f"Successfully saved leads to {target_path}")
+        logger.debug("Successfully saved leads to %s", target_path)
         return True
     except Exception as e:
-        print(f"An error occurred while saving leads to {target_path}: {e}")
+        logger.error("An error occurred while saving leads to %s: %s", target_path, e)
         # Clean up temp file if rename failed
         if os.path.exists(temp_path):
             try:
@@ -91,35 +165,1160 @@ def save_leads(leads):
                 pass
         return False
 
+# --- Lead Storage Backends ---
+# LEADS_BACKEND selects where CRM edits are persisted:
+#   json   - JSON_FILE_ON_DISK plus an edit journal next to it. Each edit is
+#            appended to the journal under an exclusive file lock, after the
+#            worker has replayed the entries other workers appended and checked
+#            the lead's version against them, so a stale edit is refused
+#            instead of overwriting a newer one. A write-behind flush folds the
+#            journal into the JSON file (a burst of edits costs one rewrite).
+#   sqlite - LEADS_DB_PATH in WAL mode. Every edit is a row-level UPDATE keyed
+#            by place_id and conditioned on the lead's version, committed before
+#            the request returns. Workers pick up each other's edits through a
+#            change sequence, re-reading only the rows that changed.
+
+class LeadConflict(Exception):
+    """An edit targeted a lead that no longer exists or was changed by another worker."""
+    def __init__(self, place_id, reason):
+        super().__init__(f"{place_id}: {reason}")
+        self.place_id = place_id
+        self.reason = reason
+
+
+def apply_ops_to_leads(leads, ops):
+    """
+    Replays edit operations onto a freshly loaded list of leads. An op whose
+    lead is gone or no longer at the op's expected_version (e.g. one already
+    folded into the file) is skipped.
+
+    Returns:
+        (leads, number of ops skipped)
+    """
+    by_id = {lead.get('place_id'): lead for lead in leads}
+    deleted = set()
+    skipped = 0
+    for op in ops:
+        lead = by_id.get(op['place_id'])
+        if lead is None or lead.get('version', 1) != op['expected_version']:
+            skipped += 1
+            continue
+        if op['op'] == 'update':
+            lead.update(op['fields'])
+            lead['version'] = lead.get('version', 1) + 1
+        elif op['op'] == 'delete':
+            deleted.add(op['place_id'])
+            del by_id[op['place_id']]
+    return [lead for lead in leads if lead.get('place_id') not in deleted], skipped
+
+
+class JsonFileBackend:
+    """
+    The JSON file and its edit journal. Methods ending in _locked expect the
+    caller to hold locked(); the change token is (file stat, journal bytes read).
+    """
+    name = 'json'
+    write_behind = True
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.journal_path = path + '.journal'
+
+    def file_token(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except OSError:
+            return 0
+
+    def change_token(self):
+        return (self.file_token(), self.journal_size())
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock shared by every process using the file (not re-entrant)."""
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        with self.locked():
+            return self.load_locked()
+
+    def load_locked(self):
+        leads = load_leads()
+        ops, offset = self.read_journal_locked(0)
+        leads, skipped = apply_ops_to_leads(leads, ops)
+        if skipped:
+            logger.info("Skipped %d journal entries already in %s.", skipped, self.path)
+        return leads, (self.file_token(), offset)
+
+    def read_journal_locked(self, offset):
+        """Returns (ops appended after byte offset, the offset after them)."""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = data.rfind(b'\n') + 1 # A line cut short by a crash mid-append is ignored
+        return [json.loads(line) for line in data[:end].splitlines() if line.strip()], offset + end
+
+    def append_locked(self, ops):
+        """Appends ops to the journal and returns its new size."""
+        with open(self.journal_path, 'ab') as f:
+            f.write(''.join(json.dumps(op) + '\n' for op in ops).encode('utf-8'))
+            return f.tell()
+
+    def compact_locked(self, leads):
+        """
+        Saves leads (which include every journal entry) and empties the journal.
+        Returns the new change token, or None if the save failed.
+        """
+        if not save_leads(leads):
+            return None
+        # A crash before this truncation only leaves entries that replay skips
+        open(self.journal_path, 'wb').close()
+        return (self.file_token(), 0)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    place_id TEXT PRIMARY KEY,
+    city TEXT,
+    position INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    seq INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leads_seq ON leads(seq);
+CREATE TABLE IF NOT EXISTS deleted_leads (
+    place_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', 0);
+"""
+
+class SqliteBackend:
+    name = 'sqlite'
+    write_behind = False
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local() # One connection per worker thread
+        conn = self._conn()
+        conn.executescript(SQLITE_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None) # Transactions are explicit below
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_lead(data, version):
+        lead = json.loads(data)
+        lead['version'] = version
+        return lead
+
+    def change_token(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+
+    def load(self):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            token = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+            rows = conn.execute("SELECT data, version FROM leads ORDER BY position").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        if not rows and token == 0:
+            # Fresh database: migrate the existing JSON leads into it
+            if migrate_json_to_sqlite(self):
+                return self.load()
+        return [self._row_to_lead(data, version) for data, version in rows], token
+
+    def changes_since(self, token):
+        """Returns (changed leads, deleted place_ids, new token), or None if nothing changed."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            current = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+            if current == token:
+                return None
+            updated = [
+                self._row_to_lead(data, version) for data, version in
+                conn.execute("SELECT data, version FROM leads WHERE seq > ? ORDER BY position", (token,))
+            ]
+            deleted = [row[0] for row in conn.execute("SELECT place_id FROM deleted_leads WHERE seq > ?", (token,))]
+        finally:
+            conn.execute("COMMIT")
+        return updated, deleted, current
+
+    def commit(self, ops):
+        """
+        Applies edit operations in one transaction. Each op must carry the
+        version the caller saw; a missing or stale row raises LeadConflict and
+        nothing is written.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'seq'")
+            seq = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+            for op in ops:
+                row = conn.execute("SELECT data, version FROM leads WHERE place_id = ?", (op['place_id'],)).fetchone()
+                if row is None:
+                    raise LeadConflict(op['place_id'], 'not found')
+                if row[1] != op['expected_version']:
+                    raise LeadConflict(op['place_id'], 'stale version')
+                if op['op'] == 'update':
+                    data = json.loads(row[0])
+                    data.update(op['fields'])
+                    data['version'] = row[1] + 1
+                    conn.execute(
+                        "UPDATE leads SET data = ?, version = version + 1, seq = ? WHERE place_id = ?",
+                        (json.dumps(data), seq, op['place_id']),
+                    )
+                elif op['op'] == 'delete':
+                    conn.execute("DELETE FROM leads WHERE place_id = ?", (op['place_id'],))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO deleted_leads (place_id, seq) VALUES (?, ?)", (op['place_id'], seq)
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def import_leads(self, leads):
+        """Inserts leads into an empty database. Returns the number imported (0 if not empty)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM leads LIMIT 1").fetchone():
+                conn.execute("ROLLBACK")
+                return 0
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'seq'")
+            seq = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO leads (place_id, city, position, version, seq, data) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (lead.get('place_id'), lead.get('city', 'Unknown City'), position, lead.get('version', 1), seq, json.dumps(lead))
+                    for position, lead in enumerate(leads)
+                ],
+            )
+            conn.execute("COMMIT")
+            return len(leads)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def migrate_json_to_sqlite(backend):
+    """
+    Copies leads into an empty SQLite store: from JSON_FILE_ON_DISK (which has
+    the CRM edits) if present, otherwise from the bundled leads_with_awnings.json.
+    """
+    leads = load_leads() # Initializes JSON_FILE_ON_DISK from INITIAL_JSON_FILE if needed
+    imported = backend.import_leads(leads)
+    if imported:
+        logger.info("Migrated %d leads from %s into %s", imported, JSON_FILE_ON_DISK, backend.path)
+    return imported
+
+
+def create_lead_backend(name):
+    if name == 'sqlite':
+        return SqliteBackend(LEADS_DB_PATH)
+    if name != 'json':
+        logger.warning("Unknown LEADS_BACKEND '%s'; using the JSON file backend.", name)
+    return JsonFileBackend(JSON_FILE_ON_DISK)
+
+
+# --- In-Memory Lead Repository ---
+# Leads are loaded once per process and kept in memory with city and place_id
+# indexes. Each request only checks the backend's change token (file mtime or
+# SQLite change sequence) and reloads when another process changed the data.
+# With the JSON backend, an edit is appended to the journal (see above) and a
+# timer folds the journal into the file once, so a burst of edits costs a
+# single save. With SQLite each edit is committed immediately as a row update.
+#
+# Listing queries (/api/leads) are served from the same memory: besides the
+# city index, leads are indexed by status and follow-up flag, and each lead's
+# lowercased name/address/phone/notes is kept for text search. Every index
+# list is in file order, so a page is a slice starting after the cursor's
+# position in the smallest index that applies. Leads are also kept ranked by
+# the crawler's classifier confidence (?sort=confidence), for working through
+# the most convincing leads first, and located ones in a spatial grid index
+# for proximity and bounding-box queries and follow-up routes.
+class LeadRepository:
+    def __init__(self, backend, flush_delay):
+        self.backend = backend
+        self.flush_delay = flush_delay
+        self.lock = threading.RLock()
+        self.leads = []
+        self.by_id = {} # place_id -> lead
+        self.by_city = {} # city -> leads in file order (the index used by the page)
+        self.by_status = {} # status -> leads in file order
+        self.follow_ups = [] # leads flagged for follow-up, in file order
+        self.search_text = {} # place_id -> lowercased text matched by ?q=
+        self.order = {} # place_id -> position in file order (what cursors refer to)
+        self.ranked = [] # all leads, most confident first, ties in file order
+        self.geo = GeoIndex(GEO_CELL_DEGREES) # leads with a lat/lng, keyed by id(lead)
+        self.token = None # Backend change token of the data in memory; None = not loaded
+        self.pending_edits = 0 # Edits journaled by this process and not yet folded into the file (JSON only)
+        self.dirty = False
+        self.flush_timer = None
+
+    def _rebuild_indexes(self):
+        by_city = defaultdict(list)
+        for lead in self.leads:
+            by_city[lead.get('city', 'Unknown City')].append(lead)
+        self.by_city = dict(by_city)
+        self.by_id = {lead.get('place_id'): lead for lead in self.leads}
+        self.order = {lead.get('place_id'): position for position, lead in enumerate(self.leads)}
+        self.by_status = {}
+        self.follow_ups = []
+        self.ranked = []
+        self.geo = GeoIndex(GEO_CELL_DEGREES)
+        self.search_text = {}
+        for lead in self.leads:
+            self._index_filters(lead)
+
+    def _order_key(self, lead):
+        return self.order.get(lead.get('place_id'), -1)
+
+    def _rank_key(self, lead):
+        """Position in the confidence ranking: a sortable list, so it can be put in a cursor."""
+        return [-score for score in confidence_rank(lead.get('confidence'))] + [self._order_key(lead)]
+
+    def _index_filters(self, lead):
+        """Adds a lead to the status/follow-up/text indexes, keeping file order, and to the ranking."""
+        status_leads = self.by_status.setdefault(lead.get('status', 'New'), [])
+        bisect.insort(status_leads, lead, key=self._order_key)
+        if lead.get('follow_up'):
+            bisect.insort(self.follow_ups, lead, key=self._order_key)
+        bisect.insort(self.ranked, lead, key=self._rank_key)
+        location = lead_location(lead)
+        if location is not None:
+            self.geo.add(id(lead), *location, lead)
+        self.search_text[lead.get('place_id')] = ' '.join(
+            str(lead.get(field) or '') for field in ('name', 'address', 'phone', 'notes')
+        ).lower()
+
+    def _remove_ordered(self, items, lead, key=None):
+        """Removes a lead from an index list kept in `key` order (file order by default), locating it by bisection."""
+        key = key or self._order_key
+        index = bisect.bisect_left(items, key(lead), key=key)
+        while index < len(items) and key(items[index]) == key(lead):
+            if items[index] is lead:
+                del items[index]
+                return
+            index += 1
+        _remove_by_identity(items, lead) # Out of order (e.g. a duplicate place_id); fall back to a scan
+
+    def _unindex_filters(self, lead):
+        status = lead.get('status', 'New')
+        self._remove_ordered(self.by_status.get(status, []), lead)
+        if status in self.by_status and not self.by_status[status]:
+            del self.by_status[status]
+        if lead.get('follow_up'):
+            self._remove_ordered(self.follow_ups, lead)
+        self._remove_ordered(self.ranked, lead, key=self._rank_key)
+        self.geo.remove(id(lead))
+        self.search_text.pop(lead.get('place_id'), None)
+
+    def _timed(self, operation):
+        return STORAGE_SECONDS.time(backend=self.backend.name, operation=operation)
+
+    def _reload(self):
+        with self._timed('load'):
+            self.leads, self.token = self.backend.load()
+        self._rebuild_indexes()
+
+    def _ensure_fresh(self):
+        """Brings memory up to date with changes made by other processes."""
+        if self.token is None:
+            self._reload()
+        elif self.backend.write_behind:
+            with self._timed('check'):
+                changed = self.backend.change_token() != self.token
+            if changed:
+                with self.backend.locked():
+                    self._catch_up_locked()
+        else:
+            with self._timed('check'):
+                changes = self.backend.changes_since(self.token)
+            if changes is not None:
+                self._apply_changes(*changes)
+
+    def _catch_up_locked(self):
+        """
+        JSON backend, file lock held: replays the journal entries other
+        processes appended since we last read it, or reloads everything if the
+        file itself was rewritten.
+        """
+        file_token, offset = self.token
+        if self.backend.file_token() != file_token or self.backend.journal_size() < offset:
+            self._reload_locked()
+            return
+        ops, offset = self.backend.read_journal_locked(offset)
+        for op in ops:
+            lead = self.by_id.get(op['place_id'])
+            if lead is None or lead.get('version', 1) != op['expected_version']:
+                logger.warning("Skipping journaled %s of %s: the lead is gone or at another version.", op['op'], op['place_id'])
+                continue
+            if op['op'] == 'delete':
+                self._forget(lead)
+                continue
+            self._unindex_filters(lead)
+            lead.update(op['fields'])
+            lead['version'] = lead.get('version', 1) + 1
+            self._index_filters(lead)
+        self.token = (file_token, offset)
+
+    @contextmanager
+    def _writing(self, leads):
+        """
+        Holds what a write needs and yields the current copy of each lead. With
+        the JSON backend that is the file lock, after catching up with other
+        processes; a lead deleted or edited since the caller read it raises
+        LeadConflict. SQLite checks versions itself when committing.
+        """
+        if not self.backend.write_behind:
+            yield leads
+            return
+        expected = [(lead.get('place_id'), lead.get('version', 1)) for lead in leads]
+        with self.backend.locked():
+            if self.token is None or self.backend.change_token() != self.token:
+                if self.token is None:
+                    self._reload_locked()
+                else:
+                    self._catch_up_locked()
+            current = []
+            for place_id, version in expected:
+                lead = self.by_id.get(place_id)
+                if lead is None:
+                    raise LeadConflict(place_id, 'deleted by another worker')
+                if lead.get('version', 1) != version:
+                    raise LeadConflict(place_id, 'changed by another worker')
+                current.append(lead)
+            yield current
+
+    def _reload_locked(self):
+        with self._timed('load'):
+            self.leads, self.token = self.backend.load_locked()
+        self._rebuild_indexes()
+
+    def _apply_changes(self, updated, deleted_ids, token):
+        added = False
+        for lead in updated:
+            existing = self.by_id.get(lead.get('place_id'))
+            if existing is not None:
+                self._unindex_filters(existing)
+                existing.clear() # Update in place so the city lists stay valid
+                existing.update(lead)
+                self._index_filters(existing)
+            else:
+                self.leads.append(lead)
+                added = True
+        for place_id in deleted_ids:
+            lead = self.by_id.get(place_id)
+            if lead is not None:
+                self._forget(lead)
+        if added:
+            self._rebuild_indexes()
+        self.token = token
+
+    def _forget(self, lead):
+        self._unindex_filters(lead)
+        city = lead.get('city', 'Unknown City')
+        _remove_by_identity(self.leads, lead)
+        _remove_by_identity(self.by_city.get(city, []), lead)
+        if city in self.by_city and not self.by_city[city]:
+            del self.by_city[city]
+        self.by_id.pop(lead.get('place_id'), None)
+
+    def refresh(self):
+        with self.lock:
+            self._ensure_fresh()
+
+    def city_counts(self):
+        """Returns [(city, number of leads)] in file order."""
+        with self.lock:
+            self._ensure_fresh()
+            return [(city, len(city_leads)) for city, city_leads in self.by_city.items()]
+
+    def query(self, city=None, status=None, follow_up=None, text=None, after=None, limit=API_PAGE_SIZE, sort='file'):
+        """
+        Returns (leads, last_position) for one page of leads matching every given
+        filter, starting after position `after`. With sort='confidence', leads
+        come most confident first and positions are rank keys (see _rank_key);
+        otherwise they are file positions. last_position is None when there are
+        no further matches.
+        """
+        with self.lock:
+            self._ensure_fresh()
+            if sort == 'confidence':
+                base, key = self.ranked, self._rank_key
+            else:
+                candidates = [self.leads]
+                if city is not None:
+                    candidates.append(self.by_city.get(city, []))
+                if status is not None:
+                    candidates.append(self.by_status.get(status, []))
+                if follow_up is True:
+                    candidates.append(self.follow_ups)
+                base, key = min(candidates, key=len), self._order_key # Walk the most selective index
+
+            start = 0 if after is None else bisect.bisect_right(base, after, key=key)
+            text = text.lower() if text else None
+            page = []
+            for index in range(start, len(base)): # Not base[start:], which would copy the rest of the index
+                lead = base[index]
+                if city is not None and lead.get('city', 'Unknown City') != city:
+                    continue
+                if status is not None and lead.get('status', 'New') != status:
+                    continue
+                if follow_up is not None and bool(lead.get('follow_up')) != follow_up:
+                    continue
+                if text and text not in self.search_text.get(lead.get('place_id'), ''):
+                    continue
+                if len(page) == limit:
+                    return page, key(page[-1]) # More matches exist
+                page.append(lead)
+            return page, None
+
+    def nearest(self, lat, lng, k, max_meters=None):
+        """Returns up to k [(distance in meters, lead)] closest to (lat, lng), closest first."""
+        with self.lock:
+            self._ensure_fresh()
+            return self.geo.nearest(lat, lng, k, max_meters)
+
+    def within(self, bounds, limit):
+        """
+        Returns (leads, total) for the leads inside bounds (south, west, north,
+        east): the first `limit` of them in file order, and how many there are.
+        """
+        with self.lock:
+            self._ensure_fresh()
+            leads = self.geo.within(bounds)
+            if len(leads) > limit:
+                return heapq.nsmallest(limit, leads, key=self._order_key), len(leads)
+            return sorted(leads, key=self._order_key), len(leads)
+
+    def follow_up_route(self, start=None, city=None):
+        """
+        Orders the leads flagged for follow-up (optionally in one city) into a
+        visiting route: from start (lat, lng), or else the first of them, always
+        on to the nearest lead not yet visited.
+
+        Returns (stops, unlocated): stops is [(meters from the previous stop,
+        lead)]; unlocated are follow-ups without a location, in file order.
+        """
+        with self.lock:
+            self._ensure_fresh()
+            pending = GeoIndex(GEO_CELL_DEGREES) # Follow-ups not yet on the route
+            first = None
+            unlocated = []
+            for lead in self.follow_ups:
+                if city is not None and lead.get('city', 'Unknown City') != city:
+                    continue
+                location = lead_location(lead)
+                if location is None:
+                    unlocated.append(lead)
+                    continue
+                pending.add(id(lead), *location, lead)
+                first = first or lead
+
+            stops = []
+            position = start
+            while len(pending):
+                if position is None:
+                    distance, lead = 0.0, first
+                else:
+                    ((distance, lead),) = pending.nearest(*position, k=1)
+                pending.remove(id(lead))
+                stops.append((distance, lead))
+                position = lead_location(lead)
+            return stops, unlocated
+
+    def position_of(self, place_id, sort='file'):
+        """A lead's current position in the given sort order, or None if it is gone."""
+        with self.lock:
+            if sort == 'confidence':
+                lead = self.by_id.get(place_id)
+                return self._rank_key(lead) if lead is not None else None
+            return self.order.get(place_id)
+
+    def find_in_city(self, city, index_in_city):
+        """Returns the Nth lead of a city (the position shown on the page), or None."""
+        with self.lock:
+            self._ensure_fresh()
+            city_leads = self.by_city.get(city, [])
+            if 0 <= index_in_city < len(city_leads):
+                return city_leads[index_in_city]
+            return None
+
+    def get(self, place_id):
+        with self.lock:
+            self._ensure_fresh()
+            return self.by_id.get(place_id)
+
+    def apply_updates(self, updates):
+        """
+        Applies [(lead, {field: value})] and bumps each lead's version, as one
+        write. Raises LeadConflict (and changes nothing) if a lead is missing
+        or was edited elsewhere since the caller read it.
+
+        The leads are changed and re-indexed before the write is journaled or
+        committed, and put back if either step fails, so a value the indexes
+        cannot take never reaches the backend.
+
+        Returns:
+            The updated leads (another process's edits may have replaced the
+            objects passed in).
+        """
+        with self.lock, self._writing([lead for lead, _ in updates]) as current:
+            updates = [(lead, fields) for lead, (_, fields) in zip(current, updates)]
+            ops = [
+                {'op': 'update', 'place_id': lead.get('place_id'), 'fields': fields, 'expected_version': lead.get('version', 1)}
+                for lead, fields in updates
+            ]
+            applied = [] # (lead, its previous values of the changed fields)
+            try:
+                for lead, fields in updates:
+                    previous = {field: lead[field] for field in (*fields, 'version') if field in lead}
+                    self._unindex_filters(lead)
+                    applied.append((lead, previous, fields))
+                    lead.update(fields)
+                    lead['version'] = lead.get('version', 1) + 1
+                    self._index_filters(lead)
+                self._write(ops)
+            except Exception as e:
+                for lead, previous, fields in reversed(applied):
+                    self._unindex_filters(lead)
+                    for field in (*fields, 'version'):
+                        lead.pop(field, None)
+                    lead.update(previous)
+                    self._index_filters(lead)
+                if isinstance(e, LeadConflict):
+                    self._ensure_fresh() # Show the caller the current state
+                raise
+            return current
+
+    def delete(self, lead):
+        with self.lock, self._writing([lead]) as (lead,):
+            try:
+                self._write([{'op': 'delete', 'place_id': lead.get('place_id'), 'expected_version': lead.get('version', 1)}])
+            except LeadConflict:
+                self._ensure_fresh() # Show the caller the current state
+                raise
+            self._forget(lead)
+
+    def _write(self, ops):
+        """Persists ops: journaled (JSON, inside _writing) or committed (SQLite)."""
+        if self.backend.write_behind:
+            with self._timed('save'):
+                offset = self.backend.append_locked(ops)
+            self.token = (self.token[0], offset) # Our own entries are already in memory
+            self.pending_edits += len(ops)
+            self._schedule_flush()
+            return
+        with self._timed('save'):
+            self.backend.commit(ops)
+
+    def _schedule_flush(self):
+        self.dirty = True
+        if self.flush_timer is None:
+            self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        """
+        Folds the journal into the JSON file (write-behind backends), other
+        processes' entries included. Returns False if the save failed.
+        """
+        with self.lock:
+            self.flush_timer = None
+            if not self.dirty:
+                return True
+            with self.backend.locked():
+                if self.backend.change_token() != self.token:
+                    self._catch_up_locked()
+                token = None
+                if self.backend.journal_size() == 0:
+                    token = self.token # Another process folded it in already
+                else:
+                    with self._timed('save'):
+                        token = self.backend.compact_locked(self.leads)
+            if token is None:
+                self._schedule_flush() # Retry later; the edits are safe in the journal
+                return False
+            self.token = token
+            self.pending_edits = 0
+            self.dirty = False
+            return True
+
+
+def lead_location(lead):
+    """(lat, lng) of a lead, or None for leads saved before the crawler kept locations."""
+    lat, lng = lead.get('lat'), lead.get('lng')
+    if isinstance(lat, (int, float)) and isinstance(lng, (int, float)) and -90 <= lat <= 90 and -180 <= lng <= 180:
+        return lat, lng
+    return None
+
+
+def _remove_by_identity(items, target):
+    # list.remove() compares dicts by value and could drop an identical duplicate
+    for i, item in enumerate(items):
+        if item is target:
+            del items[i]
+            return
+
+
+lead_repository = LeadRepository(create_lead_backend(LEADS_BACKEND), LEADS_FLUSH_DELAY_SECONDS)
+atexit.register(lead_repository.flush) # Don't lose pending edits on worker shutdown
+
+
+def collect_repository_stats():
+    return [
+        ('crm_leads', 'gauge', "Leads held in this worker's memory", [({}, len(lead_repository.leads))]),
+        ('crm_pending_edits', 'gauge', "Edits journaled by this worker and not yet folded into the JSON file", [({}, lead_repository.pending_edits)]),
+    ]
+
+
+app_metrics.register_collector(collect_repository_stats)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The URL rule (e.g. /leads/<place_id>) keeps one series per route, not per lead
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started, route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Request latencies, storage timings and lead counts in the Prometheus text format."""
+    return Response(app_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.cli.command('migrate-leads')
+def migrate_leads_command():
+    """Copy leads from the JSON file into the SQLite lead store (LEADS_DB_PATH)."""
+    backend = SqliteBackend(LEADS_DB_PATH)
+    if not migrate_json_to_sqlite(backend):
+        logger.info("%s already contains leads; nothing migrated.", LEADS_DB_PATH)
+
+
 # Custom route to serve images from the SAVED_IMAGES_DIR (bundled with code)
+_source_digests = {} # (path, mtime_ns, size) -> SHA-256, so unchanged sources are hashed once
+_source_digests_lock = threading.Lock()
+
+def source_digest(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _source_digests_lock:
+        digest = _source_digests.get(key)
+    if digest is None:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with _source_digests_lock:
+            _source_digests[key] = digest
+    return digest
+
+
+def rendition_path(source_path, digest, width, image_format):
+    """Returns the cached rendition for (digest, width, format), generating it if missing."""
+    extension = 'webp' if image_format == 'WEBP' else 'jpg'
+    path = os.path.join(RENDITIONS_DIR, digest[:2], f"{digest}_{width}.{extension}")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with Image.open(source_path) as img:
+        img.draft('RGB', (width, width)) # Lets the JPEG decoder skip detail we'd throw away
+        img = img.convert('RGB')
+        img.thumbnail((width, width * 4), Image.LANCZOS) # Keeps the aspect ratio; height is not the limit
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if image_format == 'WEBP':
+            img.save(temp_path, 'WEBP', quality=RENDITION_QUALITY, method=4)
+        else:
+            img.save(temp_path, 'JPEG', quality=RENDITION_QUALITY, optimize=True, progressive=True)
+    os.replace(temp_path, path) # Atomic, so concurrent workers never serve a partial file
+    return path
+
+
 @app.route('/images/<path:filename>')
 def images(filename):
+    """Serves a saved image, or with ?size=<name> (see RENDITION_WIDTHS) a resized copy."""
     if '..' in filename:
         return "Invalid filename", 400
-    # Serve directly from the directory bundled with the app code
-    print(f"Attempting to serve image: {filename} from {SAVED_IMAGES_DIR}")
+    source_path = os.path.join(SAVED_IMAGES_DIR, filename)
+    size = request.args.get('size')
+    if not size:
+        # Serve directly from the directory bundled with the app code
+        if not os.path.isfile(source_path):
+            logger.debug("Image not found: %s", source_path)
+            abort(404)
+        return send_from_directory(
+            SAVED_IMAGES_DIR, filename, etag=source_digest(source_path), max_age=IMAGE_CACHE_MAX_AGE
+        )
+
+    width = RENDITION_WIDTHS.get(size)
+    if width is None:
+        return "Unknown image size", 400
+    if not os.path.isfile(source_path):
+        logger.debug("Image not found: %s", source_path)
+        abort(404)
+
+    # WebP when the browser accepts it (about a third smaller), JPEG otherwise
+    image_format = 'WEBP' if 'image/webp' in request.headers.get('Accept', '') else 'JPEG'
+    digest = source_digest(source_path)
     try:
-        return send_from_directory(SAVED_IMAGES_DIR, filename)
-    except FileNotFoundError:
-         print(f"Image not found: {os.path.join(SAVED_IMAGES_DIR, filename)}")
-         from flask import abort
-         abort(404)
+        path = rendition_path(source_path, digest, width, image_format)
+    except OSError as e:
+        logger.error("Could not create %s rendition of %s: %s", size, filename, e)
+        abort(500)
+    response = send_file(
+        path,
+        mimetype='image/webp' if image_format == 'WEBP' else 'image/jpeg',
+        etag=f"{digest}-{width}-{image_format.lower()}",
+        max_age=IMAGE_CACHE_MAX_AGE,
+        conditional=True,
+    )
+    response.vary.add('Accept')
+    return response
 
 
 @app.route('/')
 def index():
-    leads = load_leads()
-    grouped_leads = defaultdict(list)
-    for lead in leads:
-        city = lead.get('city', 'Unknown City')
-        grouped_leads[city].append(lead)
-    return render_template('index.html', grouped_leads=dict(grouped_leads))
+    # Only the city headings are rendered; lead cards are fetched from /api/leads
+    return render_template('index.html', cities=lead_repository.city_counts(), statuses=LEAD_STATUSES)
+
+
+# --- Lead Listing API ---
+def encode_cursor(position, place_id):
+    raw = json.dumps([position, place_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor, sort='file'):
+    """
+    Returns the position a cursor points after. The position of the lead it
+    names is preferred, so cursors stay valid when earlier leads are deleted.
+    """
+    position, place_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    current = lead_repository.position_of(place_id, sort)
+    if current is not None:
+        return current
+    return [float(part) for part in position] if sort == 'confidence' else int(position)
+
+
+@app.route('/api/leads', methods=['GET'])
+def api_leads():
+    """
+    Lists leads one page at a time.
+    Query parameters: city, status, follow_up (true/false), q (searches name,
+    address, phone and notes), sort ('file', the default, or 'confidence' for
+    the most convincing leads first), limit and cursor (next_cursor of the
+    previous page, requested with the same sort).
+    """
+    args = request.args
+    sort = args.get('sort', 'file')
+    if sort not in LEAD_SORT_ORDERS:
+        return jsonify({'success': False, 'message': f'Invalid sort; expected one of {", ".join(LEAD_SORT_ORDERS)}'}), 400
+    try:
+        limit = min(max(int(args.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        after = decode_cursor(args['cursor'], sort) if args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid limit or cursor'}), 400
+
+    follow_up = args.get('follow_up')
+    if follow_up is not None:
+        follow_up = follow_up.lower() in ('1', 'true', 'yes')
+
+    leads, last_position = lead_repository.query(
+        city=args.get('city') or None,
+        status=args.get('status') or None,
+        follow_up=follow_up,
+        text=args.get('q', '').strip() or None,
+        after=after,
+        limit=limit,
+        sort=sort,
+    )
+    next_cursor = encode_cursor(last_position, leads[-1].get('place_id')) if last_position is not None else None
+    return jsonify({'success': True, 'leads': leads, 'next_cursor': next_cursor})
+
+
+def parse_coordinate(args, name, low, high):
+    """A float query parameter in [low, high]. Raises ValueError if it is missing or invalid."""
+    value = float(args[name]) if name in args else math.nan
+    if not low <= value <= high: # Also rejects NaN
+        raise ValueError(f'{name} must be a number from {low} to {high}')
+    return value
+
+
+@app.route('/api/leads/near', methods=['GET'])
+def api_leads_near():
+    """
+    The k leads closest to a point, closest first, each with its distance_meters.
+    Query parameters: lat, lng, k (default API_PAGE_SIZE) and optionally
+    max_meters. Leads without a location are never returned.
+    """
+    args = request.args
+    try:
+        lat = parse_coordinate(args, 'lat', -90, 90)
+        lng = parse_coordinate(args, 'lng', -180, 180)
+        k = min(max(int(args.get('k', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        max_meters = float(args['max_meters']) if args.get('max_meters') else None
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {e}'}), 400
+
+    nearest = lead_repository.nearest(lat, lng, k, max_meters)
+    return jsonify({'success': True, 'leads': [dict(lead, distance_meters=round(distance)) for distance, lead in nearest]})
+
+
+@app.route('/api/leads/within', methods=['GET'])
+def api_leads_within():
+    """
+    Leads inside a bounding box, in file order. Query parameters: south, west,
+    north, east (west > east crosses the antimeridian) and limit. 'total' is
+    the number of leads in the box, which can exceed the leads returned.
+    """
+    args = request.args
+    try:
+        bounds = (
+            parse_coordinate(args, 'south', -90, 90), parse_coordinate(args, 'west', -180, 180),
+            parse_coordinate(args, 'north', -90, 90), parse_coordinate(args, 'east', -180, 180),
+        )
+        limit = min(max(int(args.get('limit', API_MAX_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {e}'}), 400
+    if bounds[0] > bounds[2]:
+        return jsonify({'success': False, 'message': 'south must not be above north'}), 400
 
+    leads, total = lead_repository.within(bounds, limit)
+    return jsonify({'success': True, 'leads': leads, 'total': total})
 
-# --- CRM Update Routes (No changes needed in the logic itself) ---
+
+@app.route('/api/leads/route', methods=['GET'])
+def api_leads_route():
+    """
+    A nearest-neighbour visiting order for the leads flagged for follow-up.
+    Query parameters: lat and lng of the starting point (optional; the route
+    otherwise starts at the first follow-up) and city. Each stop carries
+    leg_meters from the previous one; follow-ups without a location are
+    listed separately under 'unlocated'.
+    """
+    args = request.args
+    start = None
+    try:
+        if 'lat' in args or 'lng' in args:
+            start = (parse_coordinate(args, 'lat', -90, 90), parse_coordinate(args, 'lng', -180, 180))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {e}'}), 400
+
+    stops, unlocated = lead_repository.follow_up_route(start, city=args.get('city') or None)
+    return jsonify({
+        'success': True,
+        'stops': [dict(lead, leg_meters=round(distance)) for distance, lead in stops],
+        'total_meters': round(sum(distance for distance, _ in stops)),
+        'unlocated': unlocated,
+    })
+
+
+def lead_etag(lead):
+    return f'"{lead.get("version", 1)}"'
+
+def clean_lead_fields(fields):
+    """
+    Validates a {field: value} dict of CRM edits: status must be one of
+    LEAD_STATUSES, notes a string and follow_up a boolean. Returns
+    (clean_fields, error_message).
+    """
+    if not isinstance(fields, dict) or not fields:
+        return None, 'No fields to update'
+    for field, value in fields.items():
+        if field not in EDITABLE_FIELDS:
+            return None, f'Invalid field specified: {field}'
+        if field == 'status' and value not in LEAD_STATUSES:
+            return None, f'Invalid status; expected one of: {", ".join(LEAD_STATUSES)}'
+        if field == 'notes' and not isinstance(value, str):
+            return None, 'Notes must be a string'
+        if field == 'follow_up' and not isinstance(value, bool):
+            return None, 'follow_up must be true or false'
+    return dict(fields), None
+
+def expected_version(lead_data=None):
+    """The version the client last saw, from If-Match or a 'version' in the body, or None."""
+    if_match = request.headers.get('If-Match')
+    if if_match:
+        return if_match.strip().removeprefix('W/').strip('"')
+    if isinstance(lead_data, dict) and lead_data.get('version') is not None:
+        return str(lead_data['version'])
+    return None
+
+def version_conflict(lead):
+    return jsonify({
+        'success': False,
+        'message': f'Lead "{lead.get("name", "Unknown")}" was changed by someone else. Reload to see the latest version.',
+        'lead': lead,
+    }), 412
+
+
+def lead_conflict_response(conflict):
+    """Response for a LeadConflict raised by the storage backend (edit made by another worker)."""
+    lead = lead_repository.get(conflict.place_id)
+    if lead is None:
+        return jsonify({'success': False, 'message': 'Lead not found'}), 404
+    return version_conflict(lead)
+
+
+# --- Lead Routes (addressed by place_id) ---
+@app.route('/leads/<place_id>', methods=['GET'])
+def get_lead(place_id):
+    lead = lead_repository.get(place_id)
+    if lead is None:
+        return jsonify({'success': False, 'message': 'Lead not found'}), 404
+    response = jsonify({'success': True, 'lead': lead})
+    response.headers['ETag'] = lead_etag(lead)
+    return response
+
+
+@app.route('/leads/<place_id>', methods=['PATCH'])
+def patch_lead(place_id):
+    """Edits CRM fields, e.g. {"status": "Contacted"}. Requires If-Match with the lead's ETag."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Expected a JSON object of fields'}), 400
+    fields, error = clean_lead_fields({k: v for k, v in data.items() if k != 'version'})
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    version = expected_version(data)
+    if version is None:
+        return jsonify({'success': False, 'message': 'Send If-Match with the lead ETag'}), 428
+
+    with lead_repository.lock:
+        lead = lead_repository.get(place_id)
+        if lead is None:
+            return jsonify({'success': False, 'message': 'Lead not found'}), 404
+        if str(lead.get('version', 1)) != version:
+            return version_conflict(lead)
+        try:
+            (lead,) = lead_repository.apply_updates([(lead, fields)])
+        except LeadConflict as e:
+            return lead_conflict_response(e)
+
+    response = jsonify({'success': True, 'message': 'Lead updated successfully', 'lead': lead})
+    response.headers['ETag'] = lead_etag(lead)
+    return response
+
+
+@app.route('/leads/<place_id>', methods=['DELETE'])
+def delete_lead_by_id(place_id):
+    version = expected_version(request.get_json(silent=True))
+    if version is None:
+        return jsonify({'success': False, 'message': 'Send If-Match with the lead ETag'}), 428
+
+    with lead_repository.lock:
+        lead = lead_repository.get(place_id)
+        if lead is None:
+            return jsonify({'success': False, 'message': 'Lead not found'}), 404
+        if str(lead.get('version', 1)) != version:
+            return version_conflict(lead)
+        try:
+            lead_repository.delete(lead)
+        except LeadConflict as e:
+            return lead_conflict_response(e)
+
+    return jsonify({'success': True, 'message': f'Lead "{lead.get("name", "Unknown")}" removed successfully'})
+
+
+@app.route('/leads/bulk_update', methods=['POST'])
+def bulk_update_leads():
+    """
+    Applies many edits at once: {"updates": [{"place_id", "version", "fields": {...}}]}.
+    All-or-nothing: if any lead is missing or stale, nothing is changed.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('updates') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': 'Invalid data'}), 400
+
+    with lead_repository.lock:
+        updates = []
+        conflicts = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get('place_id'), str) or item.get('version') is None:
+                return jsonify({'success': False, 'message': 'Each update needs place_id, version and fields'}), 400
+            fields, error = clean_lead_fields(item.get('fields'))
+            if error:
+                return jsonify({'success': False, 'message': error}), 400
+            lead = lead_repository.get(item['place_id'])
+            if lead is None:
+                conflicts.append({'place_id': item['place_id'], 'reason': 'not found'})
+            elif str(lead.get('version', 1)) != str(item['version']):
+                conflicts.append({'place_id': item['place_id'], 'reason': 'stale version', 'lead': lead})
+            else:
+                updates.append((lead, fields))
+
+        if conflicts:
+            return jsonify({'success': False, 'message': 'No leads were updated', 'conflicts': conflicts}), 412
+        try:
+            updated = lead_repository.apply_updates(updates)
+        except LeadConflict as e:
+            # Another worker changed a lead after our check; the transaction was rolled back
+            conflict = {'place_id': e.place_id, 'reason': e.reason}
+            current = lead_repository.get(e.place_id)
+            if current is not None:
+                conflict['lead'] = current
+            return jsonify({'success': False, 'message': 'No leads were updated', 'conflicts': [conflict]}), 412
+
+    return jsonify({
+        'success': True,
+        'message': f'{len(updates)} leads updated successfully',
+        'versions': {lead['place_id']: lead['version'] for lead in updated},
+    })
+
+
+# --- Legacy CRM Routes (addressed by city + position; kept for old pages) ---
 @app.route('/update_lead', methods=['POST'])
 def update_lead():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
     city = data.get('city')
     index_in_city = data.get('index')
     field = data.get('field')
@@ -127,69 +1326,57 @@ def update_lead():
 
     if city is None or index_in_city is None or field is None or value is None:
         return jsonify({'success': False, 'message': 'Invalid data'}), 400
+    try:
+        index_in_city = int(index_in_city)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Index must be a number'}), 400
+    if not isinstance(field, str):
+        return jsonify({'success': False, 'message': 'Invalid field specified'}), 400
+    fields, error = clean_lead_fields({field: value})
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
 
-    leads = load_leads() # Load current state from disk
-
-    found_lead = None
-    current_index_in_city = 0
-    for lead in leads:
-        if lead.get('city', 'Unknown City') == city:
-            if current_index_in_city == index_in_city:
-                found_lead = lead
-                break
-            current_index_in_city += 1
+    found_lead = lead_repository.find_in_city(city, index_in_city)
 
     if not found_lead:
         return jsonify({'success': False, 'message': 'Lead not found'}), 404
 
-    if field in ['status', 'notes', 'follow_up']:
-        if field == 'follow_up':
-             found_lead[field] = bool(value)
-        else:
-             found_lead[field] = value
-    else:
-        return jsonify({'success': False, 'message': 'Invalid field specified'}), 400
-
-    # Save updated list back to disk
-    if save_leads(leads):
-        return jsonify({'success': True, 'message': 'Lead updated successfully'})
-    else:
-        return jsonify({'success': False, 'message': 'Failed to save leads'}), 500
+    # JSON backend: applied in memory now, written to disk by the write-behind flush
+    try:
+        lead_repository.apply_updates([(found_lead, fields)])
+    except LeadConflict:
+        return jsonify({'success': False, 'message': 'Lead was changed by someone else; reload the page'}), 409
+    return jsonify({'success': True, 'message': 'Lead updated successfully'})
 
 
 @app.route('/delete_lead', methods=['POST'])
 def delete_lead():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
     city = data.get('city')
     index_in_city = data.get('index')
 
     if city is None or index_in_city is None:
         return jsonify({'success': False, 'message': 'Invalid data'}), 400
+    try:
+        index_in_city = int(index_in_city)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Index must be a number'}), 400
 
-    leads = load_leads() # Load current state from disk
-    
-    found_index = None
-    current_index_in_city = 0
-    for i, lead in enumerate(leads):
-        if lead.get('city', 'Unknown City') == city:
-            if current_index_in_city == int(index_in_city):
-                found_index = i
-                break
-            current_index_in_city += 1
-
-    if found_index is None:
+    removed_lead = lead_repository.find_in_city(city, index_in_city)
+
+    if removed_lead is None:
         return jsonify({'success': False, 'message': 'Lead not found'}), 404
 
-    removed_lead = leads.pop(found_index)
-    
-    # Save updated list back to disk
-    if save_leads(leads):
-        return jsonify({
-            'success': True, 
-            'message': f'Lead "{removed_lead.get("name", "Unknown")}" removed successfully'
-        })
-    else:
-        return jsonify({'success': False, 'message': 'Failed to save leads'}), 500
+    try:
+        lead_repository.delete(removed_lead)
+    except LeadConflict:
+        return jsonify({'success': False, 'message': 'Lead was changed by someone else; reload the page'}), 409
+    return jsonify({
+        'success': True,
+        'message': f'Lead "{removed_lead.get("name", "Unknown")}" removed successfully'
+    })
 
 # Remove the __main__ block or keep it only for local testing
 # Render uses the Procfile, it does not execute this block
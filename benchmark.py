@@ -0,0 +1,502 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from tiling import haversine_meters
+
+# --- Benchmark Harness ---
+# Measures the crawl pipeline (main.py) and the CRM app (app.py) against local
+# fixtures, so results are comparable between versions and need neither
+# Google credentials nor a Moondream server.
+#
+#   crawl: Places, Place Details and Street View responses are replayed from
+#          fixtures built from leads_with_awnings.json and saved_images/. Every
+#          lead becomes a place whose frames are its saved images (the stub
+#          vision model answers YES for them); as many decoy places get
+#          mirrored copies of those frames (answered NO). Calls sleep for a
+#          configurable latency to stand in for the network and the GPU.
+#   crm:   synthetic lead files of 1k/10k/100k leads are loaded into app.py
+#          and exercised through Flask's test client for each storage backend.
+#
+# Usage:
+#   python benchmark.py                        # everything, JSON on stdout
+#   python benchmark.py --suite crm --leads 1000,10000 --output before.json
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_LEADS_FILE = os.path.join(BASE_DIR, 'leads_with_awnings.json')
+FIXTURE_CITY = ("Fixture City", (41.3083, -72.9279))
+FIXTURE_BUSINESS_TYPES = ['restaurant', 'store']
+FIXTURE_SPREAD_METERS = 3000 # Places are scattered this far around the fixture city center
+STUB_FULL_FRAME_PIXELS = 640 * 600 # Size of the saved lead images the fixtures replay
+CRM_STATUSES = ['New', 'Contacted', 'Qualified', 'Closed - Won', 'Closed - Lost']
+CRM_CITIES = 20
+CRM_CITY_SPREAD_DEGREES = 0.1 # Synthetic leads are scattered this far (std. dev.) around their city center
+
+
+def percentiles(samples):
+    """Returns count, mean and p50/p95/p99/max (milliseconds) of a list of seconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(rank(50), 3),
+        'p95_ms': round(rank(95), 3),
+        'p99_ms': round(rank(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None where it is not available."""
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1) # bytes on macOS, KiB elsewhere
+
+
+# --- Crawl Fixtures ---
+
+def _pixel_digest(image):
+    return hashlib.sha256(image.convert('RGB').tobytes()).hexdigest()
+
+
+class CrawlFixtures:
+    """Deterministic places, panoramas and frames derived from the saved leads."""
+
+    def __init__(self, max_places, seed=0, screen_max_side=378):
+        rng = random.Random(seed)
+        with open(FIXTURE_LEADS_FILE, 'r', encoding='utf-8') as f:
+            leads = json.load(f)
+
+        self.places = {} # place_id -> fixture place
+        self.positive_digests = set() # Pixel digests the stub model answers YES for
+        lat0, lng0 = FIXTURE_CITY[1]
+        for lead in leads:
+            frames = []
+            for path in lead.get('image_filepaths', []):
+                full_path = os.path.join(BASE_DIR, path)
+                if os.path.exists(full_path):
+                    with open(full_path, 'rb') as f:
+                        frames.append(f.read())
+            if not frames:
+                continue
+            for is_lead in (True, False):
+                if len(self.places) >= max_places:
+                    break
+                place_frames = frames if is_lead else [self._mirrored(frame) for frame in frames]
+                if is_lead:
+                    for frame in frames:
+                        image = Image.open(io.BytesIO(frame))
+                        self.positive_digests.add(_pixel_digest(image))
+                        screened = image.copy()
+                        screened.thumbnail((screen_max_side, screen_max_side)) # As the screen stage sees it
+                        self.positive_digests.add(_pixel_digest(screened))
+                place_id = lead['place_id'] if is_lead else f"decoy-{lead['place_id']}"
+                d_north, d_east = rng.uniform(-1, 1) * FIXTURE_SPREAD_METERS, rng.uniform(-1, 1) * FIXTURE_SPREAD_METERS
+                lat = lat0 + math.degrees(d_north / 6371000.0)
+                lng = lng0 + math.degrees(d_east / (6371000.0 * math.cos(math.radians(lat0))))
+                self.places[place_id] = {
+                    'place_id': place_id,
+                    'lat': lat,
+                    'lng': lng,
+                    'types': [rng.choice(FIXTURE_BUSINESS_TYPES)],
+                    'frames': place_frames,
+                    'is_lead': is_lead,
+                    'details': {
+                        'name': lead.get('name', 'N/A') + ('' if is_lead else ' (decoy)'),
+                        'formatted_address': lead.get('address', 'N/A'),
+                        'formatted_phone_number': lead.get('phone', 'N/A'),
+                        'geometry': {'location': {'lat': lat, 'lng': lng}},
+                        'place_id': place_id,
+                        'url': lead.get('Maps_url', 'N/A'),
+                    },
+                }
+        self.by_pano = {f"pano-{place_id}": place for place_id, place in self.places.items()}
+
+    @staticmethod
+    def _mirrored(frame):
+        out = io.BytesIO()
+        ImageOps.mirror(Image.open(io.BytesIO(frame)).convert('RGB')).save(out, 'JPEG', quality=90)
+        return out.getvalue()
+
+
+class FixtureResponse:
+    def __init__(self, status_code=200, content=b'', payload=None):
+        self.status_code = status_code
+        self.content = content
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FixtureGoogle:
+    """Replays Places (googlemaps.Client interface) and Street View (requests.Session interface) from fixtures."""
+
+    def __init__(self, fixtures, latency):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.page_tokens = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        time.sleep(self.latency)
+
+    # googlemaps.Client
+    def places_nearby(self, location=None, radius=None, type=None, page_token=None):
+        self._count('places_nearby')
+        if page_token:
+            results = self.page_tokens.pop(page_token)
+        else:
+            results = [
+                {'place_id': p['place_id'], 'name': p['details']['name'], 'geometry': p['details']['geometry']}
+                for p in self.fixtures.places.values()
+                if type in p['types'] and haversine_meters(location[0], location[1], p['lat'], p['lng']) <= radius
+            ][:60]
+        response = {'status': 'OK', 'results': results[:20]}
+        if results[20:]:
+            token = f"token-{len(self.page_tokens)}-{time.monotonic()}"
+            self.page_tokens[token] = results[20:]
+            response['next_page_token'] = token
+        return response
+
+    def place(self, place_id=None, fields=None):
+        self._count('place_details')
+        return {'status': 'OK', 'result': dict(self.fixtures.places[place_id]['details'])}
+
+    # requests
+    def get(self, url, params=None, timeout=None, stream=False):
+        if url.endswith('/streetview/metadata'):
+            self._count('streetview_metadata')
+            lat, lng = (float(v) for v in params['location'].split(','))
+            place = min(
+                self.fixtures.places.values(), key=lambda p: (p['lat'] - lat) ** 2 + (p['lng'] - lng) ** 2
+            )
+            return FixtureResponse(payload={
+                'status': 'OK',
+                'pano_id': f"pano-{place['place_id']}",
+                'location': {'lat': place['lat'] - 0.00013, 'lng': place['lng']}, # ~15 m south of the door
+            })
+        if url.endswith('/streetview'):
+            self._count('streetview_image')
+            frames = self.fixtures.by_pano[params['pano']]['frames']
+            return FixtureResponse(content=frames[int(params['heading']) // 7 % len(frames)])
+        self._count('place_photo')
+        return FixtureResponse(status_code=404)
+
+
+class StubMoondream:
+    """
+    Stands in for one Moondream replica: answers YES for frames of fixture
+    leads, one query at a time like a server on a CPU.
+    """
+
+    def __init__(self, positive_digests, latency):
+        self.positive_digests = positive_digests
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.queries = 0
+
+    def query(self, image, prompt):
+        # Moondream tiles a large frame into crops, so a query costs roughly in
+        # proportion to the pixels up to a full frame, and the screen stage's
+        # downscaled frames are cheaper.
+        with self.lock:
+            self.queries += 1
+            time.sleep(self.latency * min(1.0, image.width * image.height / STUB_FULL_FRAME_PIXELS))
+        return {'answer': '9' if _pixel_digest(image) in self.positive_digests else '1'}
+
+
+def run_crawl_benchmark(args, workdir):
+    """Runs the full pipeline over the fixtures and returns its measurements."""
+    os.chdir(workdir)
+    os.environ['CRAWL_CACHE_DIR'] = os.path.join(workdir, 'crawl_cache')
+    import main
+    import run_state
+    from lead_sink import LeadSink
+
+    fixtures = CrawlFixtures(args.crawl_places, seed=args.seed, screen_max_side=main.VISION_SCREEN_MAX_SIDE)
+    google = FixtureGoogle(fixtures, args.google_latency_ms / 1000)
+    replicas = [StubMoondream(fixtures.positive_digests, args.vision_latency_ms / 1000) for _ in range(args.vision_replicas)]
+
+    main.Maps_API_KEY = "FIXTURE"
+    main.CITIES_TO_SEARCH = dict([FIXTURE_CITY])
+    main.BUSINESS_TYPES = FIXTURE_BUSINESS_TYPES
+    main.DELAY_BETWEEN_PLACES_PAGES = args.page_token_delay
+    main.transport.session = google # Street View and photo GETs go through the shared transport
+    from vision_pool import Replica, VisionPool
+    main.vision_pool = VisionPool([
+        Replica(f"stub-{index}", lambda stub=stub: stub, main.VISION_REPLICA_CONCURRENCY)
+        for index, stub in enumerate(replicas)
+    ])
+    main._vision_executor = None # Sized for the pool on first use
+
+    stage_samples = {}
+    run_stage = main._run_stage
+
+    def timed_run_stage(name, worker, in_queue, out_queue, concurrency, on_error=None, on_done=None):
+        samples = stage_samples.setdefault(name, [])
+
+        async def timed_worker(item):
+            started = time.perf_counter()
+            try:
+                return await worker(item)
+            finally:
+                samples.append(time.perf_counter() - started)
+
+        return run_stage(name, timed_worker, in_queue, out_queue, concurrency, on_error, on_done)
+
+    main._run_stage = timed_run_stage
+    state = run_state.RunStateStore(os.path.join(workdir, main.RUN_STATE_DB))
+    lead_sink = LeadSink(os.path.join(workdir, main.LEADS_LOG_FILENAME))
+    try:
+        elapsed, stats = timed(asyncio.run, main.run_pipeline(google, state, lead_sink))
+    finally:
+        main._run_stage = run_stage
+        lead_sink.close()
+        state_counts = state.counts()
+        state.close()
+
+    expected_leads = sum(1 for p in fixtures.places.values() if p['is_lead'])
+    api_calls = sum(count for endpoint, count in google.calls.items())
+    return {
+        'places': len(fixtures.places),
+        'expected_leads': expected_leads,
+        'leads_written': stats['leads_written'],
+        'wall_seconds': round(elapsed, 3),
+        'places_per_minute': round(stats['discovered'] / elapsed * 60, 1) if elapsed else None,
+        'stage_latency': {name: percentiles(samples) for name, samples in stage_samples.items()},
+        'step_seconds': {
+            labels['step']: {'count': main.STEP_SECONDS.count(**labels), 'total': round(main.STEP_SECONDS.sum(**labels), 3)}
+            for labels in main.STEP_SECONDS.label_values()
+        },
+        'api_calls': dict(google.calls),
+        'api_calls_per_lead': round(api_calls / stats['leads_written'], 2) if stats['leads_written'] else None,
+        'vision_queries': sum(stub.queries for stub in replicas),
+        'vision_queries_per_replica': [stub.queries for stub in replicas],
+        'vision_queries_per_place': round(sum(stub.queries for stub in replicas) / len(fixtures.places), 2) if fixtures.places else None,
+        'vision_stage_queries': {
+            stage: sum(main.VISION_STAGE_RESULTS.value(stage=stage, result=result, source='model')
+                       for result in ('pass', 'reject', 'failed'))
+            for stage in main.VISION_STAGES
+        },
+        'place_status': state_counts,
+        'image_memory': {
+            'peak_mb': round(main.image_budget.stats['peak_bytes'] / 1024**2, 1),
+            'budget_waits': main.image_budget.stats['waits'],
+            'buffers_allocated': main.buffer_pool.stats['allocated'],
+            'buffers_reused': main.buffer_pool.stats['reused'],
+            'held_after_run_bytes': main.image_budget.used,
+        },
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+# --- CRM Fixtures ---
+
+def crm_city_center(index):
+    """Centers of the synthetic cities, spread over the continental US."""
+    return 30.0 + (index * 7) % 17, -120.0 + (index * 11) % 45
+
+
+def synthetic_leads(count, seed=0):
+    """Leads shaped like the crawler's output, cycling through the real ones."""
+    rng = random.Random(seed)
+    with open(FIXTURE_LEADS_FILE, 'r', encoding='utf-8') as f:
+        templates = json.load(f)
+    leads = []
+    for i in range(count):
+        lead = dict(templates[i % len(templates)])
+        lead['place_id'] = f"{lead['place_id']}-{i}"
+        lead['city'] = f"City {i % CRM_CITIES}"
+        lead['status'] = rng.choice(CRM_STATUSES)
+        lead['notes'] = rng.choice(['', '', 'Call back next week', 'Owner prefers email', 'Needs new awning'])
+        lead['follow_up'] = rng.random() < 0.2
+        center_lat, center_lng = crm_city_center(i % CRM_CITIES)
+        lead['lat'] = center_lat + rng.gauss(0, CRM_CITY_SPREAD_DEGREES)
+        lead['lng'] = center_lng + rng.gauss(0, CRM_CITY_SPREAD_DEGREES)
+        leads.append(lead)
+    return leads
+
+
+def run_crm_benchmark(args, workdir):
+    """Measures load and edit paths of app.py at each lead count and storage backend."""
+    os.environ['RENDER_DISK_MOUNT_PATH'] = os.path.join(workdir, 'crm')
+    os.makedirs(os.environ['RENDER_DISK_MOUNT_PATH'], exist_ok=True)
+    import app
+
+    rng = random.Random(args.seed)
+    client = app.app.test_client()
+    results = []
+    for count in args.leads:
+        leads = synthetic_leads(count, seed=args.seed)
+        for backend_name in args.crm_backends:
+            # Fresh files per run, so every measurement starts cold
+            for path in (app.JSON_FILE_ON_DISK, app.LEADS_DB_PATH):
+                for suffix in ('', '-wal', '-shm', '.journal'):
+                    with contextlib.suppress(OSError):
+                        os.remove(path + suffix)
+            with open(app.JSON_FILE_ON_DISK, 'w', encoding='utf-8') as f:
+                json.dump(leads, f)
+
+            result = {'leads': count, 'backend': backend_name}
+            result['load_leads_seconds'] = round(timed(app.load_leads)[0], 4)
+            backend = app.create_lead_backend(backend_name)
+            if backend_name == 'sqlite':
+                result['migrate_seconds'] = round(timed(app.migrate_json_to_sqlite, backend)[0], 4)
+            app.lead_repository = app.LeadRepository(backend, 3600)
+            result['repository_cold_load_seconds'] = round(timed(app.lead_repository.refresh)[0], 4)
+
+            sample_ids = [lead['place_id'] for lead in rng.sample(leads, min(args.repeat, count))]
+            samples = {
+                'get_index': [], 'api_page': [], 'api_city_status_page': [], 'api_search': [],
+                'api_near': [], 'api_within': [], 'api_route': [], 'patch_lead': [], 'update_lead_legacy': [],
+            }
+            for i, place_id in enumerate(sample_ids):
+                if i < 20:
+                    samples['get_index'].append(timed(client.get, '/')[0])
+                samples['api_page'].append(timed(client.get, '/api/leads')[0])
+                samples['api_city_status_page'].append(timed(
+                    client.get, '/api/leads', query_string={'city': f"City {i % CRM_CITIES}", 'status': 'Contacted'}
+                )[0])
+                samples['api_search'].append(timed(client.get, '/api/leads', query_string={'q': 'call back'})[0])
+                center_lat, center_lng = crm_city_center(i % CRM_CITIES)
+                samples['api_near'].append(timed(
+                    client.get, '/api/leads/near', query_string={'lat': center_lat, 'lng': center_lng, 'k': 20}
+                )[0])
+                samples['api_within'].append(timed(
+                    client.get, '/api/leads/within',
+                    query_string={'south': center_lat, 'west': center_lng, 'north': center_lat + 0.02, 'east': center_lng + 0.02},
+                )[0])
+                samples['api_route'].append(timed(
+                    client.get, '/api/leads/route', query_string={'lat': center_lat, 'lng': center_lng, 'city': f"City {i % CRM_CITIES}"}
+                )[0])
+
+                version = app.lead_repository.get(place_id)['version']
+                seconds, response = timed(
+                    client.patch, f'/leads/{place_id}', json={'notes': f'benchmark edit {i}'}, headers={'If-Match': f'"{version}"'}
+                )
+                assert response.status_code == 200, response.get_json()
+                samples['patch_lead'].append(seconds)
+
+                seconds, response = timed(
+                    client.post, '/update_lead', json={'city': f"City {i % CRM_CITIES}", 'index': 0, 'field': 'follow_up', 'value': i % 2 == 0}
+                )
+                samples['update_lead_legacy'].append(seconds)
+
+            result['requests'] = {name: percentiles(values) for name, values in samples.items()}
+            if app.lead_repository.backend.write_behind:
+                result['write_behind_flush_seconds'] = round(timed(app.lead_repository.flush)[0], 4)
+            results.append(result)
+    return results
+
+
+# --- Entry Point ---
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crawl pipeline and the CRM app against local fixtures.")
+    parser.add_argument("--suite", choices=["all", "crawl", "crm"], default="all")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--crawl-places", type=int, default=200, help="Fixture places (half leads, half decoys).")
+    parser.add_argument("--google-latency-ms", type=float, default=40.0, help="Simulated latency of each Google call.")
+    parser.add_argument("--vision-latency-ms", type=float, default=120.0, help="Simulated latency of each Moondream query.")
+    parser.add_argument("--vision-replicas", type=int, default=1, help="Simulated Moondream replicas, each one query at a time.")
+    parser.add_argument("--page-token-delay", type=float, default=0.0, help="Overrides DELAY_BETWEEN_PLACES_PAGES.")
+    parser.add_argument(
+        "--leads", default="1000,10000,100000",
+        type=lambda value: [int(n) for n in value.split(',')], help="Comma-separated CRM lead counts.",
+    )
+    parser.add_argument(
+        "--crm-backends", default="json,sqlite",
+        type=lambda value: value.split(','), help="Comma-separated LEADS_BACKEND values to measure.",
+    )
+    parser.add_argument("--repeat", type=int, default=100, help="Requests measured per CRM endpoint.")
+    parser.add_argument("--verbose", action="store_true", help="Show the crawler's and app's own log output.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'verbose')},
+    }
+
+    workdir = tempfile.mkdtemp(prefix="awning-benchmark-")
+    cwd = os.getcwd()
+    sys.path.insert(0, BASE_DIR)
+    # Configured before main.py/app.py are imported, so their own basicConfig calls are no-ops
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)-7s %(message)s")
+    try:
+        if args.suite in ("all", "crawl"):
+            report['crawl'] = run_crawl_benchmark(args, workdir)
+        if args.suite in ("all", "crm"):
+            report['crm'] = run_crm_benchmark(args, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"Wrote benchmark report to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
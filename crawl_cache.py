@@ -0,0 +1,345 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- Persistent Crawl Cache ---
+# Street View metadata and image/photo responses survive between runs so
+# re-crawls don't pay Google again for panoramas we already downloaded.
+# Vision verdicts are memoized per (image digest, prompt digest, model) so the
+# same bytes are never sent through the same prompt twice. Place Details
+# responses are kept too, with their own (shorter) TTL, since phone numbers
+# and photos change more often than panoramas.
+#
+# Layout under cache_dir:
+#   index.sqlite3          request key -> blob digest / metadata JSON, verdicts
+#   objects/ab/abcdef...   image bytes, stored once per SHA-256 digest
+#
+# Entries older than the TTL are treated as misses. When the blob store grows
+# beyond max_bytes, the least recently used blobs are evicted.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_digest ON images(digest);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs(last_access);
+CREATE TABLE IF NOT EXISTS details (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS verdicts (
+    image_digest TEXT NOT NULL,
+    prompt_digest TEXT NOT NULL,
+    model TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    verdict INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (image_digest, prompt_digest, model)
+);
+"""
+
+EVICT_TARGET_FRACTION = 0.9 # Evict down to 90% of max_bytes to avoid evicting on every put
+
+
+def metadata_cache_key(location, source="outdoor"):
+    """Key for a Street View metadata lookup around a 'lat,lng' location."""
+    return f"streetview_metadata|{location}|{source}"
+
+def image_cache_key(pano_location, heading, fov, size):
+    """Key for a Street View image request from a panorama location."""
+    return f"streetview_image|{pano_location}|{heading}|{fov}|{size}"
+
+def photo_cache_key(photo_reference, max_width):
+    """Key for a Place Photo request."""
+    return f"place_photo|{photo_reference}|{max_width}"
+
+def place_details_cache_key(place_id, fields):
+    """Key for a Place Details request for a set of fields."""
+    return f"place_details|{place_id}|{','.join(sorted(fields))}"
+
+def content_digest(data):
+    """SHA-256 hex digest used to address images and prompts."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class CrawlCache:
+    """Thread-safe SQLite-indexed cache with a content-addressed blob store."""
+
+    def __init__(self, cache_dir, ttl_seconds, max_bytes, details_ttl_seconds=None):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.details_ttl_seconds = details_ttl_seconds if details_ttl_seconds is not None else ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.total_bytes = self._stored_bytes()
+        self.stats = {
+            'metadata_hits': 0, 'metadata_misses': 0,
+            'details_hits': 0, 'details_misses': 0,
+            'image_hits': 0, 'image_misses': 0,
+            'bytes_served': 0, 'evicted_blobs': 0,
+            'verdict_hits': 0, 'verdict_misses': 0, 'verdict_flips': 0,
+        }
+
+    def _blob_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _stored_bytes(self):
+        """Size of the blob store according to the index (other processes sharing the cache included)."""
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _is_fresh(self, fetched_at):
+        return time.time() - fetched_at < self.ttl_seconds
+
+    # --- Metadata ---
+
+    def get_metadata(self, key):
+        """Returns the cached metadata dict for key, or None on a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT response, fetched_at FROM metadata WHERE key = ?", (key,)).fetchone()
+            if row is None or not self._is_fresh(row[1]):
+                self.stats['metadata_misses'] += 1
+                return None
+            self.stats['metadata_hits'] += 1
+            return json.loads(row[0])
+
+    def put_metadata(self, key, metadata):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadata (key, response, fetched_at) VALUES (?, ?, ?)",
+                (key, json.dumps(metadata), time.time()),
+            )
+            self.conn.commit()
+
+    # --- Place Details ---
+
+    def get_details(self, key):
+        """Returns the cached Place Details result for key, or None on a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT response, fetched_at FROM details WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[1] >= self.details_ttl_seconds:
+                self.stats['details_misses'] += 1
+                return None
+            self.stats['details_hits'] += 1
+            return json.loads(row[0])
+
+    def put_details(self, key, details):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO details (key, response, fetched_at) VALUES (?, ?, ?)",
+                (key, json.dumps(details), time.time()),
+            )
+            self.conn.commit()
+
+    # --- Images ---
+
+    def get_image(self, key, into=None):
+        """
+        Returns the cached image bytes for key, or None on a miss. With into (an
+        image_memory.PooledBuffer), the blob is read straight into that buffer
+        and a memoryview of it is returned instead.
+
+        The blob file is read outside the lock, so other workers' cache calls
+        don't wait on the disk; a blob evicted meanwhile counts as a miss.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT images.digest, fetched_at, size FROM images JOIN blobs ON blobs.digest = images.digest "
+                "WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or not self._is_fresh(row[1]):
+                self.stats['image_misses'] += 1
+                return None
+        digest, _, size = row
+
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                data = f.read() if into is None else into.read_file(f, os.fstat(f.fileno()).st_size)
+        except OSError:
+            data = None
+        with self.lock:
+            if data is None:
+                # Blob vanished from disk; forget the mapping and refetch
+                self.conn.execute("DELETE FROM images WHERE key = ? AND digest = ?", (key, digest))
+                self.conn.commit()
+                self.stats['image_misses'] += 1
+                return None
+            touched = self.conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest)).rowcount
+            self.conn.commit()
+            if not touched or len(data) != size:
+                self.stats['image_misses'] += 1 # Evicted while it was being read
+                return None
+            self.stats['image_hits'] += 1
+            self.stats['bytes_served'] += len(data)
+            return data
+
+    def image_keys(self, prefix, min_bytes=0):
+        """Returns the keys of fresh cached images that start with prefix and are larger than min_bytes."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key FROM images JOIN blobs ON blobs.digest = images.digest "
+                "WHERE key >= ? AND key < ? AND fetched_at > ? AND size > ?",
+                (prefix, prefix + "\uffff", time.time() - self.ttl_seconds, min_bytes),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def put_image(self, key, data):
+        """Stores image bytes (or a memoryview of them) under key. Identical bytes are stored only once."""
+        digest = content_digest(data)
+        path = self._blob_path(digest)
+        now = time.time()
+        with self.lock:
+            known = self.conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if not known:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.tmp" # Shard processes may share the cache
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO blobs (digest, size, last_access) VALUES (?, ?, ?)", (digest, len(data), now)
+                )
+                self.total_bytes = self._stored_bytes() # Counts what shard processes sharing the cache stored
+            else:
+                self.conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (now, digest))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (key, digest, fetched_at) VALUES (?, ?, ?)", (key, digest, now)
+            )
+            self.conn.commit()
+            if self.total_bytes > self.max_bytes:
+                self._evict_lru()
+        return digest
+
+    # --- Vision Verdicts ---
+
+    def get_verdict(self, image_digest, prompt_digest, model):
+        """Returns (answer, verdict) memoized for this image/prompt/model, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT answer, verdict FROM verdicts WHERE image_digest = ? AND prompt_digest = ? AND model = ?",
+                (image_digest, prompt_digest, model),
+            ).fetchone()
+            if row is None:
+                self.stats['verdict_misses'] += 1
+                return None
+            self.stats['verdict_hits'] += 1
+            return row[0], bool(row[1])
+
+    def put_verdict(self, image_digest, prompt_digest, model, answer, verdict):
+        """
+        Memoizes a verdict. If the same image was classified under an earlier
+        prompt with a different outcome, it is counted as a flip.
+        """
+        with self.lock:
+            previous = self.conn.execute(
+                "SELECT verdict FROM verdicts WHERE image_digest = ? AND model = ? AND prompt_digest != ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (image_digest, model, prompt_digest),
+            ).fetchone()
+            if previous is not None and bool(previous[0]) != bool(verdict):
+                self.stats['verdict_flips'] += 1
+            self.conn.execute(
+                "INSERT OR REPLACE INTO verdicts (image_digest, prompt_digest, model, answer, verdict, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (image_digest, prompt_digest, model, answer, int(bool(verdict)), time.time()),
+            )
+            self.conn.commit()
+
+    def invalidate_verdicts(self, keep_prompt_digests=None):
+        """
+        Deletes memoized verdicts. With keep_prompt_digests, only verdicts for
+        other prompts are removed. Returns the number of rows deleted.
+        """
+        with self.lock:
+            if keep_prompt_digests is None:
+                cursor = self.conn.execute("DELETE FROM verdicts")
+            else:
+                keep = list(keep_prompt_digests)
+                cursor = self.conn.execute(
+                    f"DELETE FROM verdicts WHERE prompt_digest NOT IN ({', '.join('?' * len(keep))})", keep
+                )
+            self.conn.commit()
+            return cursor.rowcount
+
+    # --- Eviction ---
+
+    def _evict_lru(self):
+        """Deletes least recently used blobs until under the size target. Caller holds the lock."""
+        target = self.max_bytes * EVICT_TARGET_FRACTION
+        rows = self.conn.execute("SELECT digest, size FROM blobs ORDER BY last_access").fetchall()
+        for digest, size in rows:
+            if self.total_bytes <= target:
+                break
+            self._delete_blob(digest, size)
+        self.conn.commit()
+
+    def _delete_blob(self, digest, size):
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+        self.conn.execute("DELETE FROM images WHERE digest = ?", (digest,))
+        self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        self.total_bytes -= size
+        self.stats['evicted_blobs'] += 1
+
+    def purge_expired(self):
+        """
+        Drops entries past the TTL and any blobs no longer referenced. Returns
+        the number of blobs (image files) deleted.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        with self.lock:
+            self.conn.execute("DELETE FROM metadata WHERE fetched_at < ?", (cutoff,))
+            self.conn.execute("DELETE FROM details WHERE fetched_at < ?", (time.time() - self.details_ttl_seconds,))
+            self.conn.execute("DELETE FROM images WHERE fetched_at < ?", (cutoff,))
+            orphans = self.conn.execute(
+                "SELECT digest, size FROM blobs WHERE digest NOT IN (SELECT digest FROM images)"
+            ).fetchall()
+            for digest, size in orphans:
+                self._delete_blob(digest, size)
+            self.conn.commit()
+            self.total_bytes = self._stored_bytes()
+            if self.total_bytes > self.max_bytes:
+                self._evict_lru()
+        return len(orphans)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def summary_lines(self):
+        s = self.stats
+        return [
+            f"  metadata hits={s['metadata_hits']} misses={s['metadata_misses']}",
+            f"  details  hits={s['details_hits']} misses={s['details_misses']}",
+            f"  images   hits={s['image_hits']} misses={s['image_misses']} "
+            f"served={s['bytes_served'] / 1e6:.1f} MB from disk, store={self.total_bytes / 1e6:.1f} MB, "
+            f"evicted={s['evicted_blobs']}",
+            f"  verdicts hits={s['verdict_hits']} misses={s['verdict_misses']} "
+            f"changed since an earlier prompt={s['verdict_flips']}",
+        ]
@@ -0,0 +1,212 @@
+import heapq
+import math
+
+from tiling import EARTH_RADIUS_METERS, haversine_meters
+
+# --- Spatial Lead Index ---
+# Leads are bucketed into a grid of cell_degrees x cell_degrees cells keyed by
+# (floor(lat / cell), floor(lng / cell)), so adding or removing a lead is a
+# dict operation and queries only look at the cells around them:
+#   nearest  - rings of cells around the query point are searched outwards
+#              until no unsearched cell can hold anything closer than the k-th
+#              lead found so far
+#   within   - the cells overlapping the box (south, west, north, east, the
+#              convention of tiling.py) are searched
+# Occupied cells are also grouped into blocks of BLOCK_CELLS x BLOCK_CELLS. A
+# nearest query whose rings grow past a block without finding its k leads
+# (the query is far from every lead) goes on best-first over the blocks
+# instead, opening only those that can still hold a closer lead. A box
+# covering more cells than are occupied walks the occupied cells instead.
+
+BLOCK_CELLS = 16
+
+
+def _lng_delta(lng1, lng2):
+    """Absolute longitude difference in degrees, across the antimeridian if shorter."""
+    delta = abs(lng1 - lng2) % 360
+    return min(delta, 360 - delta)
+
+
+def _haversine_lower_bound(lat, d_lat, d_lng, widest_lat):
+    """
+    Least great-circle distance in meters from latitude lat to a point at
+    least d_lat degrees of latitude and d_lng degrees of longitude away, and
+    no further than widest_lat from the equator (each term of the haversine
+    formula at its minimum).
+    """
+    a = math.sin(math.radians(d_lat) / 2) ** 2 + math.cos(math.radians(lat)) \
+        * math.cos(math.radians(min(widest_lat, 90.0))) * math.sin(math.radians(min(d_lng, 180.0)) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class GeoIndex:
+    """
+    Grid index of items by location.
+
+    Args:
+        cell_degrees: Side of a grid cell in degrees; about the distance over
+                      which nearby queries usually find their neighbours.
+    """
+
+    def __init__(self, cell_degrees=0.01):
+        self.cell_degrees = cell_degrees
+        self.columns = round(360 / cell_degrees) # Cell columns around the globe
+        self.cells = {} # (row, col) -> {key: (lat, lng, item)}
+        self.cell_of = {} # key -> (row, col)
+        self.blocks = {} # (row // BLOCK_CELLS, col // BLOCK_CELLS) -> occupied cells in the block
+
+    def __len__(self):
+        return len(self.cell_of)
+
+    def _cell(self, lat, lng):
+        return self._wrap((math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees)))
+
+    def _wrap(self, cell):
+        """The same cell with its column brought into [-180, 180) degrees, so rings wrap at the antimeridian."""
+        row, col = cell
+        half = self.columns // 2
+        return (row, (col + half) % self.columns - half)
+
+    def add(self, key, lat, lng, item):
+        """Indexes item at (lat, lng) under key, replacing an earlier entry for key."""
+        self.remove(key)
+        cell = self._cell(lat, lng)
+        if cell not in self.cells:
+            self.cells[cell] = {}
+            self.blocks.setdefault(self._block(cell), set()).add(cell)
+        self.cells[cell][key] = (lat, lng, item)
+        self.cell_of[key] = cell
+
+    def remove(self, key):
+        cell = self.cell_of.pop(key, None)
+        if cell is None:
+            return
+        entries = self.cells[cell]
+        del entries[key]
+        if not entries:
+            del self.cells[cell]
+            block = self._block(cell)
+            self.blocks[block].discard(cell)
+            if not self.blocks[block]:
+                del self.blocks[block]
+
+    @staticmethod
+    def _block(cell):
+        return (cell[0] // BLOCK_CELLS, cell[1] // BLOCK_CELLS)
+
+    def _cell_distance_bound(self, lat, lng, cell, cells=1):
+        """A lower bound on the distance in meters from (lat, lng) to anything in a cell (or a block of cells x cells)."""
+        row, col = cell
+        size = self.cell_degrees * cells
+        south, north = row * size, (row + 1) * size
+        d_lat = max(south - lat, lat - north, 0.0)
+        west = col * size
+        d_lng = 0.0
+        if not west <= lng < west + size:
+            d_lng = min(_lng_delta(lng, west), _lng_delta(lng, west + size))
+        return _haversine_lower_bound(lat, d_lat, d_lng, max(abs(south), abs(north)))
+
+    def _beyond_ring_bound(self, lat, lng, center, ring):
+        """A lower bound on the distance in meters from (lat, lng) to anything `ring` or more cells from its cell."""
+        row, col = center
+        cell = self.cell_degrees
+        # Either `ring` rows away...
+        d_lat = min(lat - (row - ring + 1) * cell, (row + ring) * cell - lat)
+        # ...or `ring` columns away within the rows in between
+        d_lng = min(lng - (col - ring + 1) * cell, (col + ring) * cell - lng)
+        widest_lat = max(abs((row - ring + 1) * cell), abs((row + ring) * cell))
+        return min(_haversine_lower_bound(lat, d_lat, 0.0, 90.0), _haversine_lower_bound(lat, 0.0, d_lng, widest_lat))
+
+    def _ring(self, center, ring):
+        """The cells exactly `ring` cells from center (its perimeter square)."""
+        row, col = center
+        if ring == 0:
+            return [center]
+        cells = []
+        for d_col in range(-ring, ring + 1):
+            cells.append(self._wrap((row - ring, col + d_col)))
+            cells.append(self._wrap((row + ring, col + d_col)))
+        for d_row in range(-ring + 1, ring):
+            cells.append(self._wrap((row + d_row, col - ring)))
+            cells.append(self._wrap((row + d_row, col + ring)))
+        return cells
+
+    def nearest(self, lat, lng, k=10, max_meters=None):
+        """
+        Returns up to k [(distance in meters, item)] nearest (lat, lng), closest
+        first, optionally only those within max_meters.
+        """
+        if k <= 0 or not self.cells:
+            return []
+        lng = (lng + 180.0) % 360.0 - 180.0
+        best = [] # Max-heap of (-distance, tiebreak, item) holding the k closest so far
+        counter = 0
+
+        def consider(entries):
+            nonlocal counter
+            for item_lat, item_lng, item in entries.values():
+                distance = haversine_meters(lat, lng, item_lat, item_lng)
+                if max_meters is not None and distance > max_meters:
+                    continue
+                counter += 1
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, counter, item))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, counter, item))
+
+        def limit():
+            """Distance beyond which no further lead can make the result."""
+            if len(best) == k:
+                return -best[0][0]
+            return max_meters if max_meters is not None else math.inf
+
+        center = center_row, center_col = self._cell(lat, lng)
+        searched = set() # Occupied cells already considered (rings can meet across the antimeridian)
+        ring = 0
+        while True:
+            if ring > BLOCK_CELLS:
+                # Still short of k leads a block away: visit the rest closest first instead
+                pending = [(self._cell_distance_bound(lat, lng, block, BLOCK_CELLS), True, block) for block in self.blocks]
+                heapq.heapify(pending)
+                while pending:
+                    bound, is_block, place = heapq.heappop(pending)
+                    if bound > limit():
+                        break
+                    if not is_block:
+                        consider(self.cells[place])
+                        continue
+                    for cell in self.blocks[place]:
+                        if cell not in searched:
+                            heapq.heappush(pending, (self._cell_distance_bound(lat, lng, cell), False, cell))
+                break
+            for cell in self._ring(center, ring):
+                entries = self.cells.get(cell)
+                if entries and cell not in searched and self._cell_distance_bound(lat, lng, cell) <= limit():
+                    searched.add(cell)
+                    consider(entries)
+            ring += 1
+            if ring * self.cell_degrees > 180 or self._beyond_ring_bound(lat, lng, center, ring) > limit():
+                break
+
+        return [(-negative, item) for negative, _, item in sorted(best, reverse=True)]
+
+    def within(self, bounds):
+        """Returns the items inside (south, west, north, east); west > east crosses the antimeridian."""
+        south, west, north, east = bounds
+        lng_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        row_range = range(math.floor(south / self.cell_degrees), math.floor(north / self.cell_degrees) + 1)
+        col_ranges = [
+            range(math.floor(low / self.cell_degrees), math.floor(high / self.cell_degrees) + 1)
+            for low, high in lng_ranges
+        ]
+        if len(row_range) * sum(len(cols) for cols in col_ranges) > len(self.cells):
+            cells = self.cells.values()
+        else:
+            cells = [self.cells[(row, col)] for row in row_range for cols in col_ranges for col in cols
+                     if (row, col) in self.cells]
+        return [
+            item
+            for entries in cells
+            for item_lat, item_lng, item in entries.values()
+            if south <= item_lat <= north and any(low <= item_lng <= high for low, high in lng_ranges)
+        ]
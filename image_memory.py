@@ -0,0 +1,247 @@
+import asyncio
+import io
+import threading
+import time
+
+from PIL import Image
+
+from crawl_cache import content_digest
+
+# --- Bounded Image Memory ---
+# Every frame a place needs is held from the moment it is fetched until the
+# place leaves the pipeline, and the queues between stages hold many places.
+# To keep memory flat however long the crawl:
+#   - downloads and cache reads are streamed into pooled, reusable buffers and
+#     handed around as memoryviews of them, never copied into new bytes
+#   - a frame is decoded at most once; triage and vision share the decoded
+#     image, which is dropped as soon as vision is done with the place
+#   - encoded and decoded bytes are charged to a ByteBudget while held, and
+#     the imagery stage waits for room in it before fetching another place
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024 # Read size when streaming a response into a buffer
+
+
+class ByteBudget:
+    """
+    Bytes of image data held by places in the pipeline, with a soft limit.
+
+    charge/release may be called from any thread. wait_for_room() is awaited
+    by fetchers before they start on a place, never while they hold frames, so
+    a full budget pauses new fetches without blocking a thread or deadlocking
+    fetches already under way. Usage can overshoot the limit by at most the
+    frames of the places being fetched when it is reached.
+
+    Args:
+        limit_bytes: New places wait while this many bytes are held.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.lock = threading.Lock()
+        self.used = 0
+        self.waiters = [] # (loop, future) of coroutines waiting for room
+        self.stats = {'peak_bytes': 0, 'waits': 0, 'wait_seconds': 0.0}
+
+    def charge(self, size):
+        with self.lock:
+            self.used += size
+            if self.used > self.stats['peak_bytes']:
+                self.stats['peak_bytes'] = self.used
+
+    def release(self, size):
+        with self.lock:
+            self.used -= size
+            if self.used >= self.limit_bytes or not self.waiters:
+                return
+            waiters, self.waiters = self.waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    async def wait_for_room(self):
+        """Returns once fewer than limit_bytes are held."""
+        loop = asyncio.get_running_loop()
+        started = None
+        while True:
+            with self.lock:
+                if self.used < self.limit_bytes:
+                    break
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            if started is None:
+                started = time.monotonic()
+            await waiter
+        if started is not None:
+            with self.lock:
+                self.stats['waits'] += 1
+                self.stats['wait_seconds'] += time.monotonic() - started
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class PooledBuffer:
+    """A growable bytearray on loan from a BufferPool; data is exposed as memoryviews of it."""
+
+    def __init__(self, pool, storage):
+        self.pool = pool
+        self.storage = storage
+        self.length = 0
+
+    def _reserve(self, size):
+        if len(self.storage) < size:
+            grown = bytearray(max(size, len(self.storage) * 2))
+            grown[:self.length] = memoryview(self.storage)[:self.length]
+            self.storage = grown # Views handed out earlier keep the old storage alive
+
+    def view(self):
+        return memoryview(self.storage)[:self.length]
+
+    def read_chunks(self, chunks):
+        """Appends an iterable of byte chunks (e.g. response.iter_content()) and returns the view of all data."""
+        for chunk in chunks:
+            end = self.length + len(chunk)
+            self._reserve(end)
+            memoryview(self.storage)[self.length:end] = chunk
+            self.length = end
+        return self.view()
+
+    def read_file(self, f, size):
+        """Reads up to size bytes of an open binary file straight into the buffer and returns their view."""
+        self._reserve(size)
+        self.length = f.readinto(memoryview(self.storage)[:size])
+        return self.view()
+
+    def release(self):
+        if self.pool is not None:
+            self.pool._give_back(self)
+            self.pool = None
+
+
+class BufferPool:
+    """
+    Thread-safe free list of download buffers.
+
+    Args:
+        buffer_bytes: Initial size of a new buffer; buffers grow for larger images.
+        max_free: Free buffers kept for reuse; the rest are left to the GC.
+        max_pooled_bytes: Buffers that grew beyond this are not kept.
+    """
+
+    def __init__(self, buffer_bytes, max_free, max_pooled_bytes=None):
+        self.buffer_bytes = buffer_bytes
+        self.max_free = max_free
+        self.max_pooled_bytes = max_pooled_bytes or buffer_bytes * 8
+        self.lock = threading.Lock()
+        self.free = []
+        self.stats = {'allocated': 0, 'reused': 0}
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                self.stats['reused'] += 1
+                return PooledBuffer(self, self.free.pop())
+            self.stats['allocated'] += 1
+        return PooledBuffer(self, bytearray(self.buffer_bytes))
+
+    def _give_back(self, buffer):
+        storage, buffer.storage, buffer.length = buffer.storage, None, 0
+        if len(storage) > self.max_pooled_bytes:
+            return
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(storage)
+
+
+class _ViewReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview, so PIL can decode without a BytesIO copy."""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), len(self.view) - self.position)
+        if size <= 0:
+            return 0
+        b[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class Frame:
+    """
+    One encoded image held for a place, decoded at most once.
+
+    Args:
+        data: The encoded image, bytes or a memoryview of `buffer`.
+        budget: ByteBudget the encoded and decoded sizes are charged to.
+        buffer: PooledBuffer backing data, returned to its pool on release().
+    """
+
+    def __init__(self, data, budget, buffer=None):
+        self.data = data
+        self.budget = budget
+        self.buffer = buffer
+        self.lock = threading.Lock()
+        self._image = None
+        self._image_bytes = 0
+        self._digest = None
+        budget.charge(len(data))
+
+    def __len__(self):
+        return len(self.data) if self.data is not None else 0
+
+    def digest(self):
+        if self._digest is None:
+            self._digest = content_digest(self.data)
+        return self._digest
+
+    def image(self):
+        """Returns the decoded PIL image, decoding it on first use. Raises if the data is not an image."""
+        with self.lock:
+            if self._image is None:
+                image = Image.open(_ViewReader(self.data))
+                image.load()
+                self._image_bytes = image.width * image.height * len(image.getbands())
+                self.budget.charge(self._image_bytes)
+                self._image = image
+            return self._image
+
+    def drop_image(self):
+        """Frees the decoded image; the encoded data is kept (e.g. to save a lead's image)."""
+        with self.lock:
+            if self._image is not None:
+                self._image = None
+                self.budget.release(self._image_bytes)
+                self._image_bytes = 0
+
+    def release(self):
+        """Frees everything the frame holds. Safe to call more than once."""
+        self.drop_image()
+        with self.lock:
+            if self.data is None:
+                return
+            self.budget.release(len(self.data))
+            self.data = None
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
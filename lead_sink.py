@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+
+# --- Append-Only Lead Output ---
+# Leads are appended to a JSON Lines file, one object per line, so writing a
+# lead costs the same however many leads already exist. A place_id index is
+# built once when the file is opened. export_json() compacts the log into the
+# JSON array that app.py loads.
+#
+# A lead's 'confidence' holds the score of each classifier stage that passed
+# it (see VISION_STAGES in main.py); the CRM ranks leads by confidence_rank().
+
+logger = logging.getLogger(__name__)
+
+CONFIDENCE_RANK_STAGES = ('verify', 'screen') # The verification score ranks leads; the screen breaks ties
+
+
+def confidence_rank(confidence):
+    """Sort key of a lead's confidence dict, higher for more convincing leads. Unscored leads rank last."""
+    confidence = confidence or {}
+    return tuple(confidence.get(stage, -1.0) for stage in CONFIDENCE_RANK_STAGES)
+
+
+class LeadSink:
+    """
+    Append-only JSON Lines writer with an in-memory place_id index.
+
+    Args:
+        path: The .jsonl file to append to.
+        fsync_every: Number of appended leads between flush+fsync calls.
+        seed_json_path: Existing JSON array of leads used to create `path`
+                        the first time, so earlier leads are not lost.
+    """
+
+    def __init__(self, path, fsync_every=10, seed_json_path=None):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        self.place_ids = set()
+
+        if not os.path.exists(path) and seed_json_path and os.path.exists(seed_json_path):
+            self._seed_from_json(seed_json_path)
+        else:
+            self._load_index()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self.place_ids.add(json.loads(line).get('place_id'))
+                except ValueError:
+                    # Typically a line cut short by a crash; export_json skips it too
+                    logger.warning("Skipping unreadable line %d in %s", line_number, self.path)
+
+    def _seed_from_json(self, seed_json_path):
+        try:
+            with open(seed_json_path, 'r', encoding='utf-8') as f:
+                leads = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read %s to seed %s: %s", seed_json_path, self.path, e)
+            leads = []
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for lead in leads if isinstance(leads, list) else []:
+                if lead.get('place_id') not in self.place_ids:
+                    self.place_ids.add(lead.get('place_id'))
+                    f.write(json.dumps(lead, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logger.info("Seeded %s with %d leads from %s", self.path, len(self.place_ids), seed_json_path)
+
+    def __len__(self):
+        return len(self.place_ids)
+
+    def __contains__(self, place_id):
+        return place_id in self.place_ids
+
+    def add(self, lead):
+        """Appends a lead unless its place_id is already present. Returns True if written."""
+        place_id = lead.get('place_id')
+        if place_id in self.place_ids:
+            return False
+        self.file.write(json.dumps(lead, ensure_ascii=False) + '\n')
+        self.place_ids.add(place_id)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Flushes buffered lines and fsyncs them to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def read_leads(jsonl_path):
+    """Reads a JSON Lines lead log, keeping the first record per place_id."""
+    leads = []
+    seen = set()
+    if not os.path.exists(jsonl_path):
+        return leads
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                lead = json.loads(line)
+            except ValueError:
+                continue
+            if lead.get('place_id') in seen:
+                continue
+            seen.add(lead.get('place_id'))
+            leads.append(lead)
+    return leads
+
+
+def export_json(jsonl_path, json_path):
+    """
+    Compacts the lead log into a JSON array at json_path (atomically replaced).
+    Returns the number of leads written.
+    """
+    leads = read_leads(jsonl_path)
+    temp_path = json_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(leads, f, ensure_ascii=False, indent=4)
+    os.replace(temp_path, json_path)
+    return len(leads)
@@ -1,43 +1,115 @@
 import googlemaps
-import requests
 import time
+import asyncio
 import os
-import io
 import math
-from PIL import Image # Needed to load image bytes for moondream library
 import moondream as md # Import the moondream library
 import json
+import re
+import argparse
+import logging
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from rate_limiter import RateLimiter
+from transport import Transport, TransportError
+from crawl_cache import (
+    CrawlCache, content_digest, metadata_cache_key, image_cache_key, photo_cache_key, place_details_cache_key
+)
+from vision import VisionBatcher
+from vision_pool import Replica, VisionPool, VisionUnavailable
+from image_memory import DOWNLOAD_CHUNK_BYTES, BufferPool, ByteBudget, Frame
+from triage import ImageTriage
+from panorama import PanoramaPlanner, pano_location_key
+import run_state
+import tiling
+from run_state import RunStateStore
+from lead_sink import LeadSink, confidence_rank, export_json, read_leads
+from sharding import SHARD_MODES, Shard, shard_directories, shard_of
+from metrics import MetricsRegistry, format_duration
 
 # --- Configuration ---
 
+# Per-step messages are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
 # --- !!! SECURITY WARNING !!! ---
 # --- DO NOT HARDCODE REAL KEYS ---
 # --- Use Environment Variables or Secrets Management ---
 Maps_API_KEY = os.environ.get("Maps_API_KEY", "YOUR_Maps_API_KEY") # Replace or set env var
 # --- !!! END SECURITY WARNING !!! ---
 
-# Define the log file for processed place_ids
+# Per-place crawl status (discovered/detailed/imaged/classified/lead/failed), see run_state.py
+RUN_STATE_DB = "crawl_state.sqlite3"
+# Legacy log of processed place_ids, imported into RUN_STATE_DB the first time it is created
 PROCESSED_LOG_FILENAME = "processed_places.txt"
 
 # --- Local Moondream Server Details ---
 # !!! IMPORTANT: Replace with the actual URL your local server is running on !!!
 MOONDREAM_LOCAL_ENDPOINT = os.environ.get("MOONDREAM_ENDPOINT", "http://localhost:2020/v1") # Common default if using their server script directly
-VISION_PROMPT = "Analyze this street view image of a business. Does the building display a fabric awning — a cloth covering attached above the storefront? It should not be metal or vinyl. Answer with only YES or NO. If the presence is uncertain or the awning is only partially visible, answer NO. Do not include any additional text."
+MOONDREAM_MODEL_VERSION = os.environ.get("MOONDREAM_MODEL_VERSION", "default") # Bump when the served model changes
+# Vision replicas (see vision_pool.py): queries are spread over these servers
+# (comma-separated; empty for none) and, if MOONDREAM_LOCAL_MODEL names a model
+# (e.g. moondream2), over that model run in this process by moondream's local
+# Photon engine, which batches up to MOONDREAM_LOCAL_BATCH_SIZE queries at once.
+# All replicas must serve the same model: verdicts are memoized per model, not per replica.
+MOONDREAM_ENDPOINTS = [e.strip() for e in os.environ.get("MOONDREAM_ENDPOINTS", MOONDREAM_LOCAL_ENDPOINT).split(",") if e.strip()]
+MOONDREAM_LOCAL_MODEL = os.environ.get("MOONDREAM_LOCAL_MODEL")
+MOONDREAM_MODEL_PATH = os.environ.get("MOONDREAM_MODEL_PATH") # Weights file of the local model; downloaded if unset
+MOONDREAM_LOCAL_DEVICE = os.environ.get("MOONDREAM_LOCAL_DEVICE") # cuda, mps or cpu; chosen by moondream if unset
+MOONDREAM_LOCAL_BATCH_SIZE = int(os.environ.get("MOONDREAM_LOCAL_BATCH_SIZE", "4"))
+VISION_MODEL_KEY = f"{MOONDREAM_LOCAL_ENDPOINT}|{MOONDREAM_MODEL_VERSION}" # Verdict cache key of the served model
+# Cascaded classification: every frame is first screened at low resolution with
+# a short prompt; only frames that pass get the strict fabric verification at
+# full size. Both prompts ask for a 0-10 rating, stored as a 0-1 confidence.
+VISION_SCREEN_PROMPT = "Is there an awning or canopy above the storefront in this image? Rate from 0 (certainly not) to 10 (certainly yes). Answer with only the number."
+VISION_SCREEN_MAX_SIDE = 378 # Moondream's crop size: a frame this small is encoded in one pass, not tiled into crops
+VISION_SCREEN_THRESHOLD = float(os.environ.get("VISION_SCREEN_THRESHOLD", "0.3")) # Kept low: a screened-out awning is a lost lead
+VISION_PROMPT = "Analyze this street view image of a business. Does the building display a fabric awning — a cloth covering attached above the storefront? It should not be metal or vinyl. Rate from 0 (certainly no fabric awning) to 10 (certainly a fabric awning). If the awning is only partially visible or may be metal or vinyl, rate it low. Answer with only the number."
+VISION_VERIFY_THRESHOLD = float(os.environ.get("VISION_VERIFY_THRESHOLD", "0.6"))
+# stage -> (prompt, max image side or None for full size, pass threshold), in cascade order
+VISION_STAGES = {
+    'screen': (VISION_SCREEN_PROMPT, VISION_SCREEN_MAX_SIDE, VISION_SCREEN_THRESHOLD),
+    'verify': (VISION_PROMPT, None, VISION_VERIFY_THRESHOLD),
+}
 
 # --- End Local Moondream Server Details ---
 
-JSON_OUTPUT_FILENAME = "leads_with_awnings.json" # <--- Define the output filename
+LEADS_LOG_FILENAME = "leads_with_awnings.jsonl" # Append-only lead output (one JSON object per line)
+JSON_OUTPUT_FILENAME = "leads_with_awnings.json" # JSON array exported from LEADS_LOG_FILENAME for app.py
+LEADS_FSYNC_EVERY = 10 # Leads appended between fsyncs
 IMAGES_DIR = "saved_images"
 if not os.path.exists(IMAGES_DIR):
     os.makedirs(IMAGES_DIR)
 
+# Persistent cache of Street View metadata and downloaded imagery (see crawl_cache.py)
+CACHE_DIR = os.environ.get("CRAWL_CACHE_DIR", "crawl_cache")
+CACHE_TTL_DAYS = 180 # Refetch panoramas older than this
+CACHE_MAX_BYTES = 5 * 1024**3 # Least recently used images are evicted beyond this size
+CACHEABLE_METADATA_STATUSES = ('OK', 'ZERO_RESULTS', 'NOT_FOUND') # Never cache quota/auth errors
+DETAILS_CACHE_TTL_DAYS = 30 # Place Details (phone, photos) go stale sooner than panoramas
+
+# Every Place Details field any stage needs, requested in one call per place.
+# 'photo' returns the photo references get_place_photos falls back to.
+PLACE_DETAILS_FIELDS = ['name', 'formatted_address', 'formatted_phone_number', 'geometry/location', 'place_id', 'url', 'photo']
+
 
 # New Haven Location & Search Parameters
 CITIES_TO_SEARCH = {
     "New Haven": (41.3083, -72.9279),
     "Fairfield": (41.147, -73.251639)
 }
-SEARCH_RADIUS_METERS = 4000 # Adjust as needed
+SEARCH_RADIUS_METERS = 4000 # Half the side of the square searched around each city center
+# Adaptive tiling (see tiling.py): a search returning PLACES_RESULT_CAP results
+# may have been truncated, so its tile is split into quadrants, down to tiles
+# whose search circle is MIN_TILE_RADIUS_METERS.
+PLACES_RESULT_CAP = 60 # Nearby Search never returns more than 3 pages of 20
+MIN_TILE_RADIUS_METERS = 150
+DISCOVERY_CONCURRENCY = 4 # (city, business type) searches run at once; hides page-token delays
 BUSINESS_TYPES = [
     'restaurant', 'cafe', 'store', 'bakery', 'bar', 'clothing_store',
     'convenience_store', 'florist', 'hardware_store', 'book_store',
@@ -84,94 +156,433 @@ BUSINESS_TYPES = [
 # Street View Image Parameters
 STREET_VIEW_SIZE = "800x600"
 STREET_VIEW_FOV = 90
-
-# Delays to respect potential rate limits (in seconds)
-DELAY_BETWEEN_PLACES_PAGES = 1
-DELAY_AFTER_DETAIL_REQUEST = 0.1
-DELAY_AFTER_STREETVIEW_REQUEST = 0.5
+# Responses this small are Google's "no imagery" placeholder, not a frame
+STREET_VIEW_MIN_IMAGE_BYTES = 1000
+# A heading within this many degrees of a frame already fetched from the same
+# panorama (for a neighbouring business) reuses that frame (see panorama.py)
+HEADING_REUSE_TOLERANCE_DEG = 8
+
+# Per-endpoint request budgets (queries per second), shared by all pipeline workers.
+# Requests only wait when an endpoint's budget is used up; OVER_QUERY_LIMIT/429
+# responses halve that endpoint's rate and back off (see rate_limiter.py).
+API_QPS_BUDGETS = {
+    'places_nearby': 5,
+    'place_details': 10,
+    'streetview_metadata': 20,
+    'streetview_image': 10,
+    'place_photo': 5,
+}
+DELAY_BETWEEN_PLACES_PAGES = 1 # A next_page_token only becomes valid after a short delay
 DELAY_AFTER_VISION_REQUEST = 0 # Can likely be faster with local model, adjust if needed
+
+# Vision micro-batching (see vision.py): images from several headings and places
+# are grouped into one thread hop. Moondream answers one image per query, so a
+# batch only spreads its images over the replicas and waiting to fill it would
+# just add latency; a batch takes what is queued and goes at once.
+VISION_BATCH_SIZE = 8 # Max images per batch
+VISION_BATCH_MAX_WAIT_MS = 0 # Max time the first image of a batch waits for others (for a backend that batches)
+VISION_REPLICA_CONCURRENCY = 4 # Queries kept in flight per Moondream server (in-process replicas take 1)
+VISION_REPLICA_PROBE_SECONDS = 5 # First health check of a replica that went down; doubles while it stays down
+VISION_UNAVAILABLE_WAIT_SECONDS = 60 # How long queries wait for a replica once all are down
+VISION_EARLY_EXIT = True # Skip a place's remaining headings once one of them says YES
 CAMERA_DISTANCE = 15  # Distance in meters from the business for camera placement
 
-# --- Global Moondream Client (Optional Optimization) ---
-# Initialize once here to potentially improve performance vs initializing in the loop
-# If the server connection needs frequent re-establishment, keep initialization inside the function
-moondream_client = None
-try:
-    print(f"Attempting to connect to local Moondream server at {MOONDREAM_LOCAL_ENDPOINT}...")
-    # Note: md.vl might not actually establish a connection here, but on first use.
-    moondream_client = md.vl(endpoint=MOONDREAM_LOCAL_ENDPOINT)
-    print("Moondream client initialized (connection will be tested on first use).")
-except Exception as e:
-    print(f"ERROR: Could not initialize Moondream client. Is the server running at {MOONDREAM_LOCAL_ENDPOINT}? Error: {e}")
-    # The script will attempt to initialize again inside the function if this fails.
+# Pre-vision triage (see triage.py): frames that cannot show an awning are
+# dropped before they cost a Moondream call.
+TRIAGE_ENABLED = True
+TRIAGE_PLACEHOLDER_MAX_STD = 4.0 # Grayscale std below this = uniform "no imagery" tile
+TRIAGE_DUPLICATE_MAX_DISTANCE = 6 # dHash bits; same-place headings differ by 20+ in practice
+TRIAGE_MIN_GRADIENT = 4.0 # Frames below both of these are featureless (sky, wall, empty road)
+TRIAGE_MIN_ENTROPY = 2.5
+
+# Pipeline concurrency (workers per stage). Blocking calls run in threads, so
+# network fetches for one place overlap with vision inference for another.
+DETAILS_CONCURRENCY = 8
+IMAGERY_CONCURRENCY = 6
+VISION_CONCURRENCY = 16 # Places awaiting verdicts at once; their images share micro-batches
+PIPELINE_QUEUE_SIZE = 64 # Bounded queues apply backpressure between stages
+
+# Shared HTTP transport (see transport.py): one keep-alive connection pool for
+# every Google request, retries of transient failures and a circuit breaker
+# per upstream. Each rate-limited endpoint belongs to one upstream.
+HTTP_POOL_SIZE = DISCOVERY_CONCURRENCY + DETAILS_CONCURRENCY + IMAGERY_CONCURRENCY # Threads requesting at once
+HTTP_RETRIES = 3 # Retries of a connection error, timeout or HTTP 5xx
+HTTP_BACKOFF_SECONDS = 0.5 # Jittered exponential backoff between retries...
+HTTP_BACKOFF_MAX_SECONDS = 8 # ...capped here
+CIRCUIT_FAILURE_THRESHOLD = 5 # Failed attempts in a row that open an upstream's circuit
+CIRCUIT_RESET_SECONDS = 30 # How long an open circuit rejects calls before one trial call
+GOOGLE_UPSTREAMS = {
+    'places_nearby': 'places',
+    'place_details': 'places',
+    'place_photo': 'places',
+    'streetview_metadata': 'streetview',
+    'streetview_image': 'streetview',
+}
+# googlemaps raises these for network failures (it retries 5xx responses itself)
+GOOGLEMAPS_TRANSIENT_ERRORS = (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout)
+
+# Bounded image memory (see image_memory.py): frames are streamed into pooled
+# buffers, decoded once for triage and vision, and charged to this budget until
+# their place leaves the pipeline. The imagery stage starts no new place while
+# it is used up, so memory stays flat however many places are queued.
+IMAGE_MEMORY_BUDGET_BYTES = 256 * 1024**2 # A decoded 800x600 frame is ~1.4 MB, its JPEG ~0.1 MB
+IMAGE_BUFFER_BYTES = 256 * 1024 # Initial size of a pooled download buffer; grows for larger images
+IMAGE_BUFFER_POOL_SIZE = 64 # Free download buffers kept for reuse
+
+# Crawl metrics (see metrics.py), rewritten in the Prometheus text format with
+# every progress line and at the end of the run
+CRAWL_METRICS_FILE = os.environ.get("CRAWL_METRICS_FILE", "crawl_metrics.prom")
+PROGRESS_INTERVAL_SECONDS = 30 # How often the progress/ETA line is logged
+
+# Sharded crawls (see sharding.py): each shard keeps its run state, lead log and
+# metrics in SHARDS_DIR/<shard name>/ and shares IMAGES_DIR and the crawl cache.
+SHARDS_DIR = "shards"
+SHARD_TILE_DEPTH = 2 # 'tile' shards hand out the 16 tiles two levels below each city's root
+# API_QPS_BUDGETS apply per process, so N shards may send N times as many
+# requests (throttled responses still back each of them off). Set this when
+# the budgets must hold for the whole crawl; each shard then gets 1/N of them.
+SHARD_SPLIT_QPS_BUDGETS = False
+
+rate_limiter = RateLimiter(API_QPS_BUDGETS)
+transport = Transport(
+    pool_size=HTTP_POOL_SIZE,
+    retries=HTTP_RETRIES,
+    backoff_seconds=HTTP_BACKOFF_SECONDS,
+    backoff_max_seconds=HTTP_BACKOFF_MAX_SECONDS,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_seconds=CIRCUIT_RESET_SECONDS,
+)
+crawl_cache = CrawlCache(
+    CACHE_DIR, CACHE_TTL_DAYS * 24 * 3600, CACHE_MAX_BYTES, details_ttl_seconds=DETAILS_CACHE_TTL_DAYS * 24 * 3600
+)
+image_budget = ByteBudget(IMAGE_MEMORY_BUDGET_BYTES)
+buffer_pool = BufferPool(IMAGE_BUFFER_BYTES, IMAGE_BUFFER_POOL_SIZE)
+panorama_planner = PanoramaPlanner(crawl_cache, HEADING_REUSE_TOLERANCE_DEG, STREET_VIEW_MIN_IMAGE_BYTES)
+image_triage = ImageTriage(
+    placeholder_max_std=TRIAGE_PLACEHOLDER_MAX_STD,
+    duplicate_max_distance=TRIAGE_DUPLICATE_MAX_DISTANCE,
+    min_gradient=TRIAGE_MIN_GRADIENT,
+    min_entropy=TRIAGE_MIN_ENTROPY,
+)
+
+# --- Crawl Metrics ---
+crawl_metrics = MetricsRegistry()
+STEP_SECONDS = crawl_metrics.histogram(
+    'crawl_step_seconds',
+    "Wall time of one crawl step: a discovery tile search (all pages), a Place Details lookup, "
+    "a Street View metadata lookup, one image fetch or one vision query, cache hits included",
+    ('step',),
+)
+PLACES_QUEUED = crawl_metrics.counter(
+    'crawl_places_queued_total', "Places queued for the pipeline", ('source',)
+)
+PLACES_FINISHED = crawl_metrics.counter(
+    'crawl_places_finished_total', "Places that left the pipeline, by outcome", ('outcome',)
+)
+VISION_VERDICTS = crawl_metrics.counter(
+    'crawl_vision_verdicts_total', "Per-image vision verdicts", ('verdict', 'source')
+)
+VISION_STAGE_RESULTS = crawl_metrics.counter(
+    'crawl_vision_stage_results_total', "Per-image results of each classifier stage", ('stage', 'result', 'source')
+)
+
+
+def collect_component_stats():
+    """Exposes the counters the rate limiter, crawl cache, planner and triage keep themselves."""
+    limiter = rate_limiter.stats
+    cache = crawl_cache.stats
+    cache_lookups = [
+        ({'kind': kind, 'result': result}, cache[f"{kind}_{result}"])
+        for kind in ('metadata', 'details', 'image', 'verdict') for result in ('hits', 'misses')
+    ]
+    triage_outcomes = [({'outcome': k}, v) for k, v in image_triage.stats.items() if k != 'images']
+    return [
+        ('crawl_api_calls_total', 'counter', "Google API calls made, retries included",
+         [({'endpoint': name}, s['calls']) for name, s in limiter.items()]),
+        ('crawl_api_throttled_total', 'counter', "Google API calls answered with OVER_QUERY_LIMIT/429",
+         [({'endpoint': name}, s['throttled']) for name, s in limiter.items()]),
+        ('crawl_api_wait_seconds_total', 'counter', "Time spent waiting for an endpoint's rate budget",
+         [({'endpoint': name}, s['wait_seconds']) for name, s in limiter.items()]),
+        ('crawl_api_work_seconds_total', 'counter', "Time spent in Google API requests",
+         [({'endpoint': name}, s['work_seconds']) for name, s in limiter.items()]),
+        ('crawl_cache_lookups_total', 'counter', "Crawl cache lookups by kind and result", cache_lookups),
+        ('crawl_cache_bytes', 'gauge', "Bytes of imagery in the crawl cache", [({}, crawl_cache.total_bytes)]),
+        ('crawl_frames_total', 'counter', "Street View headings needed, and those served by a shared panorama frame",
+         [({'result': 'requested'}, panorama_planner.stats['requested']),
+          ({'result': 'shared'}, panorama_planner.stats['shared'])]),
+        ('crawl_triage_images_total', 'counter', "Images seen by triage, by outcome", triage_outcomes),
+        ('crawl_image_memory_bytes', 'gauge', "Bytes of encoded and decoded images held by places in the pipeline",
+         [({}, image_budget.used)]),
+        ('crawl_image_memory_waits_total', 'counter', "Places whose imagery waited for room in the image memory budget",
+         [({}, image_budget.stats['waits'])]),
+        ('crawl_image_memory_wait_seconds_total', 'counter', "Time imagery spent waiting for room in the image memory budget",
+         [({}, image_budget.stats['wait_seconds'])]),
+        ('crawl_vision_replica_queries_total', 'counter', "Vision queries sent to each replica, retries included",
+         [({'replica': r.name}, r.stats['queries']) for r in vision_pool.replicas]),
+        ('crawl_vision_replica_failures_total', 'counter', "Vision queries that failed on each replica",
+         [({'replica': r.name}, r.stats['failures']) for r in vision_pool.replicas]),
+        ('crawl_vision_replica_up', 'gauge', "1 if the vision replica is in rotation, 0 while it is down",
+         [({'replica': r.name}, int(r.healthy)) for r in vision_pool.replicas]),
+        ('crawl_vision_replica_in_flight', 'gauge', "Vision queries currently running on each replica",
+         [({'replica': r.name}, r.in_flight) for r in vision_pool.replicas]),
+        ('crawl_http_calls_total', 'counter', "Calls to each upstream through the shared transport",
+         [({'upstream': name}, s['calls']) for name, s in transport.stats.items()]),
+        ('crawl_http_retries_total', 'counter', "Retries of transient failures, by upstream",
+         [({'upstream': name}, s['retries']) for name, s in transport.stats.items()]),
+        ('crawl_http_failures_total', 'counter', "Calls that failed after every retry, by upstream",
+         [({'upstream': name}, s['failures']) for name, s in transport.stats.items()]),
+        ('crawl_circuit_open', 'gauge', "1 while an upstream's circuit is open or half-open, else 0",
+         [({'upstream': name}, int(b.state != 'closed')) for name, b in transport.breakers.items()]),
+        ('crawl_circuit_opened_total', 'counter', "Times an upstream's circuit opened",
+         [({'upstream': name}, b.stats['opened']) for name, b in transport.breakers.items()]),
+        ('crawl_circuit_rejected_total', 'counter', "Calls rejected while an upstream's circuit was open",
+         [({'upstream': name}, b.stats['rejected']) for name, b in transport.breakers.items()]),
+        ('crawl_image_buffers_total', 'counter', "Download buffers handed out, newly allocated or reused from the pool",
+         [({'result': 'allocated'}, buffer_pool.stats['allocated']),
+          ({'result': 'reused'}, buffer_pool.stats['reused'])]),
+    ]
+
+
+crawl_metrics.register_collector(collect_component_stats)
+
+# --- Moondream Replicas ---
+# Clients are created on each replica's first query (md.vl does not connect
+# before then either), and again after a replica recovers from going down.
+
+def create_local_moondream():
+    """Loads MOONDREAM_LOCAL_MODEL for inference in this process (md.vl without local=True would call Moondream Cloud)."""
+    runtime_config = {'max_batch_size': MOONDREAM_LOCAL_BATCH_SIZE}
+    if MOONDREAM_MODEL_PATH:
+        runtime_config['model_path'] = MOONDREAM_MODEL_PATH
+    if MOONDREAM_LOCAL_DEVICE:
+        runtime_config['device'] = MOONDREAM_LOCAL_DEVICE
+    return md.vl(local=True, model=MOONDREAM_LOCAL_MODEL, **runtime_config)
+
+def create_vision_pool():
+    replicas = [
+        Replica(endpoint, lambda endpoint=endpoint: md.vl(endpoint=endpoint), VISION_REPLICA_CONCURRENCY)
+        for endpoint in MOONDREAM_ENDPOINTS
+    ]
+    if MOONDREAM_LOCAL_MODEL:
+        replicas.append(Replica(f"local-{MOONDREAM_LOCAL_MODEL}", create_local_moondream, MOONDREAM_LOCAL_BATCH_SIZE))
+    return VisionPool(
+        replicas,
+        probe_interval=VISION_REPLICA_PROBE_SECONDS,
+        unavailable_wait=VISION_UNAVAILABLE_WAIT_SECONDS,
+    )
+
+vision_pool = create_vision_pool()
+logger.info("Vision replicas: %s", ", ".join(replica.name for replica in vision_pool.replicas))
 
 
 # --- Helper Functions ---
 
+def google_get(endpoint, url, params=None, timeout=15, stream=False, is_throttled=None):
+    """GET to a Google endpoint within its rate budget, through the shared transport."""
+    fn = lambda: transport.get(GOOGLE_UPSTREAMS[endpoint], url, params=params, timeout=timeout, stream=stream)
+    if is_throttled is None:
+        return rate_limiter.call(endpoint, fn)
+    return rate_limiter.call(endpoint, fn, is_throttled=is_throttled)
+
+def googlemaps_call(endpoint, fn):
+    """Runs a googlemaps client call within the endpoint's rate budget and its upstream's circuit breaker."""
+    return rate_limiter.call(
+        endpoint, lambda: transport.call(GOOGLE_UPSTREAMS[endpoint], fn, transient_errors=GOOGLEMAPS_TRANSIENT_ERRORS)
+    )
+
+_details_inflight = {} # place_id -> Future shared by concurrent callers
+_details_inflight_lock = threading.Lock()
+
+@STEP_SECONDS.time(step='details')
 def get_place_details(gmaps_client, place_id):
-    """Fetches detailed information for a place."""
+    """
+    Fetches detailed information for a place: all PLACE_DETAILS_FIELDS,
+    including photos, in one call.
+
+    Results are cached in crawl_cache for DETAILS_CACHE_TTL_DAYS, and callers
+    asking for a place that is already being fetched wait for that call.
+    """
+    cache_key = place_details_cache_key(place_id, PLACE_DETAILS_FIELDS)
+    cached = crawl_cache.get_details(cache_key)
+    if cached is not None:
+        return cached
+
+    with _details_inflight_lock:
+        future = _details_inflight.get(place_id)
+        owner = future is None
+        if owner:
+            future = Future()
+            _details_inflight[place_id] = future
+    if not owner:
+        return future.result()
+
+    result = None
     try:
-        fields = ['name', 'formatted_address', 'formatted_phone_number', 'geometry/location', 'place_id', 'url']
-        details = gmaps_client.place(place_id=place_id, fields=fields)
-        time.sleep(DELAY_AFTER_DETAIL_REQUEST) # Small delay
-        return details.get('result', {})
+        details = googlemaps_call(
+            'place_details', lambda: gmaps_client.place(place_id=place_id, fields=PLACE_DETAILS_FIELDS)
+        )
+        result = details.get('result', {})
+        if result:
+            crawl_cache.put_details(cache_key, result)
+    except TransportError:
+        raise # Places is unreachable: the caller defers the place instead of failing it
     except Exception as e:
-        print(f"    WARN: Could not retrieve details for Place ID {place_id}: {e}")
+        logger.warning("Could not retrieve details for Place ID %s: %s", place_id, e)
+    finally:
+        with _details_inflight_lock:
+            del _details_inflight[place_id]
+        future.set_result(result)
+    return result
+
+def _metadata_is_throttled(response):
+    """Street View metadata reports quota errors in its JSON body, not only as HTTP 429."""
+    if response.status_code == 429:
+        return True
+    try:
+        return response.json().get('status') == 'OVER_QUERY_LIMIT'
+    except ValueError:
+        return False
+
+def cached_frame(cache_key):
+    """Returns the image cached under cache_key as a Frame in a pooled buffer, or None on a miss."""
+    buffer = buffer_pool.acquire()
+    data = crawl_cache.get_image(cache_key, into=buffer)
+    if data is None:
+        buffer.release()
         return None
+    return Frame(data, image_budget, buffer)
 
-def get_street_view_with_targeted_heading(place_location, size, fov, api_key, heading_offsets=[-25, 0, 25]):
+def download_frame(endpoint, url, params=None, cache_key=None, min_cache_bytes=0):
     """
-    Gets Street View images using headings calculated towards the business,
-    plus offsets to the left and right.
+    Streams an image from Google into a pooled buffer and stores it in the
+    crawl cache under cache_key, unless it is no larger than min_cache_bytes.
 
-    Args:
-        place_location: Dict with 'lat' and 'lng' of the business
-        size: Image size string (e.g., "800x600")
-        fov: Field of view integer
-        api_key: Google Maps API key
-        heading_offsets: List of degree offsets relative to the calculated heading.
-                         Example: [-25, 0, 25] will try 25deg left, center, 25deg right.
+    Returns:
+        (status_code, Frame), where the frame is None unless the status is 200.
+    """
+    response = google_get(endpoint, url, params=params, stream=True)
+    try:
+        if response.status_code != 200:
+            return response.status_code, None
+        buffer = buffer_pool.acquire()
+        try:
+            data = buffer.read_chunks(response.iter_content(DOWNLOAD_CHUNK_BYTES))
+        except Exception:
+            buffer.release()
+            raise
+    finally:
+        response.close()
+    frame = Frame(data, image_budget, buffer)
+    if cache_key is not None and len(frame) > min_cache_bytes:
+        try:
+            crawl_cache.put_image(cache_key, frame.data)
+        except Exception:
+            frame.release()
+            raise
+    return 200, frame
+
+class MetadataUnavailable(Exception):
+    """A Street View metadata request failed, so whether there is a panorama is unknown."""
+
+
+def get_street_view_metadata(place_location, api_key, refresh=False, raise_errors=False):
+    """
+    Gets the metadata of the outdoor Street View panorama nearest a business.
+
+    Answers are cached in crawl_cache for CACHE_TTL_DAYS. With refresh, the
+    cached answer is ignored and replaced, so a newer panorama is seen.
 
     Returns:
-        List of tuples, where each tuple is (heading, image_bytes),
-        or an empty list if no suitable images are found.
+        The metadata dict (status 'OK', with 'pano_id', 'date' and 'location'),
+        or None if there is no panorama or the request failed. With
+        raise_errors, a failed request raises MetadataUnavailable instead.
     """
     if not place_location or not api_key or api_key == "YOUR_Maps_API_KEY":
-        print("    Skipping Street View: Missing location or API key.")
-        return []
+        logger.debug("Skipping Street View: Missing location or API key.")
+        return None
 
     lat = place_location.get('lat')
     lng = place_location.get('lng')
     if lat is None or lng is None:
-        print("    Skipping Street View: Missing lat/lng.")
-        return []
+        logger.debug("Skipping Street View: Missing lat/lng.")
+        return None
 
-    base_url = "https://maps.googleapis.com/maps/api/streetview"
     metadata_url = "https://maps.googleapis.com/maps/api/streetview/metadata"
-
-    # 1. Get Metadata for the nearest panorama
     metadata_params = {
         "location": f"{lat},{lng}",
         "key": api_key,
         "source": "outdoor" # Prefer outdoor panoramas
     }
-    pano_lat, pano_lng = None, None
+    metadata_key = metadata_cache_key(metadata_params["location"], metadata_params["source"])
     try:
-        metadata_response = requests.get(metadata_url, params=metadata_params, timeout=10)
-        metadata = metadata_response.json()
-
+        with STEP_SECONDS.time(step='metadata'):
+            metadata = None if refresh else crawl_cache.get_metadata(metadata_key)
+            if metadata is None:
+                metadata_response = google_get(
+                    'streetview_metadata', metadata_url, params=metadata_params, timeout=10,
+                    is_throttled=_metadata_is_throttled,
+                )
+                metadata = metadata_response.json()
+                if metadata.get('status') in CACHEABLE_METADATA_STATUSES:
+                    crawl_cache.put_metadata(metadata_key, metadata)
+
+        if metadata.get('status') not in CACHEABLE_METADATA_STATUSES:
+            raise MetadataUnavailable(f"status {metadata.get('status')}: {metadata.get('error_message', 'no message')}")
         if metadata.get('status') != 'OK':
-            print(f"    No Street View metadata found near business location ({metadata.get('status')}).")
+            logger.debug("No Street View metadata found near business location (%s).", metadata.get('status'))
             # Optional: Could try adding a radius to metadata search here, e.g., "radius": 50
-            return []
+            return None
 
-        pano_lat = float(metadata.get('location', {}).get('lat'))
-        pano_lng = float(metadata.get('location', {}).get('lng'))
-        print(f"    Found panorama at ({pano_lat:.5f}, {pano_lng:.5f}).")
+        pano_location = metadata.get('location', {})
+        if pano_location.get('lat') is None or pano_location.get('lng') is None:
+            logger.debug("Street View metadata has no panorama location.")
+            return None
+        return metadata
 
+    except TransportError:
+        raise # Street View is unreachable, which is not the same as "no panorama"
     except Exception as e:
-        print(f"    ERROR: Request failed for Street View metadata: {e}")
-        return []
+        if raise_errors:
+            if isinstance(e, MetadataUnavailable):
+                raise
+            raise MetadataUnavailable(str(e)) from e
+        logger.error("Request failed for Street View metadata: %s", e)
+        return None
+
+def get_street_view_with_targeted_heading(place_location, size, fov, api_key, heading_offsets=[-25, 0, 25], metadata=None):
+    """
+    Gets Street View images using headings calculated towards the business,
+    plus offsets to the left and right.
+
+    Args:
+        place_location: Dict with 'lat' and 'lng' of the business
+        size: Image size string (e.g., "800x600")
+        fov: Field of view integer
+        api_key: Google Maps API key
+        heading_offsets: List of degree offsets relative to the calculated heading.
+                         Example: [-25, 0, 25] will try 25deg left, center, 25deg right.
+        metadata: The panorama's metadata if the caller already has it
+                  (see get_street_view_metadata); fetched otherwise.
+
+    Returns:
+        List of tuples, where each tuple is (heading, Frame), or an empty list
+        if no suitable images are found. The caller releases the frames.
+
+    Raises:
+        TransportError: Street View could not be reached.
+    """
+    # 1. Get Metadata for the nearest panorama
+    if metadata is None:
+        metadata = get_street_view_metadata(place_location, api_key)
+        if metadata is None:
+            return []
+
+    lat = place_location['lat']
+    lng = place_location['lng']
+    base_url = "https://maps.googleapis.com/maps/api/streetview"
+    pano_lat = float(metadata['location']['lat'])
+    pano_lng = float(metadata['location']['lng'])
+    logger.debug("Found panorama at (%.5f, %.5f).", pano_lat, pano_lng)
 
     # 2. Calculate the base heading from panorama to business
     y = math.sin(math.radians(lng - pano_lng)) * math.cos(math.radians(lat))
@@ -179,335 +590,1066 @@ def get_street_view_with_targeted_heading(place_location, size, fov, api_key, he
         math.sin(math.radians(pano_lat)) * math.cos(math.radians(lat)) * math.cos(math.radians(lng - pano_lng))
     bearing = math.atan2(y, x)
     base_heading = (math.degrees(bearing) + 360) % 360
-    print(f"    Calculated base heading to business: {base_heading:.1f}°")
+    logger.debug("Calculated base heading to business: %.1f°", base_heading)
 
-    # 3. Request images for each heading offset
-    results = []
-    for offset in heading_offsets:
-        current_heading = (base_heading + offset + 360) % 360
-        heading_int = int(round(current_heading)) # API expects integer heading
+    # 3. Request images for each heading offset. Frames are requested by pano_id,
+    # so neighbouring businesses on the same panorama can share them.
+    pano_id = metadata.get('pano_id')
+    frame_location = pano_location_key(pano_id) if pano_id else f"{pano_lat},{pano_lng}"
 
+    @STEP_SECONDS.time(step='image_fetch')
+    def fetch_frame(heading_int):
+        """Returns a Frame from the cache or Street View, or None if there is no usable image."""
         params = {
-            # Use the actual panorama location for the request
-            "location": f"{pano_lat},{pano_lng}",
             "size": size,
             "fov": fov,
             "heading": str(heading_int),
             "pitch": "0", # Keep pitch level for simplicity
             "key": api_key,
-            "source": "outdoor"
         }
+        if pano_id:
+            params["pano"] = pano_id
+        else:
+            # Use the actual panorama location for the request
+            params["location"] = f"{pano_lat},{pano_lng}"
+            params["source"] = "outdoor"
 
+        frame = None
         try:
-            print(f"    Requesting Street View image with heading {heading_int}° (offset {offset}°)...")
-            response = requests.get(base_url, params=params, timeout=15)
-            time.sleep(DELAY_AFTER_STREETVIEW_REQUEST) # Respect delay
+            image_key = image_cache_key(frame_location, heading_int, fov, size)
+            frame = cached_frame(image_key)
+            if frame is not None:
+                status_code = 200
+                logger.debug("Using cached Street View image with heading %d°.", heading_int)
+            else:
+                logger.debug("Requesting Street View image with heading %d°...", heading_int)
+                status_code, frame = download_frame('streetview_image', base_url, params, image_key, STREET_VIEW_MIN_IMAGE_BYTES)
 
-            if response.status_code == 200:
+            if status_code == 200:
                 # Basic check for valid image vs. "no image" placeholder
-                if len(response.content) > 1000:
-                    print(f"      --> Success (heading {heading_int}°).")
-                    results.append((heading_int, response.content))
-                else:
-                    print(f"      --> Placeholder image received (heading {heading_int}°).")
-            elif response.status_code == 404:
-                 print(f"      --> Image not found (404) for heading {heading_int}°.")
+                if len(frame) > STREET_VIEW_MIN_IMAGE_BYTES:
+                    logger.debug("--> Success (heading %d°).", heading_int)
+                    return frame
+                logger.debug("--> Placeholder image received (heading %d°).", heading_int)
+            elif status_code == 404:
+                 logger.debug("--> Image not found (404) for heading %d°.", heading_int)
             else:
-                print(f"    WARN: Street View API returned status {response.status_code} for heading {heading_int}°")
+                logger.warning("Street View API returned status %s for heading %d°", status_code, heading_int)
 
+        except TransportError:
+            raise
         except Exception as e:
-            print(f"    ERROR: Request failed for Street View image (heading {heading_int}°): {e}")
+            logger.error("Request failed for Street View image (heading %d°): %s", heading_int, e)
+        if frame is not None:
+            frame.release()
+        return None
+
+    results = []
+    try:
+        for offset in heading_offsets:
+            current_heading = (base_heading + offset + 360) % 360
+            heading_int = int(round(current_heading)) % 360 # API expects integer heading
+
+            if pano_id:
+                frame_heading, content = panorama_planner.get_frame(pano_id, heading_int, fov, size, fetch_frame)
+                if frame_heading != heading_int:
+                    logger.debug("Heading %d° (offset %d°) served by the panorama's %d° frame.", heading_int, offset, frame_heading)
+            else:
+                frame_heading, content = heading_int, fetch_frame(heading_int)
+
+            if content is None:
+                continue
+            if all(frame_heading != heading for heading, _ in results):
+                results.append((frame_heading, content))
+            else:
+                content.release() # Two offsets served by the same shared frame
+    except Exception:
+        for _, frame in results:
+            frame.release()
+        raise
 
     if not results:
-        print("    No valid Street View images retrieved after checking bracketed headings.")
+        logger.debug("No valid Street View images retrieved after checking bracketed headings.")
 
     return results
 
-def get_place_photos(gmaps_client, place_id, max_photos=2):
-    """Gets photos specific to the place from Google Places API as a fallback"""
+def get_place_photos(gmaps_client, place_id, max_photos=2, place_details=None):
+    """
+    Gets photos specific to the place from Google Places API as a fallback.
+
+    The photo references come from place_details when it was fetched with
+    PLACE_DETAILS_FIELDS; otherwise (e.g. details stored by an older run)
+    get_place_details is consulted, which is usually a cache hit.
+
+    Returns [(label, Frame)]; the caller releases the frames.
+    """
+    photo_frames = []
     try:
-        place_details = gmaps_client.place(
-            place_id=place_id, 
-            fields=['photos']
-        )
-        photos = place_details.get('result', {}).get('photos', [])
+        if not place_details or 'photos' not in place_details:
+            place_details = get_place_details(gmaps_client, place_id) or {}
+        photos = place_details.get('photos', [])
         photo_references = [p.get('photo_reference') for p in photos[:max_photos]]
         
-        photo_bytes_list = []
         for i, ref in enumerate(photo_references):
             if ref:
+                photo_key = photo_cache_key(ref, 600)
+                frame = cached_frame(photo_key)
+                if frame is not None:
+                    logger.debug("Place photo %d loaded from cache.", i + 1)
+                    photo_frames.append((f"place_photo_{i}", frame))
+                    continue
                 photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=600&photoreference={ref}&key={Maps_API_KEY}"
-                response = requests.get(photo_url, timeout=15)
-                if response.status_code == 200:
-                    print(f"    Place photo {i+1} retrieved.")
-                    photo_bytes_list.append((f"place_photo_{i}", response.content))
+                _, frame = download_frame('place_photo', photo_url, cache_key=photo_key)
+                if frame is not None:
+                    logger.debug("Place photo %d retrieved.", i + 1)
+                    photo_frames.append((f"place_photo_{i}", frame))
         
-        return photo_bytes_list
+        return photo_frames
     except Exception as e:
-        print(f"    Error fetching place photos: {e}")
+        for _, frame in photo_frames:
+            frame.release()
+        if isinstance(e, TransportError):
+            raise
+        logger.error("Error fetching place photos: %s", e)
         return []
 
-def analyze_image_with_local_moondream(image_bytes, prompt, local_endpoint):
+def parse_vision_confidence(answer):
+    """
+    Reads a 0-10 rating in a Moondream answer as a confidence between 0 and 1.
+    An answer without a number counts as 1 if it says YES, else 0.
+    """
+    if not answer:
+        return 0.0
+    match = re.search(r"\d+(?:\.\d+)?", answer)
+    if match:
+        return min(max(float(match.group()) / 10, 0.0), 1.0)
+    return 1.0 if "YES" in answer.strip().upper() else 0.0
+
+def vision_prompt_digest(stage):
+    """Verdict cache key of a stage's prompt; the screen's image size is part of it."""
+    prompt, max_side, _ = VISION_STAGES[stage]
+    return content_digest(prompt if max_side is None else f"{prompt}|{max_side}px")
+
+def query_local_moondream(image, prompt):
+    """Sends one decoded PIL image to the least-loaded healthy Moondream replica and returns the raw answer text."""
+    logger.debug("Sending image to a Moondream replica (prompt: '%s')...", prompt)
+    answer = vision_pool.query(image, prompt)
+    time.sleep(DELAY_AFTER_VISION_REQUEST) # Small delay
+    return answer
+
+def run_vision_stage(frame, stage):
     """
-    Analyzes an image using a local Moondream server via the moondream library.
+    Returns (confidence, source) of one cascade stage for a frame, where source
+    is 'cache' or 'model'. Answers are memoized per stage in crawl_cache by
+    (image digest, prompt digest, model); the frame is only decoded on a miss.
+    Raises if the query fails.
     """
-    global moondream_client # Use the globally initialized client if available
+    prompt, max_side, threshold = VISION_STAGES[stage]
+    image_digest = frame.digest()
+    prompt_digest = vision_prompt_digest(stage)
+    model_key = f"{VISION_MODEL_KEY}|{stage}"
+    cached = crawl_cache.get_verdict(image_digest, prompt_digest, model_key)
+    if cached is not None:
+        answer, _ = cached
+        logger.debug("Cached Moondream %s answer: '%s'", stage, answer)
+        return parse_vision_confidence(answer), 'cache' # Re-read, so a changed threshold applies
+
+    image = frame.image()
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side))
+    answer = query_local_moondream(image, prompt)
+    logger.debug("Moondream %s answer: '%s'", stage, answer)
+    confidence = parse_vision_confidence(answer)
+    crawl_cache.put_verdict(image_digest, prompt_digest, model_key, answer, confidence >= threshold)
+    return confidence, 'model'
+
+@STEP_SECONDS.time(step='vision')
+def analyze_image_with_local_moondream(frame):
+    """
+    Classifies a Frame with the VISION_STAGES cascade on the Moondream replicas
+    via the moondream library. A frame below a stage's threshold skips the
+    stages after it.
 
-    if not image_bytes:
-        print("    Skipping vision analysis: Missing image data.")
-        return False
+    Returns:
+        {'has_awning': True/False, or None if a query failed (failed queries
+        are not memoized), 'confidence': {stage: 0-1 confidence of each stage
+        that ran}}.
+    """
+    result = {'has_awning': False, 'confidence': {}}
+    if not frame:
+        logger.debug("Skipping vision analysis: Missing image data.")
+        return result
 
-    try:
-        # Initialize client if global initialization failed or wasn't done
-        if moondream_client is None:
-            print(f"    Initializing Moondream client for endpoint {local_endpoint}...")
-            client = md.vl(endpoint=local_endpoint)
+    sources = set()
+    for stage, (_, _, threshold) in VISION_STAGES.items():
+        try:
+            confidence, source = run_vision_stage(frame, stage)
+        except VisionUnavailable as e:
+            # Logged by the pool when the last replica went down
+            logger.debug("Vision unavailable: %s", e)
+        except Exception as e:
+            logger.error("Failed during Moondream %s analysis: %s", stage, e)
         else:
-            client = moondream_client # Use globally initialized client
+            result['confidence'][stage] = confidence
+            sources.add(source)
+            passed = confidence >= threshold
+            VISION_STAGE_RESULTS.inc(stage=stage, result='pass' if passed else 'reject', source=source)
+            if passed:
+                continue
+            VISION_VERDICTS.inc(verdict='no', source='model' if 'model' in sources else 'cache')
+            return result
+        VISION_STAGE_RESULTS.inc(stage=stage, result='failed', source='model')
+        VISION_VERDICTS.inc(verdict='failed', source='model')
+        result['has_awning'] = None
+        return result
 
-        # Load image bytes into a PIL Image object
-        image = Image.open(io.BytesIO(image_bytes))
+    result['has_awning'] = True
+    VISION_VERDICTS.inc(verdict='yes', source='model' if 'model' in sources else 'cache')
+    return result
 
-        print(f"    Sending image to local Moondream server (prompt: '{prompt}')...")
-        # Use the 'ask' method for question answering
-        answer = client.query(image, prompt)
-        answer = answer["answer"]
-        time.sleep(DELAY_AFTER_VISION_REQUEST) # Small delay
+_vision_executor = None
 
-        print(f"    Local Moondream server response: '{answer}'")
+def analyze_images_with_local_moondream(frames):
+    """
+    Analyzes a micro-batch of images on the Moondream replicas.
 
-        # Parse the response - assumes simple YES/NO answer based on prompt
-        if answer and "YES" in answer.strip().upper():
-            return True
-        else:
-            return False
+    A replica answers one image per query, so the batch is spread over a
+    small persistent thread pool that keeps every replica's share of queries
+    (vision_pool.capacity in total) in flight.
 
-    except Exception as e:
-        print(f"    ERROR: Failed during local Moondream analysis: {e}")
-        print(f"    Is the Moondream server running and accessible at {local_endpoint}?")
-        # If connection fails consistently, prevent further attempts by nullifying global client
-        if "connection" in str(e).lower():
-            moondream_client = None
-            print("    Cleared global Moondream client due to connection error.")
-        return False
+    Returns:
+        List of results of analyze_image_with_local_moondream, in the same
+        order as frames.
+    """
+    global _vision_executor
 
+    if len(frames) == 1:
+        return [analyze_image_with_local_moondream(frames[0])]
 
-# --- Main Execution Logic ---
+    if _vision_executor is None:
+        _vision_executor = ThreadPoolExecutor(max_workers=vision_pool.capacity, thread_name_prefix="moondream")
+    return list(_vision_executor.map(analyze_image_with_local_moondream, frames))
 
-def main():
-    """Main function to find leads and analyze images."""
-    global moondream_client # Allow main to potentially clear the client on widespread failure
 
-    if Maps_API_KEY == "YOUR_Maps_API_KEY":
-        print("ERROR: Please configure your Maps_API_KEY in the script or environment variables.")
-        return
+# --- Concurrent Pipeline ---
+# discovery -> details -> imagery -> vision -> persistence
+# Each stage is a pool of asyncio workers reading from a bounded queue. The
+# Google/Moondream helpers above are blocking, so workers run them in threads.
 
-    # Check if we even have a valid moondream client configuration attempt
-    # The actual connection test happens on first use inside analyze_image_with_local_moondream
-    if moondream_client is None:
-         # Attempt to initialize again here just in case global failed silently before print
-         try:
-             moondream_client = md.vl(endpoint=MOONDREAM_LOCAL_ENDPOINT)
-             print("Moondream client late initialization attempt successful (connection pending use).")
-         except Exception as e:
-            print(f"ERROR: Failed to initialize Moondream client in main. Vision analysis will likely fail. Error: {e}")
-            # Proceed without vision if client can't be initialized, or exit? Let's proceed but it will fail later.
+_STAGE_DONE = object() # Sentinel passed down the queues once a stage has drained
 
+async def _run_stage(name, worker, in_queue, out_queue, concurrency, on_error=None, on_done=None):
+    """
+    Runs `concurrency` copies of `worker` over items from `in_queue`.
+
+    Items for which the worker returns None are dropped; everything else is
+    forwarded to `out_queue`. When the upstream sentinel arrives, every worker
+    exits and a single sentinel is passed downstream. If the worker raises,
+    on_error(item, exception) is called and the item is dropped. on_done(item)
+    is called for every item that goes no further: dropped, failed, or
+    handled by the last stage.
+    """
+    async def worker_loop():
+        while True:
+            item = await in_queue.get()
+            if item is _STAGE_DONE:
+                await in_queue.put(_STAGE_DONE) # Let sibling workers see it too
+                return
+            try:
+                result = await worker(item)
+            except Exception as e:
+                logger.error("%s stage failed for Place ID %s: %s", name, item.get('place_id'), e)
+                if on_error is not None:
+                    on_error(item, e)
+                result = None
+            if result is not None and out_queue is not None:
+                await out_queue.put(result)
+            elif on_done is not None:
+                on_done(item)
+
+    await asyncio.gather(*(worker_loop() for _ in range(concurrency)))
+    if out_queue is not None:
+        await out_queue.put(_STAGE_DONE)
+
+
+async def search_places_nearby(gmaps, location, radius, biz_type):
+    """Returns all results (up to 3 pages) of one Nearby Search and the number of API calls made."""
+    response = await asyncio.to_thread(
+        googlemaps_call, 'places_nearby',
+        lambda: gmaps.places_nearby(location=location, radius=radius, type=biz_type)
+    )
+    calls = 1
+    results = response.get('results', [])
+    next_page_token = response.get('next_page_token')
+    while next_page_token:
+        # The next page token only becomes valid after a short delay
+        await asyncio.sleep(DELAY_BETWEEN_PLACES_PAGES)
+        response = await asyncio.to_thread(
+            googlemaps_call, 'places_nearby', lambda: gmaps.places_nearby(page_token=next_page_token)
+        )
+        calls += 1
+        results.extend(response.get('results', []))
+        next_page_token = response.get('next_page_token')
+    return results, calls
 
-    print("Initializing Google Maps Client...")
-    try:
-        gmaps = googlemaps.Client(key=Maps_API_KEY)
-    except Exception as e:
-        print(f"FATAL: Error initializing Google Maps client: {e}")
-        return
 
-    # Load already processed place_ids
-    processed_place_ids = set()
-    if os.path.exists(PROCESSED_LOG_FILENAME):
-        with open(PROCESSED_LOG_FILENAME, 'r') as f:
-            for line in f:
-                place_id = line.strip()
-                if place_id:
-                    processed_place_ids.add(place_id)
-    print(f"Loaded {len(processed_place_ids)} previously processed place IDs from {PROCESSED_LOG_FILENAME}")
+async def discover_places(gmaps, state, out_queue, resume_only=False, retry_failed=False, shard=None, rescan_since=None):
+    """
+    Queues unfinished places from earlier runs, then searches every (city,
+    business type) pair tile by tile and queues each place_id not seen before.
+
+    Resumed places carry their stored details, so they skip the Places call.
+    Tiles recorded as done by earlier runs are not searched again. A place is
+    attributed to the first city whose search returned it. With a shard (see
+    sharding.py), only the shard's cities, tiles or place_ids are crawled.
 
+    With rescan_since (the re-scan's start time), places classified without
+    an awning are queued again with the pano_id they were imaged from, and
+    tiles searched before rescan_since are searched again for new places.
+    """
+    stats = {'tiles_searched': 0, 'tiles_split': 0, 'tiles_skipped': 0, 'nearby_calls': 0, 'other_shards': 0}
 
-    all_potential_places = {} # Use dict keyed by place_id to avoid duplicates
+    city_roots = {city: tiling.root_bounds(location, SEARCH_RADIUS_METERS) for city, location in CITIES_TO_SEARCH.items()}
 
-    for city_name, city_location in CITIES_TO_SEARCH.items():
-        print(f"\n{'='*20} Processing City: {city_name} {'='*20}")
+    def owns_stored(row):
+        if shard is None:
+            return True
+        location = (row['details'] or {}).get('geometry', {}).get('location')
+        return shard.owns_stored_place(row['place_id'], row['city'], location, city_roots)
+
+    resumed = 0
+    for row in state.resumable(include_failed=retry_failed):
+        if not owns_stored(row):
+            continue
+        resumed += 1
+        PLACES_QUEUED.inc(source='resumed')
+        await out_queue.put({
+            'place_id': row['place_id'],
+            'city': row['city'],
+            'name': row['name'] or 'N/A',
+            'details': row['details'],
+        })
+    if resumed:
+        logger.info("Resuming %d unfinished places from %s", resumed, state.path)
+
+    if rescan_since is not None:
+        rescanned = 0
+        for row in state.rescannable():
+            if not owns_stored(row):
+                continue
+            rescanned += 1
+            PLACES_QUEUED.inc(source='rescan')
+            await out_queue.put({
+                'place_id': row['place_id'],
+                'city': row['city'],
+                'name': row['name'] or 'N/A',
+                'details': row['details'],
+                'rescan': True,
+                'pano_id': row['pano_id'],
+            })
+        logger.info("Re-scanning %d classified places; only those whose panorama changed are imaged again", rescanned)
+
+    if resume_only:
+        await out_queue.put(_STAGE_DONE)
+        return
+
+    async def queue_new_places(city_name, results, start_bounds, root_bounds):
+        queued = 0
+        for place_summary in results:
+            place_id = place_summary.get('place_id')
+            if not place_id:
+                continue
+            location = place_summary.get('geometry', {}).get('location')
+            if shard is not None and not shard.owns_place(place_id, location, start_bounds, root_bounds):
+                stats['other_shards'] += 1
+                continue
+            if state.status_of(place_id) is None:
+                state.mark(place_id, run_state.DISCOVERED, city=city_name, name=place_summary.get('name'))
+                PLACES_QUEUED.inc(source='discovered')
+                await out_queue.put({
+                    'place_id': place_id,
+                    'city': city_name,
+                    'name': place_summary.get('name', 'N/A'),
+                })
+                queued += 1
+        return queued
+
+    async def search_city_type(city_name, city_location, biz_type):
+        root = city_roots[city_name]
+        start_quadkeys = shard.start_quadkeys(city_name) if shard is not None else [""]
+        pending = list(reversed(start_quadkeys)) # Quadkeys still to visit, depth-first
+        while pending:
+            quadkey = pending.pop()
+            tile_id = tiling.tile_id(city_name, biz_type, quadkey)
+            tile_status = state.tile_status(tile_id, since=rescan_since)
+            if tile_status == run_state.TILE_DONE:
+                stats['tiles_skipped'] += 1
+                continue
+            if tile_status == run_state.TILE_SPLIT:
+                pending.extend(reversed(tiling.child_quadkeys(quadkey)))
+                continue
 
-        print("Searching for businesses in New Haven...")
-        # (Places search loop remains the same as the previous version)
-        for biz_type in BUSINESS_TYPES:
-            print(f"\n--- Searching for type: {biz_type} ---")
+            bounds = tiling.bounds_for_quadkey(root, quadkey)
+            radius = tiling.tile_search_radius(bounds)
             try:
-                response = gmaps.places_nearby(location=city_location, radius=SEARCH_RADIUS_METERS, type=biz_type)
-                next_page_token = response.get('next_page_token')
-                places_this_page = response.get('results', [])
-
-                while True:
-                    print(f"  Processing {len(places_this_page)} potential places...")
-                    for place_summary in places_this_page:
-                        place_id = place_summary.get('place_id')
-                        if place_id and place_id not in processed_place_ids:
-                            processed_place_ids.add(place_id)
-                            # print(f"  Found new potential: {place_summary.get('name', 'N/A')} (ID: {place_id})")
-                            place_details = get_place_details(gmaps, place_id)
-                            if place_details:
-                                all_potential_places[place_id] = place_details
-                        elif place_id:
-                            print(f"  Skipping already processed place: {place_summary.get('name', 'N/A')} (ID: {place_id})")
-
-                    if next_page_token:
-                        # print("  Fetching next page...")
-                        time.sleep(DELAY_BETWEEN_PLACES_PAGES)
-                        response = gmaps.places_nearby(page_token=next_page_token)
-                        next_page_token = response.get('next_page_token')
-                        places_this_page = response.get('results', [])
-                    else:
-                        break
+                with STEP_SECONDS.time(step='discovery'):
+                    results, calls = await search_places_nearby(gmaps, tiling.tile_center(bounds), round(radius), biz_type)
             except Exception as e:
-                print(f"ERROR: An error occurred searching for {biz_type}: {e}")
+                # Left unrecorded, so the next run searches this tile again
+                logger.error("An error occurred searching for %s in %s tile '%s': %s", biz_type, city_name, quadkey, e)
+                continue
+            stats['tiles_searched'] += 1
+            stats['nearby_calls'] += calls
 
+            start_bounds = tiling.bounds_for_quadkey(root, quadkey[:len(start_quadkeys[0])])
+            queued = await queue_new_places(city_name, results, start_bounds, root)
+            saturated = len(results) >= PLACES_RESULT_CAP and radius / 2 >= MIN_TILE_RADIUS_METERS
+            logger.info("%s / %s tile '%s' (r=%.0fm): %d results, %d new%s", city_name, biz_type, quadkey or 'root',
+                        radius, len(results), queued, ' - saturated, splitting' if saturated else '')
+            if saturated:
+                stats['tiles_split'] += 1
+                pending.extend(reversed(tiling.child_quadkeys(quadkey)))
+            state.mark_tile(tile_id, run_state.TILE_SPLIT if saturated else run_state.TILE_DONE, len(results))
 
-        print(f"\nFound {len(all_potential_places)} unique potential businesses. Now checking Street View and Local Moondream...")
+    semaphore = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
 
-        leads_with_awnings = []
-        checked_count = 0
-        awning_found_count = 0
-        vision_connection_failed_persistently = False
+    async def bounded_search(city_name, city_location, biz_type):
+        async with semaphore:
+            await search_city_type(city_name, city_location, biz_type)
 
-        for place_id, place_info in all_potential_places.items():
-            checked_count += 1
-            print(f"\n[{checked_count}/{len(all_potential_places)}] Checking: {place_info.get('name', 'N/A')}")
+    for city_name, city_location in CITIES_TO_SEARCH.items():
+        if shard is not None and not shard.owns_city(CITIES_TO_SEARCH, city_name):
+            continue
+        logger.info("%s Discovering City: %s %s", '=' * 20, city_name, '=' * 20)
+        # Cities run one after another so a place found in both keeps the first city
+        await asyncio.gather(*(bounded_search(city_name, city_location, biz_type) for biz_type in BUSINESS_TYPES))
 
-            if vision_connection_failed_persistently:
-                print("    Skipping vision check due to persistent connection errors.")
-                continue # Skip remaining checks if server seems down
+    logger.info("Discovery: searched %d tiles (%d split) with %d Nearby Search calls; %d tiles already done.",
+                stats['tiles_searched'], stats['tiles_split'], stats['nearby_calls'], stats['tiles_skipped'])
+    if stats['other_shards']:
+        logger.info("Discovery: left %d search results to other shards.", stats['other_shards'])
+    await out_queue.put(_STAGE_DONE)
 
-            place_location = place_info.get('geometry', {}).get('location')
-            if not place_location:
-                print("    Skipping: No location data available.")
-                continue
 
-            # 1. Get Street View Images with targeted heading
-            image_data_list = get_street_view_with_targeted_heading(place_location, STREET_VIEW_SIZE, STREET_VIEW_FOV, Maps_API_KEY)
-            
+async def run_pipeline(gmaps, state, lead_sink, resume_only=False, retry_failed=False, shard=None, rescan=False):
+    """
+    Runs the staged crawl and returns a stats dict for the final summary.
+
+    Produces the same leads as checking each place one at a time: every new
+    place_id is detailed, imaged and classified exactly once, and leads are
+    appended to `lead_sink` by a single persistence worker. Each stage
+    transition is recorded in `state` (a RunStateStore).
+
+    With rescan, places classified by earlier runs cost one (uncached)
+    Street View metadata call each and are only imaged and classified again
+    if their panorama changed since.
+    """
+    stats = {
+        'discovered': 0,
+        'checked': 0,
+        'awnings_found': 0,
+        'leads_written': 0,
+        'vision_deferred': 0,
+        'rescan_unchanged': 0,
+        'rescan_changed': 0,
+        'rescan_baseline': 0,
+        'transport_deferred': 0,
+    }
+
+    details_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    imagery_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    vision_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    persist_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    def mark_failed(place, error):
+        state.mark(place['place_id'], run_state.FAILED, error=str(error))
+        PLACES_FINISHED.inc(outcome='failed')
+
+    def defer(place, error):
+        """An upstream is down: leave the place at its last state, so the next run resumes it."""
+        logger.warning("Deferring %s to the next run: %s", (place.get('details') or {}).get('name', place.get('name') or place['place_id']), error)
+        stats['transport_deferred'] += 1
+        PLACES_FINISHED.inc(outcome='deferred')
+
+    def release_images(place):
+        """Returns a place's image memory once it has left the pipeline."""
+        for _, frame in place.pop('images', None) or ():
+            frame.release()
+
+    async def details_worker(place):
+        stats['discovered'] += 1
+        if place.get('details'):
+            return place # Resumed with details stored by an earlier run
+        try:
+            place_details = await asyncio.to_thread(get_place_details, gmaps, place['place_id'])
+        except TransportError as e:
+            defer(place, e)
+            return None
+        if not place_details:
+            mark_failed(place, "details unavailable")
+            return None
+        place['details'] = place_details
+        # A re-scanned place (imported from the processed log without details) stays classified
+        state.mark(place['place_id'], run_state.CLASSIFIED if place.get('rescan') else run_state.DETAILED, details=place_details)
+        return place
+
+    async def triage_images(place_info, images):
+        """Drops placeholder, duplicate and featureless frames before they reach vision."""
+        if not TRIAGE_ENABLED or not images:
+            return images
+        kept, rejected = await asyncio.to_thread(image_triage.filter, images)
+        kept_frames = {id(frame) for _, frame in kept}
+        for _, frame in images:
+            if id(frame) not in kept_frames:
+                frame.release()
+        if rejected and logger.isEnabledFor(logging.DEBUG):
+            reasons = ", ".join(f"{count} {reason}" for reason, count in rejected.items())
+            logger.debug("Triage skipped %d of %d images for %s (%s).", len(images) - len(kept), len(images), place_info.get('name', 'N/A'), reasons)
+        return kept
+
+    async def imagery_worker(place):
+        place_info = place['details']
+        place_location = place_info.get('geometry', {}).get('location')
+        if not place_location:
+            logger.info("Skipping %s: No location data available.", place_info.get('name', 'N/A'))
+            mark_failed(place, "no location data")
+            return None
+
+        # 1. Find the nearest panorama. A re-scanned place stops here unless it changed
+        # ('' records that there was none, so that is compared as well).
+        rescan = place.get('rescan', False)
+        try:
+            metadata = await asyncio.to_thread(get_street_view_metadata, place_location, Maps_API_KEY, rescan, rescan)
+        except (TransportError, MetadataUnavailable) as e:
+            defer(place, e) # A re-scanned place stays 'classified' and is checked again next re-scan
+            return None
+        pano_id = metadata.get('pano_id', '') if metadata else ''
+        pano_date = metadata.get('date') if metadata else None
+        if rescan:
+            if place['pano_id'] is None:
+                # Classified before panoramas were recorded: this one becomes the baseline
+                state.mark(place['place_id'], run_state.CLASSIFIED, pano_id=pano_id, pano_date=pano_date)
+                stats['rescan_baseline'] += 1
+                PLACES_FINISHED.inc(outcome='unchanged')
+                return None
+            if pano_id == place['pano_id']:
+                stats['rescan_unchanged'] += 1
+                PLACES_FINISHED.inc(outcome='unchanged')
+                return None # Stays 'classified'
+            stats['rescan_changed'] += 1
+            logger.debug("Panorama of %s changed (%s -> %s); imaging it again.",
+                         place_info.get('name', 'N/A'), place['pano_id'] or 'none', pano_id or 'none')
+
+        # Start no new place while the frames already held use up the image memory budget
+        await image_budget.wait_for_room()
+
+        # 2. Get Street View Images with targeted heading. The frames are attached to the
+        # place as soon as they arrive, so release_images frees them if a later step fails.
+        place['images'] = []
+        try:
+            if metadata is not None:
+                place['images'] = await asyncio.to_thread(
+                    get_street_view_with_targeted_heading, place_location, STREET_VIEW_SIZE, STREET_VIEW_FOV, Maps_API_KEY,
+                    metadata=metadata,
+                )
+            place['images'] = await triage_images(place_info, place['images'])
+
             # If no street view images were found, try place photos as a fallback
-            if not image_data_list:
-                print("    No suitable Street View images found. Trying Place Photos API as fallback...")
-                image_data_list = get_place_photos(gmaps, place_id)
-
-            if image_data_list:
-                awning_detected_for_place = False # Flag to track if an awning was found in any heading
-                saved_image_paths = []
-                
-                for heading, image_bytes in image_data_list:
-                    # 2. Analyze each image with Local Moondream
-                    has_awning = analyze_image_with_local_moondream(image_bytes, VISION_PROMPT, MOONDREAM_LOCAL_ENDPOINT)
-
-                    # Check if the global client got cleared due to connection error
-                    if moondream_client is None and not vision_connection_failed_persistently:
-                        print("    WARN: Moondream connection error detected. Further vision checks may be skipped.")
-                        vision_connection_failed_persistently = True # Assume server is down
-
-                    if has_awning:
-                        if not awning_detected_for_place:
-                            awning_found_count += 1
-                            print(f"    >>> Awning DETECTED for {place_info.get('name', 'N/A')} (heading {heading})!")
-                            awning_detected_for_place = True
-
-                            # Generate a base filename based on the place_id
-                            base_image_filename = f"{IMAGES_DIR}/{place_id}"
-
-                        # Generate a filename with the heading
-                        image_filename = f"{base_image_filename}_heading_{heading}.jpg"
-
-                        try:
-                            with open(image_filename, "wb") as img_file:
-                                img_file.write(image_bytes)
-                            print(f"    Saved image (heading {heading}) to {image_filename}")
-                            saved_image_paths.append(image_filename)
-                        except Exception as e:
-                            print(f"    ERROR: Could not save image (heading {heading}) for {place_info.get('name', 'N/A')}: {e}")
-
-                
-                if awning_detected_for_place:
-                    # Make sure we have a valid saved_image_paths even if saving failed
-                    if not saved_image_paths:
-                        saved_image_paths = ["N/A"]
-                    
-                    # Create the new lead data
-                    new_lead = {
-                        'name': place_info.get('name', 'N/A'),
-                        'address': place_info.get('formatted_address', 'N/A'),
-                        'phone': place_info.get('formatted_phone_number', 'N/A'),
-                        'Maps_url': place_info.get('url', 'N/A'),
-                        'place_id': place_id,
-                        'city': city_name,
-                        'image_filepaths': saved_image_paths  # Recording file paths in JSON
-                    }
-                    
-                    # Add the new lead to our in-memory list
-                    leads_with_awnings.append(new_lead)
-
-                    # Save progress after each successful identification
-                    print("\n" + "="*60)
-                    print(f"Saving {len(leads_with_awnings)} leads to {JSON_OUTPUT_FILENAME}...")
-                    
-                    try:
-                        # Load existing data if the file exists
-                        existing_leads = []
-                        if os.path.exists(JSON_OUTPUT_FILENAME) and os.path.getsize(JSON_OUTPUT_FILENAME) > 0:
-                            try:
-                                with open(JSON_OUTPUT_FILENAME, 'r', encoding='utf-8') as f:
-                                    existing_leads = json.load(f)
-                                if not isinstance(existing_leads, list):
-                                    print(f"WARNING: Existing data in {JSON_OUTPUT_FILENAME} is not a valid JSON array. Creating new file.")
-                                    existing_leads = []
-                            except json.JSONDecodeError:
-                                print(f"WARNING: Could not parse existing JSON in {JSON_OUTPUT_FILENAME}. Creating new file.")
-                                existing_leads = []
-                        
-                        # Write all data (existing + new) to the file
-                        with open(JSON_OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
-                            # Only append the new lead to existing data
-                            if existing_leads:
-                                # Check if this place_id already exists to avoid duplicates
-                                existing_ids = {lead.get('place_id') for lead in existing_leads}
-                                if new_lead['place_id'] not in existing_ids:
-                                    existing_leads.append(new_lead)
-                            else:
-                                existing_leads = leads_with_awnings  # Use all current leads if no existing data
-                            
-                            json.dump(existing_leads, f, ensure_ascii=False, indent=4)
-                        
-                        print(f"Successfully saved {len(existing_leads)} total leads to {JSON_OUTPUT_FILENAME}")
-                    
-                    except IOError as e:
-                        print(f"ERROR: Could not write to file {JSON_OUTPUT_FILENAME}: {e}")
-                    except Exception as e:
-                        print(f"ERROR: An unexpected error occurred during JSON saving: {e}")
-                    
-                    print("="*60)
+            if not place['images']:
+                logger.debug("No suitable Street View images found for %s. Trying Place Photos API as fallback...", place_info.get('name', 'N/A'))
+                place['images'] = await asyncio.to_thread(
+                    get_place_photos, gmaps, place['place_id'], place_details=place_info
+                )
+                place['images'] = await triage_images(place_info, place['images'])
+        except TransportError as e:
+            defer(place, e)
+            return None
+
+        state.mark(place['place_id'], run_state.IMAGED, pano_id=pano_id, pano_date=pano_date)
+        return place
+
+    vision_batcher = VisionBatcher(
+        analyze_images_with_local_moondream,
+        max_batch_size=VISION_BATCH_SIZE,
+        max_wait_ms=VISION_BATCH_MAX_WAIT_MS,
+        # Enough batches to keep every replica busy, plus one filling up meanwhile
+        max_inflight_batches=math.ceil(vision_pool.capacity / VISION_BATCH_SIZE) + 1,
+        is_positive=lambda verdict: verdict['has_awning'],
+    )
+
+    async def vision_worker(place):
+        place_info = place['details']
+        stats['checked'] += 1
+        logger.debug("[%d/%d] Checking: %s", stats['checked'], stats['discovered'], place_info.get('name', 'N/A'))
+
+        place['verdicts'] = []
+        if not place['images']:
+            logger.info("Skipping vision analysis for %s: Could not retrieve any images.", place_info.get('name', 'N/A'))
+            mark_failed(place, "no imagery available")
+            return None
+
+        # 2. Analyze the headings with Local Moondream (batched with other places)
+        place['verdicts'] = await vision_batcher.classify_place(place['images'], early_exit=VISION_EARLY_EXIT)
+        for _, frame in place['images']:
+            frame.drop_image() # Persistence only needs the encoded bytes
+
+        verdicts = [verdict['has_awning'] for _, _, verdict in place['verdicts']]
+        if not any(verdicts) and None in verdicts:
+            logger.warning("Vision analysis incomplete for %s; it will be resumed next run.", place_info.get('name', 'N/A'))
+            stats['vision_deferred'] += 1
+            PLACES_FINISHED.inc(outcome='deferred')
+            return None # Left as 'imaged'
+        return place
+
+    async def persist_worker(place):
+        place_id = place['place_id']
+        place_info = place['details']
+        positives = [(heading, frame, verdict) for heading, frame, verdict in place['verdicts'] if verdict['has_awning']]
+
+        if positives:
+            # Most convincing heading first; its scores are the lead's
+            positives.sort(key=lambda positive: confidence_rank(positive[2]['confidence']), reverse=True)
+            stats['awnings_found'] += 1
+            logger.info(">>> Awning DETECTED for %s (heading %s)!", place_info.get('name', 'N/A'), positives[0][0])
+
+            saved_image_paths = []
+            for heading, frame, _ in positives:
+                # Generate a filename based on the place_id and heading
+                image_filename = f"{IMAGES_DIR}/{place_id}_heading_{heading}.jpg"
+                try:
+                    await asyncio.to_thread(_write_bytes, image_filename, frame.data)
+                    logger.debug("Saved image (heading %s) to %s", heading, image_filename)
+                    saved_image_paths.append(image_filename)
+                except Exception as e:
+                    logger.error("Could not save image (heading %s) for %s: %s", heading, place_info.get('name', 'N/A'), e)
+
+            # Make sure we have a valid saved_image_paths even if saving failed
+            if not saved_image_paths:
+                saved_image_paths = ["N/A"]
+
+            location = place_info.get('geometry', {}).get('location', {})
+            new_lead = {
+                'name': place_info.get('name', 'N/A'),
+                'address': place_info.get('formatted_address', 'N/A'),
+                'phone': place_info.get('formatted_phone_number', 'N/A'),
+                'Maps_url': place_info.get('url', 'N/A'),
+                'place_id': place_id,
+                'city': place['city'],
+                'lat': location.get('lat'), # For the CRM's proximity queries and follow-up routes
+                'lng': location.get('lng'),
+                'image_filepaths': saved_image_paths,  # Recording file paths in JSON
+                'confidence': positives[0][2]['confidence'], # Per classifier stage, e.g. {'screen': 0.9, 'verify': 0.8}
+            }
+
+            # Save progress after each successful identification
+            if lead_sink.add(new_lead):
+                stats['leads_written'] += 1
+                logger.info("Saved lead; %d total leads in %s", len(lead_sink), lead_sink.path)
+            state.mark(place_id, run_state.LEAD)
+            PLACES_FINISHED.inc(outcome='lead')
+        else:
+            state.mark(place_id, run_state.CLASSIFIED)
+            PLACES_FINISHED.inc(outcome='classified')
+        return None
 
-            else:
-                print("    Skipping vision analysis: Could not retrieve any images.")
+    started_at = time.monotonic()
+    queued_before, finished_before = PLACES_QUEUED.total(), PLACES_FINISHED.total()
+
+    def log_progress(discovering):
+        """Logs places finished so far, throughput, and the time left for the places queued."""
+        queued = PLACES_QUEUED.total() - queued_before
+        finished = PLACES_FINISHED.total() - finished_before
+        elapsed = time.monotonic() - started_at
+        per_second = finished / elapsed if elapsed > 0 else 0.0
+        eta = format_duration((queued - finished) / per_second) if per_second else "unknown"
+        logger.info(
+            "Progress: %d of %d queued places done (%d leads) in %s, %.1f places/min; ETA %s%s",
+            finished, queued, stats['awnings_found'], format_duration(elapsed), per_second * 60, eta,
+            " (discovery still running)" if discovering else "",
+        )
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL_SECONDS)
+            log_progress(not discovery.done())
+            await asyncio.to_thread(write_crawl_metrics)
+
+    vision_batcher.start()
+    discovery = asyncio.create_task(
+        discover_places(gmaps, state, details_queue, resume_only=resume_only, retry_failed=retry_failed, shard=shard,
+                        rescan_since=time.time() if rescan else None)
+    )
+    progress = asyncio.create_task(report_progress())
+    try:
+        await asyncio.gather(
+            discovery,
+            _run_stage("details", details_worker, details_queue, imagery_queue, DETAILS_CONCURRENCY, mark_failed),
+            _run_stage("imagery", imagery_worker, imagery_queue, vision_queue, IMAGERY_CONCURRENCY, mark_failed, release_images),
+            _run_stage("vision", vision_worker, vision_queue, persist_queue, VISION_CONCURRENCY, mark_failed, release_images),
+            _run_stage("persistence", persist_worker, persist_queue, None, 1, mark_failed, release_images),
+        )
+    finally:
+        progress.cancel()
+    await vision_batcher.close()
+    log_progress(False)
+    stats['vision'] = vision_batcher.stats
+    stats['transport'] = {
+        upstream: dict(transport.stats[upstream], circuit=breaker.state, **breaker.stats)
+        for upstream, breaker in transport.breakers.items()
+    }
+    return stats
+
+
+def write_crawl_metrics():
+    try:
+        crawl_metrics.write_textfile(CRAWL_METRICS_FILE)
+    except OSError as e:
+        logger.warning("Could not write crawl metrics to %s: %s", CRAWL_METRICS_FILE, e)
+
+
+def step_timing_lines():
+    """Returns printable per-step lines of count, total, mean and estimated p95 time."""
+    lines = []
+    for labels in STEP_SECONDS.label_values():
+        count, total = STEP_SECONDS.count(**labels), STEP_SECONDS.sum(**labels)
+        lines.append(
+            f"  {labels['step']:<12} count={count:<6} total={total:.1f}s "
+            f"mean={total / count * 1000:.0f}ms p95~{STEP_SECONDS.quantile(0.95, **labels) * 1000:.0f}ms"
+        )
+    return lines
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def open_run_state(path):
+    """Opens the run-state store, importing processed_places.txt into a new one."""
+    state = RunStateStore(path)
+    if state.is_empty() and os.path.exists(PROCESSED_LOG_FILENAME):
+        lead_place_ids = set()
+        if os.path.exists(JSON_OUTPUT_FILENAME):
+            try:
+                with open(JSON_OUTPUT_FILENAME, 'r', encoding='utf-8') as f:
+                    lead_place_ids = {lead.get('place_id') for lead in json.load(f)}
+            except (OSError, ValueError) as e:
+                logger.warning("Could not read %s while importing the processed log: %s", JSON_OUTPUT_FILENAME, e)
+        imported = state.import_legacy_log(PROCESSED_LOG_FILENAME, lead_place_ids)
+        logger.info("Imported %d previously processed place IDs from %s into %s", imported, PROCESSED_LOG_FILENAME, path)
+    return state
+
+
+def open_shard_state(shard_dir):
+    """
+    Opens a shard's run-state store. A new one is seeded from RUN_STATE_DB, so
+    the shard skips places and tiles that earlier (merged) runs finished.
+    """
+    path = os.path.join(shard_dir, RUN_STATE_DB)
+    state = RunStateStore(path)
+    if state.is_empty() and os.path.exists(RUN_STATE_DB):
+        seeded = state.merge_from(RUN_STATE_DB)
+        logger.info("Seeded %s with %d places from %s", path, seeded, RUN_STATE_DB)
+    return state
+
+
+def merge_shard_outputs():
+    """
+    Merges the run state and lead log of every shard under SHARDS_DIR into
+    RUN_STATE_DB and LEADS_LOG_FILENAME (leads deduplicated by place_id), then
+    re-exports JSON_OUTPUT_FILENAME. Merging the same shard again changes nothing.
+    """
+    directories = shard_directories(SHARDS_DIR)
+    if not directories:
+        logger.warning("No shard outputs found in %s", SHARDS_DIR)
+        return
+    state = open_run_state(RUN_STATE_DB)
+    lead_sink = LeadSink(LEADS_LOG_FILENAME, fsync_every=LEADS_FSYNC_EVERY, seed_json_path=JSON_OUTPUT_FILENAME)
+    try:
+        for directory in directories:
+            state_path = os.path.join(directory, RUN_STATE_DB)
+            places = state.merge_from(state_path) if os.path.exists(state_path) else 0
+            shard_leads = read_leads(os.path.join(directory, LEADS_LOG_FILENAME))
+            added = sum(1 for lead in shard_leads if lead_sink.add(lead))
+            logger.info("Merged %s: %d places, %d leads (%d new)", directory, places, len(shard_leads), added)
+    finally:
+        lead_sink.close()
+        state.close()
+    exported = export_json(LEADS_LOG_FILENAME, JSON_OUTPUT_FILENAME)
+    logger.info("Exported %d leads to %s", exported, JSON_OUTPUT_FILENAME)
+
+
+async def hand_out_places(gmaps, shards, rescan=False):
+    """
+    Discovers places once for hash-sharded workers: searches the tiles not yet
+    done in RUN_STATE_DB and records each place_id no shard has seen as
+    DISCOVERED in the state of the shard that owns it, so the shards only
+    resume and Nearby Search is not billed once per shard.
+
+    Returns the number of places handed out.
+    """
+    shard_states = []
+    for shard in shards:
+        shard_dir = os.path.join(SHARDS_DIR, shard.name)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_states.append(open_shard_state(shard_dir))
+    state = open_run_state(RUN_STATE_DB)
+    queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    handed_out = 0
+
+    async def hand_out():
+        nonlocal handed_out
+        while True:
+            place = await queue.get()
+            if place is _STAGE_DONE:
+                return
+            if place.get('rescan'):
+                continue # Re-scanned by the shards from their own state
+            shard_state = shard_states[shard_of(place['place_id'], len(shard_states))]
+            if shard_state.status_of(place['place_id']) is None:
+                shard_state.mark(place['place_id'], run_state.DISCOVERED, city=place['city'],
+                                 name=place['name'], details=place.get('details'))
+                handed_out += 1
+
+    try:
+        await asyncio.gather(
+            discover_places(gmaps, state, queue, rescan_since=time.time() if rescan else None),
+            hand_out(),
+        )
+    finally:
+        state.close()
+        for shard_state in shard_states:
+            shard_state.close()
+    return handed_out
+
+
+def run_local_shards(args, gmaps):
+    """
+    Runs args.workers shards of the crawl as child processes of this script,
+    then merges their outputs. Returns False if any shard failed.
+
+    By hash, discovery runs here first (see hand_out_places) and the shards
+    only resume the places handed to them.
+    """
+    resume = args.resume
+    if args.shard_by == 'hash' and not args.resume:
+        shards = [Shard(index, args.workers, 'hash', SHARD_TILE_DEPTH) for index in range(args.workers)]
+        handed_out = asyncio.run(hand_out_places(gmaps, shards, rescan=args.rescan))
+        logger.info("Handed %d new places out to %d shards", handed_out, args.workers)
+        resume = True
+
+    processes = []
+    for index in range(args.workers):
+        command = [sys.executable, os.path.abspath(__file__), "--shard", f"{index}/{args.workers}", "--shard-by", args.shard_by]
+        if resume:
+            command.append("--resume")
+        if args.retry_failed:
+            command.append("--retry-failed")
+        if args.rescan:
+            command.append("--rescan")
+        processes.append(subprocess.Popen(command))
+    logger.info("Started %d shard processes (by %s); outputs in %s", len(processes), args.shard_by, SHARDS_DIR)
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        # Merged anyway: what the failed shards finished is recorded, and rerunning them resumes the rest
+        logger.error("Shards %s exited with an error; rerun with --workers %d to finish them.",
+                     ", ".join(str(index) for index in failed), args.workers)
+    merge_shard_outputs()
+    return not failed
 
-            # Record that this place has been processed
-            with open(PROCESSED_LOG_FILENAME, 'a') as f:
-                f.write(place_id + '\n')
 
+# --- Main Execution Logic ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find businesses with fabric awnings via Street View and a local Moondream server.")
+    parser.add_argument(
+        "--invalidate-verdicts", action="store_true",
+        help="Delete memoized vision verdicts for prompts other than the current VISION_STAGES prompts, then exit.",
+    )
+    parser.add_argument(
+        "--export-leads", action="store_true",
+        help=f"Compact {LEADS_LOG_FILENAME} into the JSON array {JSON_OUTPUT_FILENAME} read by app.py, then exit.",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Only finish places left unfinished by earlier runs; do not search Places for new ones.",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true",
+        help="Also retry places recorded as failed, from the stage where they failed.",
+    )
+    parser.add_argument(
+        "--rescan", action="store_true",
+        help="Incremental re-scan: check the Street View panorama of every place classified without an awning and "
+             "image it again only if the panorama changed; search every tile again for new places.",
+    )
+    parser.add_argument(
+        "--shard", metavar="INDEX/COUNT",
+        help=f"Crawl only one shard of the work, e.g. 0/4, with its own state and lead log in {SHARDS_DIR}/. "
+             "Run every shard (on one machine or several), then --merge-shards.",
+    )
+    parser.add_argument(
+        "--shard-by", choices=SHARD_MODES, default="hash",
+        help="How --shard and --workers split the work: by city, by discovery tile, or by place_id hash. "
+             "By hash, --workers searches once and hands the places out; separate --shard runs each search every tile.",
+    )
+    parser.add_argument(
+        "--workers", type=int,
+        help="Run this many shards as local processes, then merge their outputs.",
+    )
+    parser.add_argument(
+        "--merge-shards", action="store_true",
+        help=f"Merge the state and leads of every shard in {SHARDS_DIR}/ into {RUN_STATE_DB} and "
+             f"{LEADS_LOG_FILENAME} (re-exporting {JSON_OUTPUT_FILENAME}), then exit.",
+    )
+    args = parser.parse_args(argv)
+    if args.shard:
+        try:
+            args.shard = Shard.parse(args.shard, args.shard_by, SHARD_TILE_DEPTH)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+def main(args=None):
+    """Main function to find leads and analyze images."""
+    global rate_limiter, CRAWL_METRICS_FILE # Replaced for a shard's share of the crawl
 
-    # --- Print Final Results ---
-    print("\n" + "="*60)
-    print(f"Processing Complete. Checked {checked_count} businesses.")
-    print(f"Potential Leads with Awnings Detected by Local Moondream: {awning_found_count}")
-    if vision_connection_failed_persistently:
-         print("WARNING: Vision analysis was stopped early due to Moondream server connection issues.")
-    print("="*60)
+    if args is None:
+        args = parse_args([])
+
+    if args.invalidate_verdicts:
+        removed = crawl_cache.invalidate_verdicts(keep_prompt_digests=[vision_prompt_digest(stage) for stage in VISION_STAGES])
+        logger.info("Removed %d memoized verdicts from earlier prompts.", removed)
+        return
+
+    if args.export_leads:
+        LeadSink(LEADS_LOG_FILENAME, seed_json_path=JSON_OUTPUT_FILENAME).close()
+        exported = export_json(LEADS_LOG_FILENAME, JSON_OUTPUT_FILENAME)
+        logger.info("Exported %d leads from %s to %s", exported, LEADS_LOG_FILENAME, JSON_OUTPUT_FILENAME)
+        return
+
+    if args.merge_shards:
+        merge_shard_outputs()
+        return
+
+    if Maps_API_KEY == "YOUR_Maps_API_KEY":
+        logger.error("Please configure your Maps_API_KEY in the script or environment variables.")
+        return
+
+    logger.info("Initializing Google Maps Client...")
+    try:
+        # Quota errors are surfaced to rate_limiter, which backs off per endpoint
+        gmaps = googlemaps.Client(key=Maps_API_KEY, retry_over_query_limit=False, requests_session=transport.session)
+    except Exception as e:
+        logger.critical("Error initializing Google Maps client: %s", e)
+        return
+
+    if args.workers:
+        if not run_local_shards(args, gmaps):
+            sys.exit(1)
+        return
+
+    shard = args.shard
+    if shard is not None:
+        shard_dir = os.path.join(SHARDS_DIR, shard.name)
+        os.makedirs(shard_dir, exist_ok=True)
+        logging.basicConfig(level=LOG_LEVEL, format=f"%(asctime)s [{shard.name}] %(levelname)-7s %(message)s", force=True)
+        logger.info("Crawling %s; state and leads in %s", shard, shard_dir)
+        state = open_shard_state(shard_dir)
+        lead_sink = LeadSink(os.path.join(shard_dir, LEADS_LOG_FILENAME), fsync_every=LEADS_FSYNC_EVERY)
+        CRAWL_METRICS_FILE = os.path.join(shard_dir, os.path.basename(CRAWL_METRICS_FILE))
+        if SHARD_SPLIT_QPS_BUDGETS:
+            rate_limiter = RateLimiter({endpoint: qps / shard.count for endpoint, qps in API_QPS_BUDGETS.items()})
+    else:
+        state = open_run_state(RUN_STATE_DB)
+        lead_sink = LeadSink(LEADS_LOG_FILENAME, fsync_every=LEADS_FSYNC_EVERY, seed_json_path=JSON_OUTPUT_FILENAME)
+
+        # Left to unsharded runs, so shard processes sharing the cache don't purge it at once
+        purged = crawl_cache.purge_expired()
+        if purged:
+            logger.info("Purged %d image files no longer referenced by fresh entries from the crawl cache at %s", purged, CACHE_DIR)
+
+    try:
+        stats = asyncio.run(run_pipeline(
+            gmaps, state, lead_sink, resume_only=args.resume, retry_failed=args.retry_failed, shard=shard,
+            rescan=args.rescan,
+        ))
+    finally:
+        lead_sink.close()
+        state_counts = state.counts()
+        state.close()
+        write_crawl_metrics()
+        vision_pool.close() # Stops the health prober and the replicas' pinned threads
+
+    if stats['leads_written'] and shard is None:
+        # Keep the JSON array app.py reads in step with the lead log
+        exported = export_json(LEADS_LOG_FILENAME, JSON_OUTPUT_FILENAME)
+        logger.info("Exported %d leads to %s", exported, JSON_OUTPUT_FILENAME)
+
+    # --- Log Final Results ---
+    logger.info("=" * 60)
+    logger.info("Processing Complete. Checked %d businesses.", stats['checked'])
+    logger.info("Potential Leads with Awnings Detected by Local Moondream: %d", stats['awnings_found'])
+    logger.info("Place status in %s: %s", state.path, ", ".join(f"{status}={count}" for status, count in sorted(state_counts.items())))
+    if args.rescan:
+        logger.info("Re-scan: %d places unchanged (metadata only), %d imaged again after a panorama change.",
+                    stats['rescan_unchanged'], stats['rescan_changed'])
+        if stats['rescan_baseline']:
+            logger.info("Re-scan: recorded the panorama of %d places classified before panoramas were tracked; "
+                        "they are compared from the next re-scan on.", stats['rescan_baseline'])
+    if stats['vision_deferred']:
+        logger.warning("Vision analysis failed for %d places (left for the next run to resume).", stats['vision_deferred'])
+    if stats['transport_deferred']:
+        logger.warning("%d places were deferred to the next run because Google could not be reached.", stats['transport_deferred'])
+    logger.info("Vision replicas (%d of %d healthy):", vision_pool.healthy_count(), len(vision_pool.replicas))
+    for line in vision_pool.summary_lines():
+        logger.info("%s", line)
+    vision_stats = stats['vision']
+    if vision_stats['batches']:
+        logger.info("Vision: %d images in %d batches (avg %.1f/batch), %d skipped after an early YES.",
+                    vision_stats['images'], vision_stats['batches'], vision_stats['images'] / vision_stats['batches'],
+                    vision_stats['skipped_early_exit'])
+        logger.info("Verdicts: yes=%d no=%d failed=%d (%d from the verdict cache)",
+                    VISION_VERDICTS.value(verdict='yes', source='model') + VISION_VERDICTS.value(verdict='yes', source='cache'),
+                    VISION_VERDICTS.value(verdict='no', source='model') + VISION_VERDICTS.value(verdict='no', source='cache'),
+                    VISION_VERDICTS.value(verdict='failed', source='model'),
+                    VISION_VERDICTS.value(verdict='yes', source='cache') + VISION_VERDICTS.value(verdict='no', source='cache'))
+        for stage, (_, _, threshold) in VISION_STAGES.items():
+            passed, rejected = (
+                sum(VISION_STAGE_RESULTS.value(stage=stage, result=result, source=source) for source in ('model', 'cache'))
+                for result in ('pass', 'reject')
+            )
+            logger.info("  %-7s (threshold %.2f): %d passed, %d rejected, %d queries sent to the model",
+                        stage, threshold, passed, rejected,
+                        sum(VISION_STAGE_RESULTS.value(stage=stage, result=result, source='model')
+                            for result in ('pass', 'reject', 'failed')))
+    if panorama_planner.stats['requested']:
+        logger.info("%s", panorama_planner.summary_line())
+    if image_triage.stats['images']:
+        logger.info("%s", image_triage.summary_line())
+    logger.info("Image memory: peak %.1f MB of the %.0f MB budget; imagery waited %d times (%.1fs) for room; "
+                "%d download buffers allocated, %d reused.",
+                image_budget.stats['peak_bytes'] / 1024**2, IMAGE_MEMORY_BUDGET_BYTES / 1024**2,
+                image_budget.stats['waits'], image_budget.stats['wait_seconds'],
+                buffer_pool.stats['allocated'], buffer_pool.stats['reused'])
+    logger.info("Time per step (cache hits included):")
+    for line in step_timing_lines():
+        logger.info("%s", line)
+    logger.info("Google API usage (time spent throttled vs. in requests):")
+    for line in rate_limiter.summary_lines():
+        logger.info("%s", line)
+    logger.info("HTTP transport (retries of transient failures, circuit breakers):")
+    for line in transport.summary_lines():
+        logger.info("%s", line)
+    logger.info("Crawl cache (%s):", CACHE_DIR)
+    for line in crawl_cache.summary_lines():
+        logger.info("%s", line)
+    logger.info("Metrics written to %s", CRAWL_METRICS_FILE)
+    logger.info("=" * 60)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_args())
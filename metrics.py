@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- In-Process Metrics ---
+# Minimal counters and histograms shared by the crawler (main.py) and the CRM
+# app (app.py), rendered in the Prometheus text exposition format. The crawler
+# writes them to a textfile (for node_exporter's textfile collector, or just to
+# read) and logs a summary; the app serves them at /metrics.
+#
+# Updating a metric is a dict lookup and an addition under the metric's lock,
+# so instrumentation can sit in hot paths. Stats that a component already
+# counts itself (rate limiter, crawl cache, ...) are not counted twice: a
+# collector callback reads them when the metrics are rendered.
+
+# Latency buckets in seconds, from a cache hit to a slow Google/Moondream call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labelnames, labels):
+    if len(labels) != len(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def format_duration(seconds):
+    """Renders a duration as e.g. '42s', '3m05s' or '1h02m'."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(self.labelnames, labels), 0)
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def samples(self):
+        with self.lock:
+            return [('', tuple(zip(self.labelnames, key)), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """Current value per label combination."""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination, with a running sum."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.lock = threading.Lock()
+        self.series = {} # label key -> [bucket counts (not cumulative), sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = 0
+        while value > self.buckets[index]:
+            index += 1
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def label_values(self):
+        with self.lock:
+            return [dict(zip(self.labelnames, key)) for key in sorted(self.series)]
+
+    def count(self, **labels):
+        series = self.series.get(_label_key(self.labelnames, labels))
+        return series[2] if series else 0
+
+    def sum(self, **labels):
+        series = self.series.get(_label_key(self.labelnames, labels))
+        return series[1] if series else 0.0
+
+    def quantile(self, q, **labels):
+        """Estimates a quantile by interpolating within its bucket (like PromQL's histogram_quantile)."""
+        with self.lock:
+            series = self.series.get(_label_key(self.labelnames, labels))
+            if not series or not series[2]:
+                return None
+            counts, _, total = list(series[0]), series[1], series[2]
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                upper = self.buckets[index]
+                lower = self.buckets[index - 1] if index else 0.0
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-2]
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                labels = tuple(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', labels + (('le', _format_value(float(bound))),), cumulative))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Named metrics plus collector callbacks, rendered together.
+
+    A collector is called at render time and returns a list of
+    (name, type, documentation, [(labels dict, value)]) for stats kept elsewhere.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+
+        def family(name, metric_type, documentation, samples):
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            family(metric.name, metric.type, metric.documentation, metric.samples())
+        for collector in self.collectors:
+            for name, metric_type, documentation, values in collector():
+                family(name, metric_type, documentation,
+                       [('', tuple(sorted(labels.items())), value) for labels, value in values])
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Writes render() to path atomically, so a scraper never reads half a file."""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import Future
+
+from crawl_cache import image_cache_key
+
+# --- Panorama-Centric Frame Sharing ---
+# Neighbouring businesses usually resolve to the same Street View panorama and
+# ask for headings a few degrees apart. Frames are therefore requested by
+# pano_id and tracked per panorama: a heading within `heading_tolerance`
+# degrees of a frame that already exists (fetched earlier in this run, or
+# cached by an earlier run) reuses that frame instead of costing another
+# image request. The business is then at most that far off-center in a
+# frame whose field of view is much wider, so it is still fully in view.
+#
+# The planner only decides which frame serves a heading; the bytes live in
+# the crawl cache, so shared frames are read back from disk (into each place's
+# own pooled buffer) rather than kept in memory for the whole run. Concurrent requests for the same frame wait
+# for the first one's fetch.
+
+
+def pano_location_key(pano_id):
+    """Stands in for the location part of image_cache_key when frames are requested by pano."""
+    return f"pano:{pano_id}"
+
+
+def heading_distance(a, b):
+    diff = abs(a - b) % 360
+    return min(diff, 360 - diff)
+
+
+class PanoramaPlanner:
+    """
+    Thread-safe registry of the Street View frames known per (pano_id, fov, size).
+
+    Args:
+        cache: CrawlCache the frames are stored in.
+        heading_tolerance: Max degrees between a requested heading and a frame
+                           that may be reused for it.
+        min_frame_bytes: Cached images no larger than this (placeholders) are
+                         not counted as frames of a panorama.
+    """
+
+    def __init__(self, cache, heading_tolerance, min_frame_bytes=0):
+        self.cache = cache
+        self.heading_tolerance = heading_tolerance
+        self.min_frame_bytes = min_frame_bytes
+        self.lock = threading.Lock()
+        self.frames = {} # (pano_id, fov, size) -> {heading: Future while fetching, then True}
+        self.stats = {'requested': 0, 'shared': 0}
+
+    def _frames_for(self, pano_id, fov, size):
+        """Returns the frame table of a panorama, seeded from the cache the first time. Caller holds the lock."""
+        pano = (pano_id, fov, size)
+        if pano not in self.frames:
+            frames = self.frames[pano] = {}
+            prefix = f"{image_cache_key(pano_location_key(pano_id), '', fov, size).rsplit('|', 3)[0]}|"
+            for key in self.cache.image_keys(prefix, min_bytes=self.min_frame_bytes):
+                _, _, heading, key_fov, key_size = key.split("|")
+                if key_fov == str(fov) and key_size == size:
+                    frames[int(heading)] = True
+        return self.frames[pano]
+
+    def get_frame(self, pano_id, heading, fov, size, fetch):
+        """
+        Returns (frame_heading, frame or None) for a requested heading.
+
+        fetch(frame_heading) returns a frame (an image_memory.Frame read from
+        the crawl cache or fetched from Google) or None. It is called for a new frame only once, even
+        when several places ask for it at the same time.
+        """
+        with self.lock:
+            self.stats['requested'] += 1
+            frames = self._frames_for(pano_id, fov, size)
+            nearby = [h for h in frames if heading_distance(h, heading) <= self.heading_tolerance]
+            if nearby:
+                frame_heading = min(nearby, key=lambda h: heading_distance(h, heading))
+                known = frames[frame_heading]
+            else:
+                frame_heading = heading
+                known = None
+                future = frames[heading] = Future()
+
+        if known is None:
+            content = None
+            try:
+                content = fetch(frame_heading)
+            finally:
+                with self.lock:
+                    if content is None:
+                        del frames[frame_heading] # Let a later request try this heading again
+                    else:
+                        frames[frame_heading] = True
+                future.set_result(content is not None)
+            return frame_heading, content
+
+        if isinstance(known, Future) and not known.result():
+            return frame_heading, None
+        with self.lock:
+            self.stats['shared'] += 1
+        return frame_heading, fetch(frame_heading) # A crawl cache hit unless the frame was evicted
+
+    def summary_line(self):
+        s = self.stats
+        return f"Street View frames: {s['requested']} headings needed, {s['shared']} served by a frame already fetched for the panorama"
@@ -0,0 +1,160 @@
+import logging
+import random
+import threading
+import time
+
+# --- Token-Bucket Rate Limiting for Google Maps Endpoints ---
+# One bucket per endpoint, shared by every pipeline worker thread. Instead of
+# sleeping a fixed delay after each request, a caller only waits when the
+# endpoint's budget is actually exhausted. When Google answers OVER_QUERY_LIMIT
+# or HTTP 429 the bucket halves its rate and pauses, then ramps back up on
+# successful calls.
+
+THROTTLE_BACKOFF_BASE = 1.0 # Seconds paused after the first throttled response
+THROTTLE_BACKOFF_MAX = 30.0 # Cap for the exponential backoff
+MIN_RATE_FRACTION = 0.1 # Never drop below 10% of an endpoint's configured QPS
+RECOVERY_FRACTION = 0.05 # Share of the configured QPS regained per successful call
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket with adaptive rate (AIMD) and throttle backoff."""
+
+    def __init__(self, qps, burst=None):
+        self.target_qps = float(qps)
+        self.rate = float(qps)
+        self.capacity = float(burst if burst is not None else max(1.0, qps))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.consecutive_throttles = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """Blocks until a token is available. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                else:
+                    delay = (1.0 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self):
+        with self.lock:
+            self.consecutive_throttles = 0
+            if self.rate < self.target_qps:
+                self.rate = min(self.target_qps, self.rate + self.target_qps * RECOVERY_FRACTION)
+
+    def on_throttled(self):
+        """Halves the rate and pauses the bucket with jittered exponential backoff."""
+        with self.lock:
+            self.consecutive_throttles += 1
+            self.rate = max(self.target_qps * MIN_RATE_FRACTION, self.rate / 2)
+            self.tokens = 0.0
+            backoff = min(THROTTLE_BACKOFF_MAX, THROTTLE_BACKOFF_BASE * 2 ** (self.consecutive_throttles - 1))
+            backoff *= random.uniform(0.8, 1.2)
+            self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+
+
+def _exception_is_throttled(exc):
+    """True for googlemaps OVER_QUERY_LIMIT errors and HTTP 429s raised by clients."""
+    if getattr(exc, 'status', None) == 'OVER_QUERY_LIMIT':
+        return True
+    return getattr(exc, 'status_code', None) == 429
+
+
+def response_is_throttled(result):
+    """Default check for results: a requests.Response with HTTP 429."""
+    return getattr(result, 'status_code', None) == 429
+
+
+class RateLimiter:
+    """
+    Holds a TokenBucket per named endpoint and records throttle vs. work time.
+
+    Usage:
+        limiter = RateLimiter({'place_details': 10})
+        result = limiter.call('place_details', lambda: gmaps.place(place_id=pid))
+    """
+
+    def __init__(self, qps_budgets, max_retries=4):
+        self.buckets = {name: TokenBucket(qps) for name, qps in qps_budgets.items()}
+        self.max_retries = max_retries
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            name: {'calls': 0, 'throttled': 0, 'wait_seconds': 0.0, 'work_seconds': 0.0}
+            for name in qps_budgets
+        }
+
+    def _record(self, endpoint, key, amount):
+        with self.stats_lock:
+            self.stats[endpoint][key] += amount
+
+    def call(self, endpoint, fn, is_throttled=response_is_throttled):
+        """
+        Calls fn() once the endpoint's budget allows it.
+
+        Throttled calls (an OVER_QUERY_LIMIT/429 exception, or a result for which
+        is_throttled returns True) back the endpoint off and are retried up to
+        max_retries times; a throttled result that is retried is closed first.
+        After that, the last throttled result is returned or the last exception
+        is re-raised, so callers keep their existing handling.
+        """
+        bucket = self.buckets[endpoint]
+        attempt = 0
+        while True:
+            self._record(endpoint, 'wait_seconds', bucket.acquire())
+
+            started = time.monotonic()
+            result, error = None, None
+            try:
+                result = fn()
+                throttled = is_throttled(result)
+            except Exception as e:
+                error = e
+                throttled = _exception_is_throttled(e)
+            self._record(endpoint, 'work_seconds', time.monotonic() - started)
+            self._record(endpoint, 'calls', 1)
+
+            if not throttled:
+                if error is None:
+                    bucket.on_success()
+                    return result
+                raise error
+
+            self._record(endpoint, 'throttled', 1)
+            bucket.on_throttled()
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return result
+            logger.warning("%s throttled by Google (attempt %d); backing off to %.2f QPS.", endpoint, attempt + 1, bucket.rate)
+            if hasattr(result, 'close'):
+                result.close() # A streamed response would otherwise hold its pooled connection
+            attempt += 1
+
+    def summary_lines(self):
+        """Returns printable per-endpoint lines of calls, throttles, wait and work time."""
+        lines = []
+        with self.stats_lock:
+            for name, s in self.stats.items():
+                if not s['calls']:
+                    continue
+                lines.append(
+                    f"  {name:<20} calls={s['calls']:<6} throttled={s['throttled']:<4} "
+                    f"waiting={s['wait_seconds']:.1f}s working={s['work_seconds']:.1f}s"
+                )
+        return lines
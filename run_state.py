@@ -0,0 +1,312 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- Crawl Run-State Store ---
+# One row per place_id recording how far the pipeline got with it:
+#
+#   discovered -> detailed -> imaged -> classified (no awning) | lead
+#                                    \-> failed (with the error reason)
+#
+# Place details are stored with the row, so a resumed place re-enters the
+# pipeline at the stage where it stopped without another Places query.
+# Status changes are buffered and written in batched transactions.
+#
+# The Street View panorama (pano_id and capture date) a place was imaged from
+# is stored too. An incremental re-scan (main.py --rescan) compares it with
+# the current panorama and only re-images places whose panorama changed.
+#
+# Discovery tiles (see tiling.py) are recorded in the same store: 'done' when
+# the tile's search was below the result cap, 'split' when it was saturated
+# and its quadrants are searched instead. Tile marks are flushed in the same
+# transaction as the places they discovered, after them, so a tile is never
+# recorded as done while its places are still only in memory.
+
+DISCOVERED = 'discovered'
+DETAILED = 'detailed'
+IMAGED = 'imaged'
+CLASSIFIED = 'classified'
+LEAD = 'lead'
+FAILED = 'failed'
+
+TILE_DONE = 'done'
+TILE_SPLIT = 'split'
+
+FINISHED_STATUSES = (CLASSIFIED, LEAD)
+RESUMABLE_STATUSES = (DISCOVERED, DETAILED, IMAGED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT PRIMARY KEY,
+    city TEXT,
+    name TEXT,
+    status TEXT NOT NULL,
+    details TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    discovered_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    pano_id TEXT,
+    pano_date TEXT
+);
+CREATE INDEX IF NOT EXISTS places_status ON places(status);
+CREATE TABLE IF NOT EXISTS tiles (
+    tile_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    results INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, with their types; added to older stores on open
+ADDED_PLACE_COLUMNS = (('pano_id', 'TEXT'), ('pano_date', 'TEXT'))
+
+UPSERT_SQL = """
+INSERT INTO places (place_id, city, name, status, details, error, attempts, discovered_at, updated_at, pano_id, pano_date)
+VALUES (:place_id, :city, :name, :status, :details, :error, :failed, :now, :now, :pano_id, :pano_date)
+ON CONFLICT(place_id) DO UPDATE SET
+    city = COALESCE(excluded.city, places.city),
+    name = COALESCE(excluded.name, places.name),
+    status = excluded.status,
+    details = COALESCE(excluded.details, places.details),
+    error = excluded.error,
+    attempts = places.attempts + excluded.attempts,
+    updated_at = excluded.updated_at,
+    pano_id = COALESCE(excluded.pano_id, places.pano_id),
+    pano_date = COALESCE(excluded.pano_date, places.pano_date)
+"""
+
+# Copies another store's places in (see merge_from). An incoming row replaces an
+# existing one if it is finished and the existing one is not, or if both are
+# equally finished and the incoming one is newer.
+MERGE_PLACES_SQL = """
+INSERT INTO places (place_id, city, name, status, details, error, attempts, discovered_at, updated_at, pano_id, pano_date)
+SELECT place_id, city, name, status, details, error, attempts, discovered_at, updated_at, pano_id, pano_date
+FROM other.places WHERE true
+ON CONFLICT(place_id) DO UPDATE SET
+    city = COALESCE(excluded.city, places.city),
+    name = COALESCE(excluded.name, places.name),
+    status = excluded.status,
+    details = COALESCE(excluded.details, places.details),
+    error = excluded.error,
+    attempts = MAX(places.attempts, excluded.attempts),
+    discovered_at = MIN(places.discovered_at, excluded.discovered_at),
+    updated_at = excluded.updated_at,
+    pano_id = COALESCE(excluded.pano_id, places.pano_id),
+    pano_date = COALESCE(excluded.pano_date, places.pano_date)
+WHERE (excluded.status IN ('classified', 'lead')) > (places.status IN ('classified', 'lead'))
+   OR ((excluded.status IN ('classified', 'lead')) = (places.status IN ('classified', 'lead'))
+       AND excluded.updated_at > places.updated_at)
+"""
+
+
+class RunStateStore:
+    """
+    SQLite (WAL) store of per-place crawl status.
+
+    Args:
+        path: Database file path.
+        batch_size: Buffered status changes that trigger a flush.
+        flush_interval: Seconds after which buffered changes are flushed anyway.
+    """
+
+    def __init__(self, path, batch_size=50, flush_interval=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = {} # place_id -> row dict waiting for the next flush
+        self.pending_tiles = {} # tile_id -> (status, results, updated_at) waiting for the next flush
+        self.last_flush = time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._add_missing_columns("main")
+        self.conn.commit()
+
+    def _add_missing_columns(self, schema):
+        """Upgrades a store created before ADDED_PLACE_COLUMNS existed."""
+        existing = {row[1] for row in self.conn.execute(f"PRAGMA {schema}.table_info(places)")}
+        for column, column_type in ADDED_PLACE_COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE {schema}.places ADD COLUMN {column} {column_type}")
+
+    def is_empty(self):
+        with self.lock:
+            return not self.pending and self.conn.execute("SELECT 1 FROM places LIMIT 1").fetchone() is None
+
+    def status_of(self, place_id):
+        """Returns the current status of place_id, or None if it was never seen."""
+        with self.lock:
+            row = self.pending.get(place_id)
+            if row is not None:
+                return row['status']
+            row = self.conn.execute("SELECT status FROM places WHERE place_id = ?", (place_id,)).fetchone()
+            return row[0] if row else None
+
+    def mark(self, place_id, status, city=None, name=None, details=None, error=None, pano_id=None, pano_date=None):
+        """Records a status change. Written to disk on the next batched flush."""
+        with self.lock:
+            row = self.pending.get(place_id)
+            if row is None:
+                row = {
+                    'place_id': place_id, 'city': None, 'name': None, 'details': None, 'failed': 0,
+                    'pano_id': None, 'pano_date': None,
+                }
+                self.pending[place_id] = row
+            row['status'] = status
+            row['error'] = error
+            row['now'] = time.time()
+            if city is not None:
+                row['city'] = city
+            if name is not None:
+                row['name'] = name
+            if details is not None:
+                row['details'] = json.dumps(details)
+            if pano_id is not None:
+                row['pano_id'] = pano_id
+                row['pano_date'] = pano_date
+            if status == FAILED:
+                row['failed'] += 1
+            due = len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def tile_status(self, tile_id, since=None):
+        """
+        Returns TILE_DONE, TILE_SPLIT or None for a discovery tile. With since
+        (a timestamp), tiles last searched before then count as never searched.
+        """
+        with self.lock:
+            row = self.pending_tiles.get(tile_id)
+            if row is None:
+                row = self.conn.execute("SELECT status, updated_at FROM tiles WHERE tile_id = ?", (tile_id,)).fetchone()
+            if row is None or (since is not None and row[-1] < since):
+                return None
+            return row[0]
+
+    def mark_tile(self, tile_id, status, results):
+        """Records a searched tile. Written with the next flush, after its places."""
+        with self.lock:
+            self.pending_tiles[tile_id] = (status, results, time.time())
+
+    def flush(self):
+        """Writes all buffered status changes in a single transaction."""
+        with self.lock:
+            if self.pending or self.pending_tiles:
+                with self.conn:
+                    self.conn.executemany(UPSERT_SQL, list(self.pending.values()))
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO tiles (tile_id, status, results, updated_at) VALUES (?, ?, ?, ?)",
+                        [(tile_id,) + values for tile_id, values in self.pending_tiles.items()],
+                    )
+                self.pending.clear()
+                self.pending_tiles.clear()
+            self.last_flush = time.monotonic()
+
+    def resumable(self, include_failed=False):
+        """
+        Yields dicts for places whose crawl did not finish, with their stored
+        city, name, status, error and parsed details (or None).
+        """
+        self.flush()
+        statuses = RESUMABLE_STATUSES + ((FAILED,) if include_failed else ())
+        placeholders = ",".join("?" * len(statuses))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT place_id, city, name, status, details, error FROM places WHERE status IN ({placeholders}) "
+                "ORDER BY discovered_at",
+                statuses,
+            ).fetchall()
+        for place_id, city, name, status, details, error in rows:
+            yield {
+                'place_id': place_id,
+                'city': city,
+                'name': name,
+                'status': status,
+                'details': json.loads(details) if details else None,
+                'error': error,
+            }
+
+    def rescannable(self):
+        """
+        Yields dicts for places classified without an awning, with their
+        stored city, name, parsed details (or None) and the pano_id and
+        pano_date they were imaged from (None if not recorded).
+        """
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT place_id, city, name, details, pano_id, pano_date FROM places WHERE status = ? "
+                "ORDER BY discovered_at",
+                (CLASSIFIED,),
+            ).fetchall()
+        for place_id, city, name, details, pano_id, pano_date in rows:
+            yield {
+                'place_id': place_id,
+                'city': city,
+                'name': name,
+                'details': json.loads(details) if details else None,
+                'pano_id': pano_id,
+                'pano_date': pano_date,
+            }
+
+    def counts(self):
+        """Returns {status: number of places} including buffered changes."""
+        self.flush()
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM places GROUP BY status").fetchall())
+
+    def import_legacy_log(self, processed_log_path, lead_place_ids=()):
+        """
+        One-time migration from processed_places.txt: every listed place is
+        recorded as finished ('lead' if it is in lead_place_ids).
+        """
+        if not os.path.exists(processed_log_path):
+            return 0
+        lead_place_ids = set(lead_place_ids)
+        now = time.time()
+        rows = []
+        with open(processed_log_path, 'r') as f:
+            for line in f:
+                place_id = line.strip()
+                if place_id:
+                    status = LEAD if place_id in lead_place_ids else CLASSIFIED
+                    rows.append({
+                        'place_id': place_id, 'city': None, 'name': None, 'status': status,
+                        'details': None, 'error': 'imported from processed log', 'failed': 0, 'now': now,
+                        'pano_id': None, 'pano_date': None,
+                    })
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(UPSERT_SQL, rows)
+        return len(rows)
+
+    def merge_from(self, other_path):
+        """
+        Copies the places and tiles of another store (e.g. a crawl shard's)
+        into this one. A finished place is never set back to an unfinished
+        status. Returns the number of places in the other store.
+        """
+        self.flush()
+        with self.lock:
+            self.conn.execute("ATTACH DATABASE ? AS other", (other_path,))
+            try:
+                self._add_missing_columns("other")
+                with self.conn:
+                    self.conn.execute(MERGE_PLACES_SQL)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO tiles (tile_id, status, results, updated_at) "
+                        "SELECT tile_id, status, results, updated_at FROM other.tiles"
+                    )
+                return self.conn.execute("SELECT COUNT(*) FROM other.places").fetchone()[0]
+            finally:
+                self.conn.execute("DETACH DATABASE other")
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
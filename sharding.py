@@ -0,0 +1,159 @@
+import hashlib
+import math
+import os
+
+import tiling
+
+# --- Sharded Crawls ---
+# A crawl can be split into `count` shards that run as separate processes, on
+# one machine or several. Every shard owns a disjoint part of the work, keeps
+# its own run-state store and lead log under SHARDS_DIR/<shard name>/, and the
+# shard outputs are merged afterwards (leads deduplicated by place_id).
+#
+# Work is split one of three ways:
+#   city  - whole cities, round-robin over their sorted names. Simple, but only
+#           as many shards as cities can be busy.
+#   tile  - the tiles SHARD_TILE_DEPTH levels below each city's root tile (see
+#           tiling.py), hashed over the shards. A shard searches its tiles for
+#           every business type and keeps only the places that lie inside them,
+#           so no place is processed by two shards and discovery is not
+#           repeated, but a dense downtown tile makes its shard the slowest.
+#           Search circles reach past the city's root square; a place found
+#           out there belongs to the shard of the nearest edge tile.
+#   hash  - place_ids hashed over the shards. Details, imagery and vision, the
+#           expensive part, are split evenly, so this scales best. --workers
+#           searches every tile once and hands the places out to the shards;
+#           shards started by hand with --shard each search every tile
+#           (discovery, and its Nearby Search bill, is repeated per shard).
+
+SHARD_MODES = ('city', 'tile', 'hash')
+
+
+def shard_of(key, count):
+    """Stable shard number for a string key (Python's hash() differs between processes)."""
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % count
+
+
+def quadkeys_at_depth(depth):
+    quadkeys = [""]
+    for _ in range(depth):
+        quadkeys = [child for quadkey in quadkeys for child in tiling.child_quadkeys(quadkey)]
+    return quadkeys
+
+
+def point_in_bounds(location, bounds):
+    """True if a {'lat', 'lng'} location lies in (south, west, north, east); the south/west edges are inclusive."""
+    south, west, north, east = bounds
+    lat, lng = location.get('lat'), location.get('lng')
+    if lat is None or lng is None:
+        return False
+    return south <= lat < north and west <= lng < east
+
+
+def clamp_to_bounds(location, bounds):
+    """The point of (south, west, north, east) nearest a {'lat', 'lng'} location, as such a location."""
+    south, west, north, east = bounds
+    return {
+        'lat': min(max(location['lat'], south), math.nextafter(north, south)),
+        'lng': min(max(location['lng'], west), math.nextafter(east, west)),
+    }
+
+
+class Shard:
+    """
+    One shard of a crawl.
+
+    Args:
+        index: This shard's number, 0 <= index < count.
+        count: Total number of shards.
+        mode: 'city', 'tile' or 'hash' (see SHARD_MODES).
+        tile_depth: Quadtree depth of the tiles handed out in 'tile' mode.
+    """
+
+    def __init__(self, index, count, mode, tile_depth=2):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode '{mode}'; expected one of {', '.join(SHARD_MODES)}")
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index {index} is outside 0..{count - 1}")
+        self.index = index
+        self.count = count
+        self.mode = mode
+        self.tile_depth = tile_depth
+
+    @classmethod
+    def parse(cls, spec, mode, tile_depth=2):
+        """Parses 'I/N' (e.g. '0/4' is the first of four shards)."""
+        try:
+            index, count = (int(part) for part in spec.split('/'))
+        except ValueError:
+            raise ValueError(f"Invalid shard '{spec}'; expected INDEX/COUNT, e.g. 0/4")
+        return cls(index, count, mode, tile_depth)
+
+    @property
+    def name(self):
+        return f"{self.mode}-{self.index:02d}-of-{self.count:02d}"
+
+    def __str__(self):
+        return f"shard {self.index + 1} of {self.count} (by {self.mode})"
+
+    def owns_city(self, city_names, city_name):
+        """In 'city' mode, whether this shard crawls city_name; other modes crawl every city."""
+        if self.mode != 'city':
+            return True
+        return sorted(city_names).index(city_name) % self.count == self.index
+
+    def start_quadkeys(self, city_name):
+        """Quadkeys this shard starts its tile search from in a city."""
+        if self.mode != 'tile':
+            return [""]
+        return [
+            quadkey for quadkey in quadkeys_at_depth(self.tile_depth)
+            if shard_of(f"{city_name}|{quadkey}", self.count) == self.index
+        ]
+
+    def owns_place(self, place_id, location=None, start_bounds=None, root_bounds=None):
+        """
+        Whether this shard processes a place returned by a search.
+
+        In 'tile' mode that is decided by where the place is: inside the shard
+        tile (start_bounds) the search started from. Search circles overlap
+        their neighbours, so a place near an edge is also returned to the
+        shard next door, which skips it. A place outside the city's root tile
+        (root_bounds) counts as being at the nearest point of it.
+        """
+        if self.mode == 'hash':
+            return shard_of(place_id, self.count) == self.index
+        if self.mode == 'tile':
+            if location is None or location.get('lat') is None or location.get('lng') is None or start_bounds is None:
+                return False
+            if root_bounds is not None:
+                location = clamp_to_bounds(location, root_bounds)
+            return point_in_bounds(location, start_bounds)
+        return True
+
+    def owns_stored_place(self, place_id, city_name, location, city_roots):
+        """
+        Whether this shard resumes a place recorded in the run state. city_roots
+        maps city names to their root tile bounds. Places whose city or
+        location is unknown are split by place_id hash, so exactly one shard
+        resumes each of them.
+        """
+        if self.mode == 'city' and city_name in city_roots:
+            return self.owns_city(city_roots, city_name)
+        if self.mode == 'tile' and location is not None and city_name in city_roots:
+            if location.get('lat') is not None and location.get('lng') is not None:
+                location = clamp_to_bounds(location, city_roots[city_name]) # As owns_place does
+            for quadkey in quadkeys_at_depth(self.tile_depth):
+                if point_in_bounds(location, tiling.bounds_for_quadkey(city_roots[city_name], quadkey)):
+                    return shard_of(f"{city_name}|{quadkey}", self.count) == self.index
+        return shard_of(place_id, self.count) == self.index
+
+
+def shard_directories(shards_dir):
+    """Shard output directories under shards_dir, in name order."""
+    if not os.path.isdir(shards_dir):
+        return []
+    return [
+        os.path.join(shards_dir, name) for name in sorted(os.listdir(shards_dir))
+        if os.path.isdir(os.path.join(shards_dir, name))
+    ]
@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules live at the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.py creates its data directory on import; keep it out of the working tree
+os.environ.setdefault('RENDER_DISK_MOUNT_PATH', tempfile.mkdtemp(prefix='leads-test-'))
+
+
+def make_lead(index, city='New Haven', **fields):
+    lead = {
+        'place_id': f'place-{index:03d}',
+        'name': f'Business {index}',
+        'address': f'{index} Chapel St',
+        'city': city,
+        'status': 'New',
+        'notes': '',
+        'follow_up': False,
+        'version': 1,
+    }
+    lead.update(fields)
+    return lead
+
+
+@pytest.fixture
+def leads_file(tmp_path, monkeypatch):
+    """
+    Points the JSON backend at a file of 30 leads in two cities and returns
+    its path. Leads are 0.001 degrees of latitude apart along a meridian,
+    except every tenth (place-009, place-019, ...), which has no location.
+    """
+    import app
+
+    path = tmp_path / 'leads.json'
+    leads = [
+        make_lead(index, city='New Haven' if index % 3 else 'Hartford',
+                  **({'lat': 41.3 + index * 0.001, 'lng': -72.92} if index % 10 != 9 else {}))
+        for index in range(30)
+    ]
+    path.write_text(json.dumps(leads), encoding='utf-8')
+    monkeypatch.setattr(app, 'JSON_FILE_ON_DISK', str(path))
+    monkeypatch.setattr(app, 'INITIAL_JSON_FILE', str(tmp_path / 'missing.json'))
+    return str(path)
+
+
+@pytest.fixture
+def repository(leads_file, monkeypatch):
+    """The app's lead repository, on leads_file, with edits only written by an explicit flush."""
+    import app
+
+    repository = app.LeadRepository(app.JsonFileBackend(leads_file), flush_delay=3600)
+    monkeypatch.setattr(app, 'lead_repository', repository)
+    yield repository
+    with repository.lock:
+        if repository.flush_timer is not None:
+            repository.flush_timer.cancel()
+
+
+@pytest.fixture
+def client(repository):
+    import app
+
+    return app.app.test_client()
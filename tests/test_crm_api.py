@@ -0,0 +1,220 @@
+import json
+
+import pytest
+
+import app
+
+
+def patch(client, place_id, fields, version):
+    return client.patch(f'/leads/{place_id}', json=fields, headers={'If-Match': f'"{version}"'})
+
+
+def disk_leads(path):
+    with open(path, encoding='utf-8') as f:
+        return {lead['place_id']: lead for lead in json.load(f)}
+
+
+# --- ETags and versioned edits ---
+
+def test_get_lead_returns_its_version_as_etag(client):
+    response = client.get('/leads/place-001')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"1"'
+    assert response.get_json()['lead']['name'] == 'Business 1'
+    assert client.get('/leads/nope').status_code == 404
+
+
+def test_patch_needs_if_match_and_bumps_the_version(client):
+    assert client.patch('/leads/place-001', json={'status': 'Contacted'}).status_code == 428
+
+    response = patch(client, 'place-001', {'status': 'Contacted', 'notes': 'Call back Monday'}, 1)
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
+    lead = response.get_json()['lead']
+    assert (lead['status'], lead['notes'], lead['version']) == ('Contacted', 'Call back Monday', 2)
+
+    stale = patch(client, 'place-001', {'status': 'Qualified'}, 1)
+    assert stale.status_code == 412
+    assert stale.get_json()['lead']['status'] == 'Contacted'
+
+
+@pytest.mark.parametrize('fields', [
+    {'status': 'Bogus'},
+    {'status': None},
+    {'notes': 42},
+    {'follow_up': 'yes'},
+    {'name': 'Renamed'},
+    {},
+])
+def test_patch_rejects_invalid_values_without_changing_the_lead(client, repository, fields):
+    response = patch(client, 'place-002', fields, 1)
+    assert response.status_code == 400
+    lead = client.get('/leads/place-002').get_json()['lead']
+    assert (lead['status'], lead['notes'], lead['follow_up'], lead['version']) == ('New', '', False, 1)
+    assert repository.pending_edits == 0
+    assert repository.by_status['New'][0]['place_id'] == 'place-000'
+
+
+def test_legacy_update_rejects_invalid_values(client):
+    response = client.post('/update_lead', json={'city': 'Hartford', 'index': 0, 'field': 'status', 'value': 'Bogus'})
+    assert response.status_code == 400
+    response = client.post('/update_lead', json={'city': 'Hartford', 'index': 0, 'field': 'status', 'value': 'Qualified'})
+    assert response.status_code == 200
+    assert client.get('/leads/place-000').get_json()['lead']['status'] == 'Qualified'
+
+
+def test_delete_needs_the_current_version(client):
+    assert client.delete('/leads/place-004', headers={'If-Match': '"7"'}).status_code == 412
+    assert client.delete('/leads/place-004', headers={'If-Match': '"1"'}).status_code == 200
+    assert client.get('/leads/place-004').status_code == 404
+
+
+# --- Bulk updates ---
+
+def test_bulk_update_applies_every_edit(client):
+    response = client.post('/leads/bulk_update', json={'updates': [
+        {'place_id': 'place-001', 'version': 1, 'fields': {'status': 'Contacted'}},
+        {'place_id': 'place-002', 'version': 1, 'fields': {'follow_up': True}},
+    ]})
+    assert response.status_code == 200
+    assert response.get_json()['versions'] == {'place-001': 2, 'place-002': 2}
+    assert client.get('/leads/place-002').get_json()['lead']['follow_up'] is True
+
+
+def test_bulk_update_is_all_or_nothing(client):
+    patch(client, 'place-002', {'notes': 'edited'}, 1)
+    response = client.post('/leads/bulk_update', json={'updates': [
+        {'place_id': 'place-001', 'version': 1, 'fields': {'status': 'Contacted'}},
+        {'place_id': 'place-002', 'version': 1, 'fields': {'status': 'Contacted'}},
+        {'place_id': 'missing', 'version': 1, 'fields': {'status': 'Contacted'}},
+    ]})
+    assert response.status_code == 412
+    assert {conflict['place_id']: conflict['reason'] for conflict in response.get_json()['conflicts']} == {
+        'place-002': 'stale version', 'missing': 'not found',
+    }
+    assert client.get('/leads/place-001').get_json()['lead']['status'] == 'New'
+
+    invalid = client.post('/leads/bulk_update', json={'updates': [
+        {'place_id': 'place-001', 'version': 1, 'fields': {'status': 'Bogus'}},
+    ]})
+    assert invalid.status_code == 400
+
+
+# --- Listing ---
+
+def test_cursor_pages_through_every_lead_once(client):
+    seen = []
+    cursor = None
+    while True:
+        response = client.get('/api/leads', query_string={'limit': 7, **({'cursor': cursor} if cursor else {})})
+        body = response.get_json()
+        seen.extend(lead['place_id'] for lead in body['leads'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [f'place-{index:03d}' for index in range(30)]
+
+
+def test_cursor_survives_deleting_the_lead_it_names(client, repository):
+    first = client.get('/api/leads', query_string={'limit': 5}).get_json()
+    repository.delete(repository.get('place-004'))
+    second = client.get('/api/leads', query_string={'limit': 5, 'cursor': first['next_cursor']}).get_json()
+    assert [lead['place_id'] for lead in second['leads']] == [f'place-{index:03d}' for index in range(5, 10)]
+
+
+def test_filters_and_invalid_queries(client):
+    patch(client, 'place-005', {'status': 'Contacted', 'notes': 'Wants a quote'}, 1)
+    hartford = client.get('/api/leads', query_string={'city': 'Hartford', 'limit': 100}).get_json()['leads']
+    assert [lead['place_id'] for lead in hartford] == [f'place-{index:03d}' for index in range(0, 30, 3)]
+    contacted = client.get('/api/leads', query_string={'status': 'Contacted'}).get_json()['leads']
+    assert [lead['place_id'] for lead in contacted] == ['place-005']
+    quoted = client.get('/api/leads', query_string={'q': 'QUOTE'}).get_json()['leads']
+    assert [lead['place_id'] for lead in quoted] == ['place-005']
+    assert client.get('/api/leads', query_string={'cursor': 'not-a-cursor'}).status_code == 400
+    assert client.get('/api/leads', query_string={'sort': 'name'}).status_code == 400
+
+
+# --- Geo queries ---
+
+def test_near_returns_the_closest_located_leads(client):
+    body = client.get('/api/leads/near', query_string={'lat': 41.3084, 'lng': -72.92, 'k': 3}).get_json()
+    assert [lead['place_id'] for lead in body['leads']] == ['place-008', 'place-007', 'place-010']
+    assert body['leads'][0]['distance_meters'] == pytest.approx(44, abs=1)
+    assert client.get('/api/leads/near', query_string={'lat': 95, 'lng': 0}).status_code == 400
+
+
+def test_within_counts_every_lead_in_the_box(client):
+    body = client.get('/api/leads/within', query_string={
+        'south': 41.3045, 'west': -72.93, 'north': 41.3125, 'east': -72.91, 'limit': 3,
+    }).get_json()
+    assert [lead['place_id'] for lead in body['leads']] == ['place-005', 'place-006', 'place-007']
+    assert body['total'] == 7 # place-005 to place-012, without place-009
+    assert client.get('/api/leads/within', query_string={
+        'south': 42, 'west': -73, 'north': 41, 'east': -72,
+    }).status_code == 400
+
+
+def test_route_visits_follow_ups_nearest_first(client):
+    for place_id in ('place-021', 'place-020', 'place-002', 'place-011', 'place-019'):
+        patch(client, place_id, {'follow_up': True}, 1)
+    body = client.get('/api/leads/route', query_string={'lat': 41.3, 'lng': -72.92}).get_json()
+    assert [stop['place_id'] for stop in body['stops']] == ['place-002', 'place-011', 'place-020', 'place-021']
+    assert body['total_meters'] == sum(stop['leg_meters'] for stop in body['stops'])
+    assert [lead['place_id'] for lead in body['unlocated']] == ['place-019']
+    hartford = client.get('/api/leads/route', query_string={'city': 'Hartford'}).get_json()
+    assert [stop['place_id'] for stop in hartford['stops']] == ['place-021']
+    new_haven = client.get('/api/leads/route', query_string={'city': 'New Haven'}).get_json()
+    assert [stop['place_id'] for stop in new_haven['stops']] == ['place-002', 'place-011', 'place-020']
+
+
+# --- Several workers on the JSON backend ---
+
+def test_stale_edit_from_another_worker_is_refused(client, repository, leads_file):
+    other = app.LeadRepository(app.JsonFileBackend(leads_file), flush_delay=3600)
+    other.refresh()
+    repository.refresh()
+    patch(client, 'place-003', {'notes': 'first worker'}, 1)
+
+    # The other worker still holds version 1 in memory
+    stale = other.by_id['place-003']
+    with pytest.raises(app.LeadConflict):
+        other.apply_updates([(stale, {'notes': 'second worker'})])
+    assert other.get('place-003')['notes'] == 'first worker'
+
+    # Through the routes, the same race is a 412 carrying the current lead
+    other.apply_updates([(other.get('place-003'), {'status': 'Qualified'})])
+    response = patch(client, 'place-003', {'notes': 'overwrite'}, 2)
+    assert response.status_code == 412
+    assert response.get_json()['lead']['status'] == 'Qualified'
+
+    assert repository.flush() and other.flush()
+    lead = disk_leads(leads_file)['place-003']
+    assert (lead['notes'], lead['status'], lead['version']) == ('first worker', 'Qualified', 3)
+
+
+def test_edit_after_another_worker_deleted_the_lead(client, repository, leads_file):
+    other = app.LeadRepository(app.JsonFileBackend(leads_file), flush_delay=3600)
+    other.refresh()
+    repository.refresh()
+    stale = repository.by_id['place-006']
+    other.delete(other.get('place-006'))
+    with pytest.raises(app.LeadConflict):
+        repository.apply_updates([(stale, {'notes': 'too late'})])
+    assert patch(client, 'place-006', {'notes': 'too late'}, 1).status_code == 404
+
+    assert repository.flush() and other.flush()
+    assert 'place-006' not in disk_leads(leads_file)
+
+
+def test_sqlite_backend_refuses_stale_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'JSON_FILE_ON_DISK', str(tmp_path / 'missing.json'))
+    backend = app.SqliteBackend(str(tmp_path / 'leads.sqlite3'))
+    backend.import_leads([{'place_id': 'p1', 'name': 'Cafe', 'city': 'A', 'status': 'New', 'notes': '', 'follow_up': False}])
+    first = app.LeadRepository(backend, flush_delay=0)
+    second = app.LeadRepository(app.SqliteBackend(backend.path), flush_delay=0)
+    first.refresh()
+    second.refresh()
+    first.apply_updates([(first.get('p1'), {'status': 'Contacted'})])
+    with pytest.raises(app.LeadConflict):
+        second.apply_updates([(second.by_id['p1'], {'status': 'Qualified'})])
+    assert second.get('p1')['status'] == 'Contacted'
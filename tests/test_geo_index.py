@@ -0,0 +1,68 @@
+import random
+
+from geo_index import GeoIndex
+from tiling import haversine_meters
+
+
+def brute_force_nearest(points, lat, lng, k, max_meters=None):
+    distances = sorted((haversine_meters(lat, lng, p_lat, p_lng), key) for key, (p_lat, p_lng) in points.items())
+    if max_meters is not None:
+        distances = [(distance, key) for distance, key in distances if distance <= max_meters]
+    return distances[:k]
+
+
+def build_index(points, cell_degrees=0.01):
+    index = GeoIndex(cell_degrees)
+    for key, (lat, lng) in points.items():
+        index.add(key, lat, lng, key)
+    return index
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(7)
+    points = {f'p{i}': (41.3 + rng.uniform(-0.2, 0.2), -72.9 + rng.uniform(-0.2, 0.2)) for i in range(500)}
+    index = build_index(points)
+    for _ in range(25):
+        lat, lng = 41.3 + rng.uniform(-0.3, 0.3), -72.9 + rng.uniform(-0.3, 0.3)
+        expected = brute_force_nearest(points, lat, lng, 10)
+        found = index.nearest(lat, lng, 10)
+        assert [item for _, item in found] == [key for _, key in expected]
+        assert [round(distance, 6) for distance, _ in found] == [round(distance, 6) for distance, _ in expected]
+
+
+def test_nearest_far_from_every_point_and_max_meters():
+    points = {'a': (41.30, -72.90), 'b': (41.31, -72.90), 'c': (40.71, -74.00)}
+    index = build_index(points)
+    # Hundreds of cells away from the nearest point: found through the block search
+    assert [item for _, item in index.nearest(45.0, -70.0, 2)] == [key for _, key in brute_force_nearest(points, 45.0, -70.0, 2)]
+    assert [item for _, item in index.nearest(41.30, -72.90, 3, max_meters=2000)] == ['a', 'b']
+    assert index.nearest(0.0, 0.0, 3, max_meters=1000) == []
+    assert index.nearest(41.30, -72.90, 0) == []
+
+
+def test_nearest_across_the_antimeridian():
+    index = build_index({'east': (0.0, 179.995), 'west': (0.0, -179.995), 'far': (0.0, 170.0)})
+    assert [item for _, item in index.nearest(0.0, -179.999, 2)] == ['west', 'east']
+
+
+def test_remove_and_readd():
+    index = build_index({'a': (41.30, -72.90), 'b': (41.31, -72.91)})
+    index.remove('a')
+    assert len(index) == 1
+    assert [item for _, item in index.nearest(41.30, -72.90, 5)] == ['b']
+    index.add('a', 42.0, -73.0, 'a')
+    assert index.within((41.9, -73.1, 42.1, -72.9)) == ['a']
+
+
+def test_within_box():
+    points = {f'p{i}': (41.0 + i * 0.01, -73.0 + i * 0.01) for i in range(50)}
+    index = build_index(points)
+    found = index.within((41.095, -72.905, 41.205, -72.795))
+    assert sorted(found) == sorted(f'p{i}' for i in range(10, 21))
+    # A box larger than the occupied cells walks the occupied cells instead
+    assert sorted(index.within((-90, -180, 90, 180))) == sorted(points)
+
+
+def test_within_box_crossing_the_antimeridian():
+    index = build_index({'east': (10.0, 179.5), 'west': (10.0, -179.5), 'middle': (10.0, 0.0)})
+    assert sorted(index.within((9.0, 179.0, 11.0, -179.0))) == ['east', 'west']
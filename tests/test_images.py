@@ -0,0 +1,70 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import app
+
+
+@pytest.fixture
+def images_client(tmp_path, monkeypatch):
+    images_dir = tmp_path / 'saved_images'
+    images_dir.mkdir()
+    Image.new('RGB', (800, 600), (200, 40, 40)).save(images_dir / 'place_heading_90.jpg', 'JPEG')
+    monkeypatch.setattr(app, 'SAVED_IMAGES_DIR', str(images_dir))
+    monkeypatch.setattr(app, 'RENDITIONS_DIR', str(tmp_path / 'renditions'))
+    return app.app.test_client()
+
+
+def test_original_is_served_with_an_etag_and_revalidates(images_client):
+    response = images_client.get('/images/place_heading_90.jpg')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == f'public, max-age={app.IMAGE_CACHE_MAX_AGE}'
+    etag = response.headers['ETag']
+
+    cached = images_client.get('/images/place_heading_90.jpg', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+
+def test_rendition_is_resized_and_cached(images_client):
+    response = images_client.get('/images/place_heading_90.jpg?size=thumb')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert 'Accept' in response.headers['Vary']
+    with Image.open(io.BytesIO(response.data)) as img:
+        assert img.size == (app.RENDITION_WIDTHS['thumb'], app.RENDITION_WIDTHS['thumb'] * 3 // 4)
+
+    renditions = [name for _, _, names in os.walk(app.RENDITIONS_DIR) for name in names]
+    assert len(renditions) == 1
+    images_client.get('/images/place_heading_90.jpg?size=thumb')
+    assert [name for _, _, names in os.walk(app.RENDITIONS_DIR) for name in names] == renditions
+
+    cached = images_client.get('/images/place_heading_90.jpg?size=thumb', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+
+def test_rendition_format_follows_accept(images_client):
+    jpeg = images_client.get('/images/place_heading_90.jpg?size=medium')
+    webp = images_client.get('/images/place_heading_90.jpg?size=medium', headers={'Accept': 'image/webp,*/*'})
+    assert webp.mimetype == 'image/webp'
+    assert webp.headers['ETag'] != jpeg.headers['ETag']
+    # A JPEG ETag does not revalidate the WebP rendition
+    assert images_client.get(
+        '/images/place_heading_90.jpg?size=medium', headers={'Accept': 'image/webp', 'If-None-Match': jpeg.headers['ETag']}
+    ).status_code == 200
+
+
+def test_replaced_source_gets_a_new_etag(images_client):
+    first = images_client.get('/images/place_heading_90.jpg?size=thumb').headers['ETag']
+    Image.new('RGB', (800, 600), (40, 40, 200)).save(os.path.join(app.SAVED_IMAGES_DIR, 'place_heading_90.jpg'), 'JPEG')
+    os.utime(os.path.join(app.SAVED_IMAGES_DIR, 'place_heading_90.jpg'), ns=(1, 1))
+    assert images_client.get('/images/place_heading_90.jpg?size=thumb').headers['ETag'] != first
+
+
+def test_invalid_image_requests(images_client):
+    assert images_client.get('/images/missing.jpg').status_code == 404
+    assert images_client.get('/images/missing.jpg?size=thumb').status_code == 404
+    assert images_client.get('/images/place_heading_90.jpg?size=huge').status_code == 400
+    assert images_client.get('/images/..%2Fsecret.jpg').status_code in (400, 404)
@@ -0,0 +1,113 @@
+import sqlite3
+
+import pytest
+
+import run_state
+from run_state import RunStateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RunStateStore(str(tmp_path / 'run_state.sqlite3'), batch_size=1000, flush_interval=3600)
+    yield store
+    store.close()
+
+
+def stored_row(store, place_id):
+    store.flush()
+    return store.conn.execute(
+        "SELECT city, name, status, details, error, attempts, pano_id FROM places WHERE place_id = ?", (place_id,)
+    ).fetchone()
+
+
+def test_mark_is_buffered_until_flush(store):
+    store.mark('p1', run_state.DISCOVERED, city='New Haven', name='Cafe')
+    assert store.status_of('p1') == run_state.DISCOVERED
+    assert store.conn.execute("SELECT COUNT(*) FROM places").fetchone()[0] == 0
+    store.flush()
+    assert store.conn.execute("SELECT COUNT(*) FROM places").fetchone()[0] == 1
+
+
+def test_upsert_keeps_earlier_values_and_counts_failures(store):
+    store.mark('p1', run_state.DISCOVERED, city='New Haven', name='Cafe')
+    store.flush()
+    store.mark('p1', run_state.DETAILED, details={'name': 'Cafe', 'geometry': {}})
+    store.flush()
+    store.mark('p1', run_state.FAILED, error='no imagery available')
+    store.flush()
+    store.mark('p1', run_state.FAILED, error='no imagery available')
+    city, name, status, details, error, attempts, _ = stored_row(store, 'p1')
+    assert (city, name, status, error, attempts) == ('New Haven', 'Cafe', run_state.FAILED, 'no imagery available', 2)
+    assert details == '{"name": "Cafe", "geometry": {}}'
+
+
+def test_resumable_and_rescannable(store):
+    store.mark('new', run_state.DISCOVERED, city='A')
+    store.mark('detailed', run_state.DETAILED, city='A', details={'name': 'D'})
+    store.mark('failed', run_state.FAILED, city='A', error='x')
+    store.mark('done', run_state.CLASSIFIED, city='A', pano_id='pano-1', pano_date='2024-05')
+    store.mark('lead', run_state.LEAD, city='A')
+    assert [row['place_id'] for row in store.resumable()] == ['new', 'detailed']
+    assert [row['place_id'] for row in store.resumable(include_failed=True)] == ['new', 'detailed', 'failed']
+    assert next(row for row in store.resumable() if row['place_id'] == 'detailed')['details'] == {'name': 'D'}
+    assert [(row['place_id'], row['pano_id']) for row in store.rescannable()] == [('done', 'pano-1')]
+
+
+def test_tile_status_since(store):
+    store.mark_tile('A|cafe|', run_state.TILE_SPLIT, 60)
+    store.flush()
+    assert store.tile_status('A|cafe|') == run_state.TILE_SPLIT
+    assert store.tile_status('A|cafe|0') is None
+    assert store.tile_status('A|cafe|', since=float('inf')) is None
+
+
+def test_import_legacy_log(store, tmp_path):
+    log = tmp_path / 'processed_places.txt'
+    log.write_text('p1\np2\n\np3\n')
+    assert store.import_legacy_log(str(log), lead_place_ids={'p2'}) == 3
+    assert store.counts() == {run_state.CLASSIFIED: 2, run_state.LEAD: 1}
+    assert stored_row(store, 'p1')[-1] is None # No panorama recorded: a re-scan only records a baseline
+
+
+def test_merge_from_never_unfinishes_a_place(store, tmp_path):
+    store.mark('p1', run_state.LEAD, city='A')
+    store.mark('p2', run_state.DISCOVERED, city='A')
+    store.mark('p3', run_state.CLASSIFIED, city='A')
+    store.mark_tile('A|cafe|', run_state.TILE_DONE, 12)
+    store.flush()
+
+    shard = RunStateStore(str(tmp_path / 'shard.sqlite3'))
+    shard.mark('p1', run_state.DISCOVERED, city='A') # Stale copy seeded before p1 finished
+    shard.mark('p2', run_state.CLASSIFIED, name='Bakery', pano_id='pano-2')
+    shard.mark('p4', run_state.DETAILED, city='B', details={'name': 'New'})
+    shard.mark_tile('B|cafe|', run_state.TILE_SPLIT, 60)
+    shard.close()
+
+    assert store.merge_from(str(tmp_path / 'shard.sqlite3')) == 3
+    assert store.status_of('p1') == run_state.LEAD
+    assert store.status_of('p2') == run_state.CLASSIFIED
+    assert stored_row(store, 'p2')[:2] == ('A', 'Bakery')
+    assert stored_row(store, 'p2')[-1] == 'pano-2'
+    assert store.status_of('p3') == run_state.CLASSIFIED
+    assert store.status_of('p4') == run_state.DETAILED
+    assert store.tile_status('B|cafe|') == run_state.TILE_SPLIT
+
+    # Merging the same shard again changes nothing
+    before = store.conn.execute("SELECT * FROM places ORDER BY place_id").fetchall()
+    store.merge_from(str(tmp_path / 'shard.sqlite3'))
+    assert store.conn.execute("SELECT * FROM places ORDER BY place_id").fetchall() == before
+
+
+def test_opening_an_older_store_adds_the_pano_columns(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE places (place_id TEXT PRIMARY KEY, city TEXT, name TEXT, status TEXT NOT NULL, details TEXT, "
+        "error TEXT, attempts INTEGER NOT NULL DEFAULT 0, discovered_at REAL NOT NULL, updated_at REAL NOT NULL);"
+        "INSERT INTO places VALUES ('p1', 'A', 'Cafe', 'classified', NULL, NULL, 0, 1, 1);"
+    )
+    conn.commit()
+    conn.close()
+    store = RunStateStore(path)
+    assert [row['pano_id'] for row in store.rescannable()] == [None]
+    store.close()
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+import tiling
+from sharding import Shard, clamp_to_bounds, point_in_bounds, quadkeys_at_depth, shard_of
+
+ROOT = tiling.root_bounds((41.3083, -72.9279), 5000)
+CITY_ROOTS = {'New Haven': ROOT}
+
+
+def random_locations(count, margin=0.05, seed=1):
+    rng = random.Random(seed)
+    south, west, north, east = ROOT
+    return [
+        (f'place-{index}', {'lat': rng.uniform(south - margin, north + margin), 'lng': rng.uniform(west - margin, east + margin)})
+        for index in range(count)
+    ]
+
+
+def test_parse_and_name():
+    shard = Shard.parse('1/4', 'tile')
+    assert (shard.index, shard.count, shard.mode) == (1, 4, 'tile')
+    assert shard.name == 'tile-01-of-04'
+    for spec in ('4/4', '1', 'a/b'):
+        with pytest.raises(ValueError):
+            Shard.parse(spec, 'hash')
+    with pytest.raises(ValueError):
+        Shard(0, 2, 'street')
+
+
+def test_shard_of_is_stable():
+    assert shard_of('ChIJa0gEhDTY54kR-kUbCu9eH3k', 8) == shard_of('ChIJa0gEhDTY54kR-kUbCu9eH3k', 8)
+    assert {shard_of(f'place-{index}', 4) for index in range(100)} == {0, 1, 2, 3}
+
+
+def test_point_in_bounds_edges_and_clamp():
+    bounds = (0.0, 0.0, 1.0, 1.0)
+    assert point_in_bounds({'lat': 0.0, 'lng': 0.0}, bounds)
+    assert not point_in_bounds({'lat': 1.0, 'lng': 0.5}, bounds)
+    assert not point_in_bounds({'lat': None, 'lng': 0.5}, bounds)
+    assert point_in_bounds(clamp_to_bounds({'lat': 5.0, 'lng': -3.0}, bounds), bounds)
+
+
+def test_hash_mode_gives_each_place_to_one_shard():
+    shards = [Shard(index, 4, 'hash') for index in range(4)]
+    for place_id, location in random_locations(500):
+        assert sum(shard.owns_place(place_id, location) for shard in shards) == 1
+        assert sum(shard.owns_stored_place(place_id, 'New Haven', location, CITY_ROOTS) for shard in shards) == 1
+
+
+def test_city_mode_round_robins_sorted_cities():
+    cities = {'Hartford': None, 'New Haven': None, 'Stamford': None}
+    shards = [Shard(index, 2, 'city') for index in range(2)]
+    assert [shard.owns_city(cities, 'Hartford') for shard in shards] == [True, False]
+    assert [shard.owns_city(cities, 'New Haven') for shard in shards] == [False, True]
+    assert [shard.owns_city(cities, 'Stamford') for shard in shards] == [True, False]
+
+
+def test_tile_mode_start_quadkeys_partition_the_city():
+    shards = [Shard(index, 3, 'tile', tile_depth=2) for index in range(3)]
+    start = [quadkey for shard in shards for quadkey in shard.start_quadkeys('New Haven')]
+    assert sorted(start) == sorted(quadkeys_at_depth(2))
+
+
+def test_tile_mode_ownership_including_places_outside_the_root():
+    shards = [Shard(index, 4, 'tile', tile_depth=2) for index in range(4)]
+    for place_id, location in random_locations(2000):
+        # Every shard's search may return the place; exactly one keeps it
+        owners = [
+            shard.index for shard in shards for quadkey in shard.start_quadkeys('New Haven')
+            if shard.owns_place(place_id, location, tiling.bounds_for_quadkey(ROOT, quadkey), ROOT)
+        ]
+        assert len(owners) == 1, (place_id, location, owners)
+        # A resumed place goes back to the shard that found it
+        resumers = [shard.index for shard in shards if shard.owns_stored_place(place_id, 'New Haven', location, CITY_ROOTS)]
+        assert resumers == owners
+
+
+def test_tile_mode_splits_unlocated_places_by_hash():
+    shards = [Shard(index, 4, 'tile') for index in range(4)]
+    assert not any(shard.owns_place('place-1', None, ROOT, ROOT) for shard in shards)
+    assert sum(shard.owns_stored_place('place-1', 'Elsewhere', None, CITY_ROOTS) for shard in shards) == 1
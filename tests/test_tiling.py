@@ -0,0 +1,54 @@
+import pytest
+
+import tiling
+
+ROOT = tiling.root_bounds((41.3083, -72.9279), 5000)
+
+
+def test_root_bounds_is_a_square_around_the_center():
+    south, west, north, east = ROOT
+    assert tiling.tile_center(ROOT) == pytest.approx((41.3083, -72.9279))
+    assert tiling.haversine_meters(south, -72.9279, north, -72.9279) == pytest.approx(10000, rel=1e-6)
+    assert tiling.haversine_meters(41.3083, west, 41.3083, east) == pytest.approx(10000, rel=1e-3)
+
+
+def test_quadrants_split_a_tile_into_four():
+    south, west, north, east = ROOT
+    mid_lat, mid_lng = (south + north) / 2, (west + east) / 2
+    assert tiling.quadrant(ROOT, '0') == (south, west, mid_lat, mid_lng)
+    assert tiling.quadrant(ROOT, '1') == (south, mid_lng, mid_lat, east)
+    assert tiling.quadrant(ROOT, '2') == (mid_lat, west, north, mid_lng)
+    assert tiling.quadrant(ROOT, '3') == (mid_lat, mid_lng, north, east)
+
+
+def test_child_quadkeys_and_bounds():
+    assert tiling.child_quadkeys('') == ['0', '1', '2', '3']
+    assert tiling.child_quadkeys('21') == ['210', '211', '212', '213']
+    assert tiling.bounds_for_quadkey(ROOT, '') == ROOT
+    assert tiling.bounds_for_quadkey(ROOT, '21') == tiling.quadrant(tiling.quadrant(ROOT, '2'), '1')
+
+
+def test_children_cover_their_parent_exactly():
+    parent = tiling.bounds_for_quadkey(ROOT, '3')
+    children = [tiling.bounds_for_quadkey(ROOT, quadkey) for quadkey in tiling.child_quadkeys('3')]
+    area = sum((north - south) * (east - west) for south, west, north, east in children)
+    assert area == pytest.approx((parent[2] - parent[0]) * (parent[3] - parent[1]))
+    assert min(child[0] for child in children) == parent[0]
+    assert max(child[2] for child in children) == parent[2]
+    assert min(child[1] for child in children) == parent[1]
+    assert max(child[3] for child in children) == parent[3]
+
+
+def test_search_radius_covers_the_tile_and_halves_per_level():
+    bounds = tiling.bounds_for_quadkey(ROOT, '03')
+    radius = tiling.tile_search_radius(bounds)
+    lat, lng = tiling.tile_center(bounds)
+    south, west, north, east = bounds
+    for corner in ((south, west), (south, east), (north, west), (north, east)):
+        assert tiling.haversine_meters(lat, lng, *corner) <= radius + 1e-6
+    child_radius = tiling.tile_search_radius(tiling.bounds_for_quadkey(ROOT, '030'))
+    assert child_radius == pytest.approx(radius / 2, rel=1e-3)
+
+
+def test_tile_id():
+    assert tiling.tile_id('New Haven', 'restaurant', '012') == 'New Haven|restaurant|012'
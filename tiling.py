@@ -0,0 +1,69 @@
+import math
+
+# --- Quadtree Tiling for Places Discovery ---
+# Nearby Search returns at most 60 results (3 pages of 20) per query, so one
+# big circle per city silently drops places in dense areas. Instead, each
+# city is covered by a square root tile that is searched with the circle
+# circumscribing it. A tile whose search comes back saturated is split into
+# four quadrants, recursively, so sparse areas cost one query and dense
+# downtowns are subdivided until every tile is below the cap.
+#
+# Tiles are addressed by a quadkey: the root is "", its quadrants are "0"
+# (south-west), "1" (south-east), "2" (north-west) and "3" (north-east), their
+# quadrants "00".."33", and so on. Bounds are (south, west, north, east).
+
+EARTH_RADIUS_METERS = 6371000.0
+
+
+def haversine_meters(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def root_bounds(center, half_side_meters):
+    """Square tile centered on (lat, lng) whose sides are 2 * half_side_meters long."""
+    lat, lng = center
+    d_lat = math.degrees(half_side_meters / EARTH_RADIUS_METERS)
+    d_lng = math.degrees(half_side_meters / (EARTH_RADIUS_METERS * math.cos(math.radians(lat))))
+    return (lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng)
+
+
+def quadrant(bounds, digit):
+    """Bounds of quadrant `digit` ('0'-'3') of a tile."""
+    south, west, north, east = bounds
+    mid_lat, mid_lng = (south + north) / 2, (west + east) / 2
+    index = int(digit)
+    lat_range = (mid_lat, north) if index >= 2 else (south, mid_lat)
+    lng_range = (mid_lng, east) if index % 2 else (west, mid_lng)
+    return (lat_range[0], lng_range[0], lat_range[1], lng_range[1])
+
+
+def bounds_for_quadkey(root, quadkey):
+    bounds = root
+    for digit in quadkey:
+        bounds = quadrant(bounds, digit)
+    return bounds
+
+
+def child_quadkeys(quadkey):
+    return [quadkey + digit for digit in "0123"]
+
+
+def tile_center(bounds):
+    south, west, north, east = bounds
+    return ((south + north) / 2, (west + east) / 2)
+
+
+def tile_search_radius(bounds):
+    """Radius in meters of the circle around the tile center that covers the whole tile."""
+    south, west, north, east = bounds
+    lat, lng = tile_center(bounds)
+    return max(haversine_meters(lat, lng, corner_lat, corner_lng) for corner_lat in (south, north) for corner_lng in (west, east))
+
+
+def tile_id(city, business_type, quadkey):
+    """Key under which a tile's search is recorded in the run-state store."""
+    return f"{city}|{business_type}|{quadkey}"
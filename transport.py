@@ -0,0 +1,193 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# --- Shared HTTP Transport ---
+# Every outbound Google request goes through one requests.Session, whose
+# keep-alive connection pool is sized to the crawl's concurrency, so a request
+# reuses a warm TLS connection to maps.googleapis.com instead of opening a new
+# one. The googlemaps client is given the same session.
+#
+# Transient failures (connection errors, timeouts, HTTP 5xx) are retried with
+# jittered exponential backoff; these are idempotent GETs. Rate limiting and
+# OVER_QUERY_LIMIT/429 stay with rate_limiter.py, which wraps these calls.
+#
+# Each upstream (e.g. 'streetview', 'places') has a circuit breaker: after
+# `failure_threshold` failed attempts in a row it opens and rejects calls at
+# once for `reset_seconds`, then lets a single trial call through (half-open)
+# and closes again if that succeeds. Failures that outlast the retries, and
+# rejected calls, raise TransportError, so a caller can defer its work to a
+# later run instead of mistaking an outage for "no imagery".
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class TransportError(Exception):
+    """An upstream stayed unreachable (or kept failing) through every retry."""
+
+
+class CircuitOpen(TransportError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Thread-safe closed -> open -> half-open breaker for one upstream."""
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    def before_call(self):
+        """Raises CircuitOpen if the call may not go ahead."""
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self.trial_running):
+                self.trial_running = self.state == HALF_OPEN
+                return
+            self.stats['rejected'] += 1
+        raise CircuitOpen(f"circuit for {self.name} is open")
+
+    def on_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed again.", self.name)
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.trial_running = False
+
+    def on_failure(self, error):
+        with self.lock:
+            self.consecutive_failures += 1
+            reopen = self.state == HALF_OPEN
+            self.trial_running = False
+            if not reopen and (self.state == OPEN or self.consecutive_failures < self.failure_threshold):
+                return
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.stats['opened'] += 1
+        logger.warning("Circuit for %s opened after %d failures in a row (last: %s); calls are rejected for %.0fs.",
+                       self.name, self.consecutive_failures, error, self.reset_seconds)
+
+
+class Transport:
+    """
+    Pooled, retrying HTTP GETs with a circuit breaker per upstream.
+
+    Args:
+        pool_size: Keep-alive connections kept per host; match the number of
+                   threads that make requests at once.
+        retries: Retries of a transient failure (so retries + 1 attempts).
+        backoff_seconds: Base of the exponential backoff between attempts...
+        backoff_max_seconds: ...capped here; each wait is drawn uniformly
+                             from zero to the capped value (full jitter).
+        failure_threshold: Failed attempts in a row that open a circuit.
+        reset_seconds: How long an open circuit rejects calls.
+    """
+
+    def __init__(self, pool_size=16, retries=3, backoff_seconds=0.5, backoff_max_seconds=8.0,
+                 failure_threshold=5, reset_seconds=30.0):
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.stats = {} # upstream -> {'calls', 'retries', 'failures'}
+
+    def breaker(self, upstream):
+        with self.lock:
+            if upstream not in self.breakers:
+                self.breakers[upstream] = CircuitBreaker(upstream, self.failure_threshold, self.reset_seconds)
+                self.stats[upstream] = {'calls': 0, 'retries': 0, 'failures': 0}
+            return self.breakers[upstream]
+
+    def _count(self, upstream, key):
+        with self.lock:
+            self.stats[upstream][key] += 1
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** attempt)))
+
+    def call(self, upstream, fn, transient_errors=(), is_transient=None):
+        """
+        Calls fn() under the upstream's circuit breaker, retrying it when it
+        raises one of transient_errors or when is_transient(result) is true.
+
+        Returns fn()'s result. Raises TransportError (CircuitOpen while the
+        circuit is open) once the retries are used up.
+        """
+        breaker = self.breaker(upstream)
+        self._count(upstream, 'calls')
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count(upstream, 'retries')
+                self._backoff(attempt - 1)
+            try:
+                breaker.before_call()
+            except CircuitOpen:
+                self._count(upstream, 'failures')
+                raise
+            try:
+                result = fn()
+            except transient_errors as e:
+                breaker.on_failure(e)
+                error = e
+                logger.debug("%s attempt %d failed: %s", upstream, attempt + 1, e)
+                continue
+            except Exception:
+                breaker.on_success() # The upstream answered; the error is about this request
+                raise
+            if is_transient is not None and is_transient(result):
+                error = f"HTTP {result.status_code}"
+                breaker.on_failure(error)
+                logger.debug("%s attempt %d failed: %s", upstream, attempt + 1, error)
+                result.close()
+                continue
+            breaker.on_success()
+            return result
+        self._count(upstream, 'failures')
+        raise TransportError(f"{upstream} failed {self.retries + 1} times; last error: {error}")
+
+    def get(self, upstream, url, params=None, timeout=15, stream=False):
+        """A GET through the shared session, retried on connection errors, timeouts and 5xx responses."""
+        return self.call(
+            upstream,
+            lambda: self.session.get(url, params=params, timeout=timeout, stream=stream),
+            transient_errors=(requests.ConnectionError, requests.Timeout),
+            is_transient=lambda response: response.status_code in RETRY_STATUS_CODES,
+        )
+
+    def summary_lines(self):
+        lines = []
+        with self.lock:
+            upstreams = sorted(self.breakers.items())
+        for upstream, breaker in upstreams:
+            s = self.stats[upstream]
+            lines.append(
+                f"  {upstream:<12} calls={s['calls']:<6} retries={s['retries']:<4} failed={s['failures']:<4} "
+                f"circuit={breaker.state} (opened {breaker.stats['opened']}x, rejected {breaker.stats['rejected']} calls)"
+            )
+        return lines
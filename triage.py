@@ -0,0 +1,120 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+# --- Pre-Vision Image Triage ---
+# Cheap CPU checks run on each place's images before they are queued for
+# Moondream. Each frame's decoded image is shared with vision (see
+# image_memory.py), so triage adds no decode of its own; a frame is rejected
+# if it is:
+#   placeholder      - a near-uniform tile, e.g. Google's grey "no imagery" image
+#   duplicate        - within a few bits (dHash) of a heading already kept for
+#                      the same place, so it cannot tell the model anything new
+#   low_information  - almost no edges and a narrow histogram (sky, blank wall,
+#                      empty road), which never shows a storefront awning
+# Thresholds are deliberately conservative: on the saved lead images the
+# weakest frame has ~2.5x the edge energy and ~1.3x the entropy of the limits.
+
+ANALYSIS_SIZE = (128, 96) # Grayscale size the statistics are computed on
+DHASH_SIZE = 8 # 8x8 difference hash = 64 bits
+
+
+def _grayscale(image):
+    # Downscale first: every statistic is computed at ANALYSIS_SIZE or smaller
+    return image.resize((ANALYSIS_SIZE[0] * 2, ANALYSIS_SIZE[1] * 2), Image.BILINEAR).convert('L')
+
+
+def dhash(gray_image, hash_size=DHASH_SIZE):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a (size+1)x(size) thumbnail."""
+    pixels = np.asarray(gray_image.resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def image_statistics(gray_image):
+    """Returns (std, mean gradient magnitude, histogram entropy in bits) of a grayscale image."""
+    pixels = np.asarray(gray_image.resize(ANALYSIS_SIZE, Image.BILINEAR), dtype=np.float32)
+    gradient = np.abs(np.diff(pixels, axis=1)).mean() + np.abs(np.diff(pixels, axis=0)).mean()
+    histogram = np.bincount((pixels // 8).astype(np.int64).ravel(), minlength=32) / pixels.size
+    histogram = histogram[histogram > 0]
+    entropy = float(-(histogram * np.log2(histogram)).sum())
+    return float(pixels.std()), float(gradient), entropy
+
+
+class ImageTriage:
+    """
+    Filters a place's (heading, frame) list before vision inference, where a
+    frame is an image_memory.Frame (anything whose image() returns the decoded
+    PIL image).
+
+    Args:
+        placeholder_max_std: Frames with a grayscale standard deviation below
+                             this are treated as placeholder tiles.
+        duplicate_max_distance: dHash Hamming distance at or below which a
+                                frame duplicates an already kept one.
+        min_gradient: Low-information frames have a mean gradient below this...
+        min_entropy: ...and a histogram entropy (bits) below this.
+    """
+
+    def __init__(self, placeholder_max_std=4.0, duplicate_max_distance=6, min_gradient=4.0, min_entropy=2.5):
+        self.placeholder_max_std = placeholder_max_std
+        self.duplicate_max_distance = duplicate_max_distance
+        self.min_gradient = min_gradient
+        self.min_entropy = min_entropy
+        self.lock = threading.Lock()
+        self.stats = {'images': 0, 'kept': 0, 'placeholder': 0, 'duplicate': 0, 'low_information': 0, 'undecodable': 0}
+
+    def classify(self, frame, kept_hashes):
+        """Returns (reason or None, dhash) for one frame, given the hashes of frames kept so far."""
+        try:
+            gray = _grayscale(frame.image())
+            std, gradient, entropy = image_statistics(gray)
+            frame_hash = dhash(gray)
+        except Exception:
+            # Let vision see anything we cannot decode here rather than risk losing a lead
+            return 'undecodable', None
+        if std < self.placeholder_max_std:
+            return 'placeholder', frame_hash
+        if gradient < self.min_gradient and entropy < self.min_entropy:
+            return 'low_information', frame_hash
+        if any(hamming_distance(frame_hash, kept) <= self.duplicate_max_distance for kept in kept_hashes):
+            return 'duplicate', frame_hash
+        return None, frame_hash
+
+    def filter(self, images):
+        """
+        Returns (kept images, {reason: count of rejected images}) for one
+        place's [(heading, frame)], preserving order.
+        """
+        kept, kept_hashes, rejected = [], [], {}
+        for heading, frame in images:
+            reason, frame_hash = self.classify(frame, kept_hashes)
+            if reason is None or reason == 'undecodable':
+                kept.append((heading, frame))
+                if frame_hash is not None:
+                    kept_hashes.append(frame_hash)
+            else:
+                rejected[reason] = rejected.get(reason, 0) + 1
+            with self.lock:
+                self.stats['images'] += 1
+                if reason in (None, 'undecodable'):
+                    self.stats['kept'] += 1
+                if reason is not None:
+                    self.stats[reason] += 1
+        return kept, rejected
+
+    def inference_calls_saved(self):
+        return self.stats['images'] - self.stats['kept']
+
+    def summary_line(self):
+        s = self.stats
+        return (
+            f"Triage: {s['images']} images, {s['kept']} sent to vision; skipped {self.inference_calls_saved()} inference calls "
+            f"(placeholder={s['placeholder']} duplicate={s['duplicate']} low_information={s['low_information']}); "
+            f"{s['undecodable']} undecodable passed through"
+        )
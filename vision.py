@@ -0,0 +1,125 @@
+import asyncio
+
+# --- Micro-batched Vision Inference ---
+# Pipeline workers submit images one at a time; a single batching loop groups
+# them (across headings and across places) into micro-batches capped by size
+# and by how long the first image may wait. Each batch is handed to a blocking
+# batch function in one thread hop, which is where per-call overhead is paid
+# once instead of once per image.
+#
+# Waiting only pays off when the backend really serves a batch in one call.
+# When batch_fn just spreads the images over single-image queries, pass
+# max_wait_ms=0: a batch then takes whatever is already queued and goes at
+# once, so no image is held back waiting for company.
+
+
+class VisionBatcher:
+    """
+    Groups image classification requests into micro-batches.
+
+    Args:
+        batch_fn: Blocking callable taking a list of image payloads and returning
+                  a list of verdicts in the same order.
+        max_batch_size: Maximum number of images per batch.
+        max_wait_ms: Maximum time the first image of a batch waits for others;
+                     0 sends what is already queued without waiting.
+        max_inflight_batches: Number of batches that may run at the same time.
+        is_positive: Called with a verdict; True stops classify_place early.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=50, max_inflight_batches=1, is_positive=bool):
+        self.batch_fn = batch_fn
+        self.is_positive = is_positive
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.inflight = asyncio.Semaphore(max_inflight_batches)
+        self.queue = asyncio.Queue()
+        self.dispatch_tasks = set()
+        self.loop_task = None
+        self.stats = {'images': 0, 'batches': 0, 'skipped_early_exit': 0}
+
+    def start(self):
+        self.loop_task = asyncio.create_task(self._batch_loop())
+
+    async def close(self):
+        """Flushes queued images and waits for running batches to finish."""
+        await self.queue.put(None)
+        await self.loop_task
+        if self.dispatch_tasks:
+            await asyncio.gather(*self.dispatch_tasks)
+
+    async def classify(self, image):
+        """Queues a single image and waits for its verdict."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((future, image))
+        return await future
+
+    async def classify_place(self, images, early_exit=True):
+        """
+        Classifies all (heading, image) pairs of one place.
+
+        With early_exit, headings are submitted one after another and the
+        remaining ones are skipped after the first positive verdict; batches
+        still fill up with images from other places in flight. Without it, all
+        headings are submitted at once.
+
+        Returns:
+            List of (heading, image, verdict) for every image that was analyzed.
+        """
+        if not early_exit:
+            verdicts = await asyncio.gather(*(self.classify(image) for _, image in images))
+            return [(heading, image, verdict) for (heading, image), verdict in zip(images, verdicts)]
+
+        results = []
+        for i, (heading, image) in enumerate(images):
+            verdict = await self.classify(image)
+            results.append((heading, image, verdict))
+            if self.is_positive(verdict):
+                self.stats['skipped_early_exit'] += len(images) - i - 1
+                break
+        return results
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0:
+                        item = self.queue.get_nowait() # Past the deadline, take only what is waiting
+                    else:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+
+            await self.inflight.acquire()
+            task = asyncio.create_task(self._dispatch(batch))
+            self.dispatch_tasks.add(task)
+            task.add_done_callback(self.dispatch_tasks.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            self.stats['batches'] += 1
+            self.stats['images'] += len(batch)
+            try:
+                verdicts = await asyncio.to_thread(self.batch_fn, [image for _, image in batch])
+            except Exception as e:
+                for future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (future, _), verdict in zip(batch, verdicts):
+                if not future.done():
+                    future.set_result(verdict)
+        finally:
+            self.inflight.release()
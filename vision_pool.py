@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# --- Vision Replica Pool ---
+# Moondream queries are spread over several replicas: Moondream servers and/or
+# a model run in this process by the library's local (Photon) engine, which
+# batches the queries it is given at once. Every query goes to the healthy
+# replica with the fewest queries in flight.
+#
+# A replica that fails with a connection error is taken out of rotation at
+# once, and the queries that failed on it are retried on the others. Any other
+# error is about the query (e.g. an image the model cannot read): it is raised
+# to the caller straight away and says nothing about the replica's health.
+# A background thread probes a replica that is down with a tiny image, backing
+# off between probes, and puts it back once it answers. Only while every
+# replica is down do queries wait, and only for unavailable_wait seconds from
+# the start of the outage. After that they fail at once, so their places are
+# deferred to the next run instead of the crawl stalling on each one.
+
+PROBE_PROMPT = "Is this image blank? Answer YES or NO."
+PROBE_IMAGE_SIZE = (64, 48)
+
+
+class VisionUnavailable(Exception):
+    """Raised when no vision replica is healthy."""
+
+
+def is_connection_error(error):
+    """Errors that mean the replica itself is gone, not that one query went wrong."""
+    if isinstance(error, OSError): # Includes ConnectionError, TimeoutError and requests' errors
+        return True
+    message = str(error).lower()
+    return "connection" in message or "timed out" in message
+
+
+class Replica:
+    """
+    One Moondream client: a server endpoint or an in-process model.
+
+    Args:
+        name: Shown in logs and metrics.
+        client_factory: Returns a client with query(image, prompt) -> {'answer': ...};
+                        called again after the replica was down.
+        concurrency: Queries this replica is given at once.
+    """
+
+    def __init__(self, name, client_factory, concurrency=1):
+        self.name = name
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.client_lock = threading.Lock()
+        self.client = None
+        # Guarded by the pool's condition
+        self.in_flight = 0
+        self.healthy = True
+        self.next_probe = 0.0
+        self.probe_interval = 0.0
+        self.stats = {'queries': 0, 'failures': 0, 'downs': 0}
+
+    def query(self, image, prompt):
+        with self.client_lock:
+            if self.client is None:
+                self.client = self.client_factory()
+            client = self.client
+        return client.query(image, prompt)["answer"]
+
+    def reset(self):
+        """Drops the client, so the next query (or probe) connects afresh."""
+        with self.client_lock:
+            client, self.client = self.client, None
+        if client is not None and hasattr(client, 'close'):
+            client.close() # A local model's client holds its inference engine
+
+    def close(self):
+        self.reset()
+
+
+class VisionPool:
+    """
+    Least-loaded, health-checked dispatch of vision queries over replicas.
+
+    Args:
+        replicas: Replica objects.
+        max_attempts: Replicas a query is tried on (after connection errors)
+                      before its error is raised.
+        probe_interval: Seconds before a replica that is down is first probed;
+                        doubled after every failed probe...
+        max_probe_interval: ...up to this.
+        unavailable_wait: Seconds queries wait for a replica to recover once
+                          every replica is down.
+    """
+
+    def __init__(self, replicas, max_attempts=3, probe_interval=5.0,
+                 max_probe_interval=120.0, unavailable_wait=60.0):
+        if not replicas:
+            raise ValueError("A vision pool needs at least one replica")
+        self.replicas = list(replicas)
+        self.max_attempts = max_attempts
+        self.initial_probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+        self.unavailable_wait = unavailable_wait
+        self.condition = threading.Condition()
+        self.all_down_since = None
+        self.prober = None
+        self.closed = False
+
+    @property
+    def capacity(self):
+        """Queries the replicas are given at once in total."""
+        return sum(replica.concurrency for replica in self.replicas)
+
+    def healthy_count(self):
+        with self.condition:
+            return sum(1 for replica in self.replicas if replica.healthy)
+
+    def _acquire(self, tried):
+        """Picks the least-loaded healthy replica, preferring ones this query has not failed on."""
+        with self.condition:
+            while True:
+                healthy = [replica for replica in self.replicas if replica.healthy]
+                if healthy:
+                    candidates = [replica for replica in healthy if replica not in tried] or healthy
+                    replica = min(candidates, key=lambda r: (r.in_flight / r.concurrency, r.stats['queries']))
+                    replica.in_flight += 1
+                    replica.stats['queries'] += 1
+                    return replica
+                remaining = self.all_down_since + self.unavailable_wait - time.monotonic()
+                if remaining <= 0 or self.closed:
+                    raise VisionUnavailable(f"none of the {len(self.replicas)} vision replicas is healthy")
+                self.condition.wait(remaining)
+
+    def query(self, image, prompt):
+        """
+        Returns the answer text for one image, retrying on other replicas if
+        the one it was sent to cannot be reached. Raises VisionUnavailable if
+        every replica is down, the last connection error after max_attempts,
+        and any other error at once.
+        """
+        tried = set()
+        for attempt in range(1, self.max_attempts + 1):
+            replica = self._acquire(tried)
+            try:
+                answer = replica.query(image, prompt)
+            except Exception as e:
+                self._record_failure(replica, e)
+                if not is_connection_error(e):
+                    raise # The query failed, not the replica
+                tried.add(replica)
+                if attempt == self.max_attempts:
+                    raise
+                logger.debug("Vision replica %s failed (%s); requeueing the image.", replica.name, e)
+                continue
+            finally:
+                with self.condition:
+                    replica.in_flight -= 1
+            return answer
+
+    def _record_failure(self, replica, error):
+        """Counts a failed query; a connection error also takes the replica out of rotation."""
+        with self.condition:
+            replica.stats['failures'] += 1
+            if not replica.healthy or not is_connection_error(error):
+                return
+            replica.healthy = False
+            replica.stats['downs'] += 1
+            replica.probe_interval = self.initial_probe_interval
+            replica.next_probe = time.monotonic() + replica.probe_interval
+            healthy = sum(1 for r in self.replicas if r.healthy)
+            if not healthy:
+                self.all_down_since = time.monotonic()
+            if self.prober is None or not self.prober.is_alive():
+                self.prober = threading.Thread(target=self._probe_loop, name="vision-health", daemon=True)
+                self.prober.start()
+        replica.reset()
+        logger.warning("Vision replica %s is down (%s); %d of %d replicas healthy.",
+                       replica.name, error, healthy, len(self.replicas))
+        if not healthy:
+            logger.error("No vision replica is healthy; queries wait up to %.0fs for one to recover, "
+                         "then their places are deferred to the next run.", self.unavailable_wait)
+
+    def _probe_loop(self):
+        """Health-checks replicas that are down until all are back (or the pool is closed)."""
+        probe_image = Image.new('RGB', PROBE_IMAGE_SIZE, (128, 128, 128))
+        while True:
+            with self.condition:
+                down = [replica for replica in self.replicas if not replica.healthy]
+                if not down or self.closed:
+                    return
+                due = [replica for replica in down if replica.next_probe <= time.monotonic()]
+                if not due:
+                    self.condition.wait(min(replica.next_probe for replica in down) - time.monotonic())
+                    continue
+            for replica in due:
+                try:
+                    replica.query(probe_image, PROBE_PROMPT)
+                except Exception as e:
+                    replica.reset()
+                    with self.condition:
+                        replica.probe_interval = min(replica.probe_interval * 2, self.max_probe_interval)
+                        replica.next_probe = time.monotonic() + replica.probe_interval
+                    logger.debug("Vision replica %s still down (%s); next probe in %.0fs.",
+                                 replica.name, e, replica.probe_interval)
+                    continue
+                with self.condition:
+                    replica.healthy = True
+                    self.all_down_since = None
+                    self.condition.notify_all()
+                logger.info("Vision replica %s recovered.", replica.name)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for replica in self.replicas:
+            replica.close()
+
+    def summary_lines(self):
+        return [
+            f"  {replica.name:<28} queries={replica.stats['queries']:<6} failures={replica.stats['failures']:<4} "
+            f"went down {replica.stats['downs']}x{'' if replica.healthy else ' (down)'}"
+            for replica in self.replicas
+        ]